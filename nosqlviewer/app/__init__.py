@@ -1,16 +1,105 @@
 import os
-from flask import Flask, jsonify
+import time
+from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required
 from .routes.cassandra_routes import cassandra_routes
+from .routes.metrics_routes import TimedJSONProvider, metrics_routes
+from .services import compression, db, metrics, shards
+from .services.cassandra_schema import get_scheduler
+from .services.fuzzy import get_column_name_index
+from .services.jobs import recover_jobs
+from .services.migrations import migrate
+from .services.relations_graph import get_relations_graph
 from dotenv import load_dotenv
 
-load_dotenv()
+# Modules the first upload or Arrow export would otherwise import inside a request
+WARM_IMPORTS = ('pyarrow', 'pyarrow.compute', 'pyarrow.csv', 'pyarrow.json', 'pyarrow.parquet', 'zstandard')
+
+_worker_pid = None
+
+def compress_response(response):
+    """Compress a response body in the best encoding the client accepts. Streamed bodies are compressed
+    as they are produced; others only from compression.MIN_SIZE bytes. Responses that already carry a
+    Content-Encoding, such as cached catalog responses, are left alone."""
+    if not compression.compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compression.compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+        return compression.encoded(response, encoding)
+    data = response.get_data()
+    if len(data) < compression.MIN_SIZE:
+        return response
+    started = time.perf_counter()
+    response.set_data(compression.compress(data, encoding))
+    metrics.add_phase('compress', time.perf_counter() - started)
+    return compression.encoded(response, encoding)
+
+def warm_up(app):
+    """Do the work every serving process would otherwise repeat on its first requests: import the optional
+    codecs, load the column name and relations indexes and prime the catalog cache with the keyspaces,
+    their tables and the statistics.
+
+    With gunicorn --preload this runs once, in the master, and the workers inherit the result when they
+    fork (the fork handlers of each module keep the data and replace the locks). The master's database
+    connections are closed afterwards, so none is ever shared with a worker.
+    """
+    for module in WARM_IMPORTS:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    compression.available_encodings()
+    for db_file in [None] + [path for _, path in shards.shard_files()]:
+        get_column_name_index(db_file).refresh()
+    get_relations_graph()
+
+    # Dispatched without the request hooks: no snapshot to pin, and no worker to start in this process
+    def prime(path, **query_string):
+        with app.test_request_context(path, query_string=query_string):
+            return app.make_response(app.dispatch_request())
+
+    keyspaces = prime('/api/keyspace_names')
+    for keyspace_name in keyspaces.get_json() if keyspaces.status_code == 200 else ():
+        prime('/api/table_names', keyspace_name=keyspace_name)
+    prime('/api/stats')
+    db.close_connections()
+
+
+def start_worker():
+    """Start the background work of a serving process, once per process: the periodic schema sync, and the
+    recovery of ingestion jobs left behind by processes that exited (see recover_jobs).
+
+    Called by the gunicorn post_worker_init hook (see gunicorn.conf.py), and otherwise on the process's first
+    request, so the process that only created the app, such as the master under --preload, never runs it.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    started = time.perf_counter()
+    recover_jobs()
+    get_scheduler()
+    metrics.observe_startup('worker_start', time.perf_counter() - started)
+
 
 def create_app():
+    """Build the app: read the settings, bring the database schema up to date and warm up (see warm_up).
+    Importing this package does no I/O; background work starts per serving process (see start_worker).
+
+    The duration of each phase is kept in app.config['STARTUP_TIMINGS'] and reported in /metrics."""
+    started = time.perf_counter()
+    timings = {}
+    load_dotenv()
     app = Flask(__name__)
     CORS(app)
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+    app.config['RETAIN_UPLOADS'] = os.getenv('RETAIN_UPLOADS', 'false').lower() in ('1', 'true')
     jwt = JWTManager(app)
     @app.route('/protected', methods=['GET'])
     @jwt_required()
@@ -18,4 +107,36 @@ def create_app():
         return jsonify(message="You have access to this protected route")
 
     app.register_blueprint(cassandra_routes)
+
+    # Request timing, response sizes and the /metrics endpoint
+    metrics.configure()
+    app.register_blueprint(metrics_routes)
+    if metrics.ENABLED:
+        app.json = TimedJSONProvider(app)
+
+    # Accept-Encoding negotiated compression; registered last so it runs before the metrics hook,
+    # which then records the size actually sent
+    compression.configure()
+    app.after_request(compress_response)
+
+    shards.configure()
+    # Periodic schema sync from Cassandra, when a cluster and SCHEMA_SYNC_INTERVAL are configured
+    app.before_request(start_worker)
+    timings['configure'] = time.perf_counter() - started
+
+    # Bring the database schema up to date once, before serving, and that of every keyspace shard when sharded
+    phase_started = time.perf_counter()
+    migrate()
+    if shards.ENABLED:
+        shards.migrate_shards()
+    timings['migrate'] = time.perf_counter() - phase_started
+
+    if os.getenv('WARMUP', 'true').lower() not in ('0', 'false', 'no'):
+        phase_started = time.perf_counter()
+        warm_up(app)
+        timings['warmup'] = time.perf_counter() - phase_started
+    timings['create_app'] = time.perf_counter() - started
+    for phase, seconds in timings.items():
+        metrics.observe_startup(phase, seconds)
+    app.config['STARTUP_TIMINGS'] = timings
     return app
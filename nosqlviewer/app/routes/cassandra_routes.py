@@ -1,279 +1,169 @@
-from datetime import datetime
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, g, jsonify, request, stream_with_context, url_for
 from flask_jwt_extended import create_access_token
 from werkzeug.security import generate_password_hash, check_password_hash
+import json
 import sqlite3
-import csv
 import os
+from contextlib import ExitStack
+from ..services import compression, shards
+from ..services.annotations import COLUMN_ANNOTATIONS, TABLE_ANNOTATIONS, apply_annotations
+from ..services.cassandra_schema import get_scheduler
+from ..services.catalog_cache import bump_generation, catalog_cache
+from ..services.db import get_connection, query_database, read_snapshot, transaction
+from ..services.export import export_table
+from ..services.fuzzy import DEFAULT_THRESHOLD, fuzzy_search_columns
+from ..services.history import compact_update_logs, query_history
+from ..services.jobs import get_job, run_ingestion, spool_upload, submit_ingestion
+from ..services.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_MIMETYPES, fetch_page,
+                                   stream_rows)
+from ..services.relations_graph import MAX_DEPTH, get_relations_graph, parse_published
+from ..services.search import DEFAULT_LIMIT, MAX_LIMIT, build_search_query
+from ..services.snapshots import diff_snapshots, list_snapshots, resolve_snapshot
+from ..services.stats import catalog_stats, keyspace_stats
+from ..services.upload_formats import ChunkStream, needs_seekable, read_upload, upload_format
+from ..services.upload_stream import MultipartFileStream, UploadError, retain_compressed
 
 cassandra_routes = Blueprint('cassandra_routes', __name__)
 
-DB_FILE = 'nosql_viewer.db'
-
-
-def init_databases():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    # Create relations table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS relations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            from_keyspace TEXT,
-            from_table TEXT,
-            from_column TEXT,
-            to_keyspace TEXT,
-            to_table TEXT,
-            to_column TEXT,
-            is_published TEXT
-        )
-    ''')
-
-    # Create users table
-    cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_name TEXT,
-                password TEXT
-            )
-        ''')
-
-    # Create table_description table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS table_description (
-            keyspace_name TEXT,
-            table_name TEXT,
-            note TEXT,
-            tag TEXT,
-            PRIMARY KEY (keyspace_name, table_name)
-        )
-    ''')
-
-    # Create columns table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS columns (
-                        keyspace_name TEXT,
-                        table_name TEXT,
-                        column_name TEXT,
-                        clustering_order TEXT,
-                        column_name_bytes TEXT,
-                        kind TEXT,
-                        position INTEGER,
-                        type TEXT,
-                        note TEXT DEFAULT 'no note',
-                        tag TEXT DEFAULT 'no tags',
-                        status TEXT DEFAULT 'active',
-                        PRIMARY KEY (keyspace_name, table_name, column_name)
-                    )
-                ''')
-    cursor.execute('''
-            INSERT OR IGNORE INTO table_description (keyspace_name, table_name, note, tag)
-            SELECT DISTINCT keyspace_name, table_name, 'no note', 'no tag'
-            FROM columns
-        ''')
-
-    # Create update_logs table
-    cursor.execute('''
-                CREATE TABLE IF NOT EXISTS update_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_name TEXT,
-                    timestamp TEXT,
-                    existing_data TEXT,
-                    updated_data TEXT
-                )
-            ''')
 
-    conn.commit()
-    conn.close()
+@cassandra_routes.before_request
+def pin_snapshot():
+    # A read request sees one committed version of the catalog from its first query to its last, and an
+    # ingestion committing meanwhile neither blocks it nor shows up half applied (see read_snapshot)
+    if request.method in ('GET', 'HEAD'):
+        g.snapshot = ExitStack()
+        g.snapshot.enter_context(read_snapshot())
 
 
-init_databases()
+@cassandra_routes.after_request
+def release_snapshot_before_streaming(response):
+    # A streamed body reads through a connection of its own (see stream_rows): keeping the request's snapshot
+    # until the download ends would only hold back WAL checkpoints
+    if response.is_streamed:
+        release_snapshot(None)
+    return response
 
 
-def query_database(query, params=(), fetchall=True):
-    """Helper function to execute database queries."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(query, params)
-    results = cur.fetchall() if fetchall else cur.fetchone()
-    conn.commit()
-    conn.close()
-    return [dict(row) for row in results] if fetchall else dict(results) if results else None
+@cassandra_routes.teardown_request
+def release_snapshot(exc):
+    snapshot = g.pop('snapshot', None)
+    if snapshot is not None:
+        snapshot.close()
 
 
 @cassandra_routes.route('/api/upload-file', methods=['POST'])
 def upload_file():
     try:
-        # Check if the 'file' is in the request
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file part in the request'}), 400
-
-        file = request.files['file']
+        # Parse the multipart body as it arrives instead of letting Flask spool it to disk
+        upload = MultipartFileStream(request.stream, request.content_type or '')
 
         # Check if a file is selected
-        if file.filename == '':
+        if upload.filename == '':
             return jsonify({'error': 'No file selected for uploading'}), 400
 
-        # Check if the file is a CSV
-        if not file.filename.lower().endswith('.csv'):
-            return jsonify({'error': 'Only CSV files are allowed'}), 400
-
-        # Save the uploaded file temporarily
-        uploads_dir = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')
-        file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{timestamp}{file_extension}"
-        file_path = os.path.join(uploads_dir, filename)
-        file.save(file_path)
+        # CSV or NDJSON, optionally gzip or zstd compressed, or Parquet; raises a 400 for anything else
+        fmt, compression = upload_format(upload.filename)
 
-        # Process the CSV file
-        with open(file_path, newline='', encoding='utf-8') as csvfile:
-            csv_reader = csv.DictReader(csvfile)
-            csv_data = [row for row in csv_reader]
+        # Optionally keep a zstd-compressed copy of the raw upload
+        chunks = upload.chunks()
+        retain = request.args.get('retain')
+        if current_app.config.get('RETAIN_UPLOADS') if retain is None else retain.lower() in ('1', 'true'):
+            extension = f'.{fmt}' + {'gzip': '.gz', 'zstd': '.zst'}.get(compression, '')
+            chunks = retain_compressed(chunks, os.path.join(os.getcwd(), 'uploads'), extension)
 
-        # Update database with the CSV data
-        process_csv_data(csv_data)
+        # ?wait=1 reconciles inside the request, streaming the parsed rows into the database in batches
+        if request.args.get('wait', '').lower() in ('1', 'true'):
+            source = spool_upload(chunks) if needs_seekable(fmt) else ChunkStream(chunks)
+            try:
+                # Recorded as a job, so that it waits for any other ingestion of the database to finish
+                counts = run_ingestion(lambda progress: shards.ingest_runs(read_upload(source, fmt, compression),
+                                                                           progress=progress), upload.filename)
+            finally:
+                source.close()
+            return jsonify({'message': 'File processed and database updated successfully', 'counts': counts}), 200
+
+        # Otherwise hand the upload to the ingestion worker pool and return right away
+        job_id = submit_ingestion(chunks, upload.filename)
+        return jsonify({'message': 'File accepted for processing', 'job_id': job_id,
+                        'status_url': url_for('cassandra_routes.get_ingestion_job', job_id=job_id)}), 202
+
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        # Return a success response
-        return jsonify({'message': 'File processed and database updated successfully'}), 200
 
+@cassandra_routes.route('/api/jobs/<job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({'error': f"No job found with id '{job_id}'"}), 404
+        return jsonify(job), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-def process_csv_data(csv_data):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Ensure the `columns` table exists
+@cassandra_routes.route('/api/schema-sync', methods=['GET', 'POST'])
+def schema_sync():
+    # POST syncs the catalog with the configured cluster now; GET reports the last sync of this worker
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return jsonify({'error': 'Schema sync is not configured: set CASSANDRA_CONTACT_POINTS'}), 400
     try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS columns (
-                keyspace_name TEXT,
-                table_name TEXT,
-                column_name TEXT,
-                clustering_order TEXT,
-                column_name_bytes TEXT,
-                kind TEXT,
-                position INTEGER,
-                type TEXT,
-                note TEXT DEFAULT 'no note',
-                tag TEXT DEFAULT 'no tags',
-                status TEXT DEFAULT 'active',
-                PRIMARY KEY (keyspace_name, table_name, column_name)
-            )
-        ''')
+        if request.method == 'POST':
+            run = scheduler.run_once()
+            return jsonify(run), 200 if run['status'] == 'completed' else 502
+        return jsonify(scheduler.last_run or {'status': 'never_run'}), 200
     except Exception as e:
-        print(f"Error creating 'columns' table: {e}")
-        conn.close()
-        return
-
-    # Fetch existing records from sqliteDB
-    cursor.execute('SELECT keyspace_name, table_name, column_name, clustering_order, column_name_bytes, kind, '
-                   'position, type, note, tag, status FROM columns')
-    db_rows = cursor.fetchall()
-    db_data = {f"{row[0]}.{row[1]}.{row[2]}": row for row in db_rows}
-
-    new_data_keys = set()
-    for row in csv_data:
-        try:
-            keyspace_name = row.get('keyspace_name', '').strip()
-            table_name = row.get('table_name', '').strip()
-            column_name = row.get('column_name', '').strip()
-            clustering_order = row.get('clustering_order', '').strip()
-            column_name_bytes = row.get('column_name_bytes', '').strip()
-            kind = row.get('kind', '').strip()
-            position = row.get('position', '')
-            try:
-                position = int(position)
-            except (ValueError, TypeError):
-                position = 0
-            type = row.get('type', '').strip()
-            note = row.get('note', 'no note').strip() or 'no note'
-            tag = row.get('tag', 'no tags').strip() or 'no tags'
-            status = row.get('status', 'active').strip() or 'active'
-            identifier = f"{keyspace_name}.{table_name}.{column_name}"
-
-            if not keyspace_name or not table_name or not column_name:
-                continue  # Skip invalid rows
-
-            new_data_keys.add(identifier)
-            if identifier in db_data:
-                db_row = db_data[identifier]
-                if (clustering_order != db_row[3] or
-                        column_name_bytes != db_row[4] or
-                        kind != db_row[5] or
-                        position != db_row[6] or
-                        type != db_row[7] or
-                        note != db_row[8] or
-                        tag != db_row[9] or
-                        status != db_row[10]):
-                    existing_data = str(db_row)
-                    updated_data = str((keyspace_name, table_name, column_name, clustering_order, column_name_bytes,
-                                        kind, position, type, note, tag, 'active'))
-                    cursor.execute('''
-                        UPDATE columns
-                        SET clustering_order = ?, column_name_bytes = ?, kind = ?, position = ?, type = ?, note = ?, 
-                        tag = ?, status = 'active'
-                        WHERE keyspace_name = ? AND table_name = ? AND column_name = ?
-                    ''', (clustering_order, column_name_bytes, kind, position, type, note, tag, keyspace_name,
-                          table_name, column_name))
-                    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    cursor.execute(''' 
-                                        INSERT INTO update_logs (user_name, timestamp, existing_data, updated_data)
-                                        VALUES ('admin', ?, ?, ?)
-                                    ''', (timestamp, existing_data, updated_data))
+        return jsonify({'error': str(e)}), 500
 
-            else:
-                existing_data = "None"
-                updated_data = str((keyspace_name, table_name, column_name, clustering_order, column_name_bytes,
-                                    kind, position, type, note, tag, 'active'))
-                # Insert the new row into the columns table
-                cursor.execute('''
-                    INSERT INTO columns (keyspace_name, table_name, column_name, clustering_order, column_name_bytes, 
-                    kind, position,type, note, tag, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active')
-                ''', (keyspace_name, table_name, column_name, clustering_order, column_name_bytes,
-                      kind, position, type, note, tag))
-
-                # Log the insertion in the update_logs table
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                cursor.execute(''' 
-                                INSERT INTO update_logs (user_name, timestamp, existing_data, updated_data)
-                                VALUES ('admin', ?, ?, ?)
-                            ''', (timestamp, existing_data, updated_data))
-        except Exception as e:
-            print(f"Error processing row: {row}, Error: {str(e)}")
-            continue
-
-    # Mark missing rows as deleted
-    for identifier, db_row in db_data.items():
-        if identifier not in new_data_keys:
-            cursor.execute('''
-                UPDATE columns
-                SET status = 'deleted'
-                WHERE keyspace_name = ? AND table_name = ? AND column_name = ?
-            ''', (db_row[0], db_row[1], db_row[2]))
-            existing_data = str(db_row)
-            updated_data = "none"
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute(''' 
-            INSERT INTO update_logs (user_name, timestamp, existing_data, updated_data)
-            VALUES ('admin', ?, ?, ?)
-            ''', (timestamp, existing_data, updated_data))
-
-    conn.commit()
-    conn.close()
+
+def _catalog_response(key, load):
+    """Serve a tree navigation response from the catalog cache. `load` returns the payload and status code
+    on a miss; a request whose If-None-Match holds the current ETag gets a 304 without touching the database.
+    The ETag follows the catalog generation as this process last read it, at most GENERATION_TTL (1 s) ago:
+    for that long after another worker's write, this one may still answer 304 for the previous data.
+
+    Bodies worth compressing are cached once per negotiated encoding as well, so a hot response is
+    compressed once per catalog generation rather than on every request."""
+    etag = catalog_cache.etag(key)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    def serialize():
+        payload, status = load()
+        return jsonify(payload).get_data(), status
+
+    body, status = catalog_cache.get(key, serialize)
+    response = Response(body, status=status, mimetype='application/json')
+    if status == 200:
+        response.set_etag(etag)
+    if not compression.compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings)
+    if encoding is None or len(body) < compression.MIN_SIZE:
+        return response
+    body, _ = catalog_cache.get((key, encoding), lambda: (
+        compression.compress(body, encoding, compression.CACHED_LEVELS[encoding]), status))
+    response.set_data(body)
+    return compression.encoded(response, encoding)
 
 
 @cassandra_routes.route('/api/keyspace_names', methods=['GET'])
 def get_distinct_keyspace_names():
-    try:
+    def load():
+        if shards.ENABLED:
+            return shards.indexed_keyspaces(), 200
         query = "SELECT DISTINCT keyspace_name FROM columns WHERE keyspace_name IS NOT NULL"
         result = query_database(query)
-        distinct_keyspace_names = [row['keyspace_name'] for row in result]
-        return jsonify(distinct_keyspace_names)
+        return [row['keyspace_name'] for row in result], 200
+
+    try:
+        return _catalog_response(('keyspace_names',), load)
     except Exception as e:
         print(f"Error retrieving keyspace names: {e}")
         return jsonify({"error": "Failed to retrieve keyspace names"}), 500
@@ -285,15 +175,19 @@ def get_distinct_table_names():
     if not keyspace_name:
         return jsonify({"error": "keyspace_name parameter is required"}), 400
 
-    try:
+    def load():
+        if shards.ENABLED:
+            return shards.indexed_tables(keyspace_name), 200
         query = """
             SELECT DISTINCT table_name
             FROM columns
             WHERE keyspace_name = ? AND table_name IS NOT NULL
         """
         result = query_database(query, params=(keyspace_name,))
-        distinct_table_names = [row['table_name'] for row in result]
-        return jsonify(distinct_table_names)
+        return [row['table_name'] for row in result], 200
+
+    try:
+        return _catalog_response(('table_names', keyspace_name), load)
 
     except Exception as e:
         # Log the error
@@ -307,22 +201,44 @@ def get_distinct_columns():
     table_name = request.args.get('table_name')
     if not keyspace_name or not table_name:
         return jsonify({"error": "Both keyspace_name and table_name parameters are required"}), 400
-    try:
+    def load():
         query = """
             SELECT DISTINCT column_name, clustering_order, column_name_bytes, kind, position, type, note, tag
             FROM columns
             WHERE keyspace_name = ? AND table_name = ? AND column_name IS NOT NULL
         """
-        result = query_database(query, params=(keyspace_name, table_name))
+        result = query_database(query, params=(keyspace_name, table_name), db_file=shards.shard_for(keyspace_name))
         if not result:
-            return jsonify({"error": f"No data found for keyspace '{keyspace_name}' and table '{table_name}'"}), 404
+            return {"error": f"No data found for keyspace '{keyspace_name}' and table '{table_name}'"}, 404
+        return result, 200
+
+    try:
         # Return as JSON
-        return jsonify(result), 200
+        return _catalog_response(('get_columns', keyspace_name, table_name), load)
 
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+@cassandra_routes.route('/api/stats', methods=['GET'])
+def get_stats():
+    # Counts, type distribution and annotation coverage, from the summary tables kept up to date on write
+    keyspace_name = request.args.get('keyspace_name')
+
+    def load():
+        if not keyspace_name:
+            return catalog_stats(), 200
+        stats = keyspace_stats(keyspace_name)
+        if stats is None:
+            return {"error": f"No data found for keyspace '{keyspace_name}'"}, 404
+        return stats, 200
+
+    try:
+        return _catalog_response(('stats', keyspace_name), load)
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+
 @cassandra_routes.route('/api/update_column_tag', methods=['PUT'])
 def update_column():
     data = request.get_json()
@@ -334,12 +250,13 @@ def update_column():
     if not all([keyspace_name, table_name, column_name, note, tag]):
         return jsonify({"error": "keyspace_name, table_name, column_name, tag, and note are required"}), 400
     try:
+        db_file = shards.shard_for(keyspace_name)
         check_query = """
             SELECT 1 FROM columns 
             WHERE keyspace_name = ? AND table_name = ? AND column_name = ?
             LIMIT 1
         """
-        result = query_database(check_query, params=(keyspace_name, table_name, column_name))
+        result = query_database(check_query, params=(keyspace_name, table_name, column_name), db_file=db_file)
         if not result:
             return jsonify(
                 {"error": "No matching row found for the provided keyspace_name, table_name, and column_name"}), 404
@@ -348,8 +265,13 @@ def update_column():
             SET tag = ?, note = ?
             WHERE keyspace_name = ? AND table_name = ? AND column_name = ?
         """
-        # Execute the update query
-        query_database(update_query, params=(tag, note, keyspace_name, table_name, column_name))
+        # Execute the update query and invalidate the catalog caches of every worker
+        with transaction(get_connection(db_file)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(update_query, (tag, note, keyspace_name, table_name, column_name))
+            bump_generation(cursor)
+        if db_file:
+            shards.bump_index_generation()
 
         # Return success message
         return jsonify({"message": "Record updated successfully"}), 200
@@ -366,15 +288,15 @@ def get_table_description():
 
     if not keyspace_name or not table_name:
         return jsonify({"error": "keyspace_name and table_name parameter is required"}), 400
-    try:
+    def load():
         query = ''' SELECT keyspace_name, table_name, tag, note
         FROM table_description
         WHERE keyspace_name = ? AND table_name = ?
         LIMIT 1
             '''
-        result = query_database(query, params=(keyspace_name, table_name))
+        result = query_database(query, params=(keyspace_name, table_name), db_file=shards.shard_for(keyspace_name))
         if not result:
-            return jsonify({"error": f"No data found for keyspace '{keyspace_name}' and table '{table_name}'"}), 404
+            return {"error": f"No data found for keyspace '{keyspace_name}' and table '{table_name}'"}, 404
         record = result[0] if isinstance(result, list) else result
         response = {
             "keyspace_name": record.get("keyspace_name"),
@@ -382,7 +304,10 @@ def get_table_description():
             "tag": record.get("tag"),
             "note": record.get("note")
         }
-        return jsonify(response), 200
+        return response, 200
+
+    try:
+        return _catalog_response(('table_description', keyspace_name, table_name), load)
     except Exception as e:
         # Handle unexpected errors
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
@@ -398,12 +323,13 @@ def update_table_description():
     if not all([keyspace_name, table_name, tag, note]):
         return jsonify({"error": "keyspace_name, table_name, tag, and note are required"}), 400
     try:
+        db_file = shards.shard_for(keyspace_name)
         check_query = """
             SELECT 1 FROM table_description
             WHERE keyspace_name = ? AND table_name = ?
             LIMIT 1
         """
-        result = query_database(check_query, params=(keyspace_name, table_name))
+        result = query_database(check_query, params=(keyspace_name, table_name), db_file=db_file)
         if not result:
             return jsonify(
                 {"error": "No matching row found for the provided keyspace_name, table_name, "}), 404
@@ -412,8 +338,13 @@ def update_table_description():
             SET tag = ?, note = ?
             WHERE keyspace_name = ? AND table_name = ?
         """
-        # Execute the update query
-        query_database(update_query, params=(tag, note, keyspace_name, table_name))
+        # Execute the update query and invalidate the catalog caches of every worker
+        with transaction(get_connection(db_file)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(update_query, (tag, note, keyspace_name, table_name))
+            bump_generation(cursor)
+        if db_file:
+            shards.bump_index_generation()
 
         # Return success message
         return jsonify({"message": "Record updated successfully"}), 200
@@ -423,42 +354,95 @@ def update_table_description():
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+def _bulk_annotation_response(target):
+    data = request.get_json(silent=True)
+    edits = data.get('edits') if isinstance(data, dict) else data
+    if not isinstance(edits, list) or not edits:
+        return jsonify({"error": "A non-empty array of edits is required"}), 400
+    try:
+        if shards.ENABLED:
+            # One transaction per keyspace shard
+            results = shards.apply_sharded_annotations(
+                lambda shard_edits, db_file: apply_annotations(target, shard_edits, db_file=db_file), edits)
+        else:
+            results = apply_annotations(target, edits)
+        updated = sum(result['status'] == 'updated' for result in results)
+        return jsonify({"message": f"{updated} of {len(results)} records updated", "results": results}), 200
+    except Exception as e:
+        # Handle unexpected errors
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+
+@cassandra_routes.route('/api/update_column_tags', methods=['PUT'])
+def update_columns():
+    # Batch version of /api/update_column_tag: an array of edits, applied in one transaction
+    return _bulk_annotation_response(COLUMN_ANNOTATIONS)
+
+
+@cassandra_routes.route('/api/update_table_descriptions', methods=['PUT'])
+def update_table_descriptions():
+    # Batch version of /api/update_table_description: an array of edits, applied in one transaction
+    return _bulk_annotation_response(TABLE_ANNOTATIONS)
+
+
 @cassandra_routes.route('/api/filtered_data', methods=['GET'])
 def get_filter_data():
     # Get search filter from query parameters
     search_filter = request.args.get('search', default='', type=str)
-    threshold = 0.5  # You can adjust the threshold value based on your needs.
+    threshold = request.args.get('threshold', default=DEFAULT_THRESHOLD, type=float)
+    # If no search filter is provided, return the first 50 records
+    limit = min(request.args.get('limit', default=DEFAULT_LIMIT if search_filter else 50, type=int), MAX_LIMIT)
+    if limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    after = request.args.get('after')
+    stream = request.args.get('stream')
 
     try:
-        # If no search filter is provided, return the first 50 records
-        if not search_filter:
-            query = "SELECT * FROM columns LIMIT 50"
-            data = query_database(query)
-            return jsonify(data)
-
-        # Apply the search filter on the text columns using a LIKE query
-        search_filter_lower = search_filter.lower()
-        query = """
-            SELECT * FROM columns
-            WHERE LOWER(column_name) LIKE ? 
-               OR LOWER(note) LIKE ? 
-               OR LOWER(tag) LIKE ?
-        """
-        params = (f"%{search_filter_lower}%", f"%{search_filter_lower}%", f"%{search_filter_lower}%")
-        data = query_database(query, params=params)
+        # With mode=fuzzy rank column names by trigram similarity so that typos still match
+        if search_filter and request.args.get('mode') == 'fuzzy':
+            if shards.ENABLED:
+                data = shards.fuzzy_search_shards(fuzzy_search_columns, search_filter, limit, threshold=threshold)
+            else:
+                data = fuzzy_search_columns(search_filter, threshold=threshold, limit=limit)
+            next_after = None
+        elif shards.ENABLED:
+            # Every keyspace shard has its own full-text index: fan out and merge
+            if stream in STREAM_MIMETYPES:
+                query, params, cursor_fields = build_search_query(search_filter, limit=limit)
+                rows = shards.stream_shards(query, params, fmt=stream, hidden_fields=cursor_fields,
+                                            transform=_clean_record, limit=limit)
+                return Response(stream_with_context(rows), mimetype=STREAM_MIMETYPES[stream])
+            data, next_after = shards.search_page(build_search_query, search_filter, limit, after)
+        else:
+            # Otherwise look the terms up in the trigram full-text index, best matches first, one keyset page
+            # at a time
+            query, params, cursor_fields = build_search_query(search_filter, limit=limit, after=after)
+            if stream in STREAM_MIMETYPES:
+                rows = stream_rows(query, params, fmt=stream, hidden_fields=cursor_fields, transform=_clean_record)
+                return Response(stream_with_context(rows), mimetype=STREAM_MIMETYPES[stream])
+            data, next_after = fetch_page(query, params, cursor_fields, limit)
 
-        # Apply data type adjustments (e.g., stripping tags or handling None for notes)
         for record in data:
-            record['note'] = None if record.get('note') is None else record['note']
-            record['tag'] = record.get('tag', "").strip() if isinstance(record.get('tag'), str) else "no tags"
+            _clean_record(record)
 
-        # Return the filtered data
-        return jsonify(data)
+        # Return the filtered data, pointing at the next page if there is one
+        response = jsonify(data)
+        if next_after:
+            response.headers['X-Next-After'] = next_after
+        return response
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _clean_record(record):
+    # Apply data type adjustments (e.g., stripping tags or handling None for notes)
+    record['note'] = None if record.get('note') is None else record['note']
+    record['tag'] = record.get('tag', "").strip() if isinstance(record.get('tag'), str) else "no tags"
+
+
 @cassandra_routes.route('/api/save_relation', methods=['POST'])
 def save_relation():
     try:
@@ -487,6 +471,8 @@ def save_relation():
               '''
         query_database(query, (from_keyspace, from_table, from_column, to_keyspace, to_table, to_column, is_published),
                        fetchall=False)
+        # Add the new edge to this worker's lineage graph right away
+        get_relations_graph()
         return jsonify({'message': 'Relation saved successfully'}), 201
 
     except Exception as e:
@@ -500,32 +486,32 @@ def get_relations():
     if not from_keyspace or not from_table:
         return jsonify({'error': 'Both from_keyspace and from_table are required parameters'}), 400
     try:
-        with sqlite3.connect(DB_FILE) as connection:
-            cursor = connection.cursor()
-            query = """
-            SELECT from_keyspace, from_table, from_column, to_keyspace, to_table, to_column, is_published
-            FROM relations
-            WHERE from_keyspace = ? AND from_table = ?
-            """
-            cursor.execute(query, (from_keyspace, from_table))
-            rows = cursor.fetchall()
-
-            if not rows:
-                return jsonify({'message': 'No relations found for the given keyspace and table'}), 404
-            relations = [
-                {
-                    'from_keyspace': row[0],
-                    'from_table': row[1],
-                    'from_column': row[2],
-                    'to_keyspace': row[3],
-                    'to_table': row[4],
-                    'to_column': row[5],
-                    'is_published': row[6]
-                }
-                for row in rows
-            ]
-
-            return jsonify(relations), 200
+        # Not `with connection`: its exit commits, which would end the request's read snapshot
+        cursor = get_connection().cursor()
+        query = """
+        SELECT from_keyspace, from_table, from_column, to_keyspace, to_table, to_column, is_published
+        FROM relations
+        WHERE from_keyspace = ? AND from_table = ?
+        """
+        cursor.execute(query, (from_keyspace, from_table))
+        rows = cursor.fetchall()
+
+        if not rows:
+            return jsonify({'message': 'No relations found for the given keyspace and table'}), 404
+        relations = [
+            {
+                'from_keyspace': row[0],
+                'from_table': row[1],
+                'from_column': row[2],
+                'to_keyspace': row[3],
+                'to_table': row[4],
+                'to_column': row[5],
+                'is_published': row[6]
+            }
+            for row in rows
+        ]
+
+        return jsonify(relations), 200
 
     except sqlite3.Error as e:
         return jsonify({'error': f'Database error: {e}'}), 500
@@ -533,6 +519,160 @@ def get_relations():
         return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
 
 
+def _published_filter():
+    published = request.args.get('published')
+    return None if published is None else parse_published(published)
+
+
+def _node_payload(node, hops=None):
+    payload = {'keyspace_name': node[0], 'table_name': node[1]}
+    if len(node) == 3:
+        payload['column_name'] = node[2]
+    if hops is not None:
+        payload['depth'] = hops
+    return payload
+
+
+@cassandra_routes.route('/api/relations/lineage', methods=['GET'])
+def get_lineage():
+    keyspace_name = request.args.get('keyspace_name')
+    table_name = request.args.get('table_name')
+    column_name = request.args.get('column_name')
+    direction = request.args.get('direction', 'downstream')
+    depth = min(request.args.get('depth', default=1, type=int), MAX_DEPTH)
+    if not keyspace_name or not table_name:
+        return jsonify({'error': 'Both keyspace_name and table_name are required parameters'}), 400
+    if direction not in ('downstream', 'upstream', 'both'):
+        return jsonify({'error': "direction must be one of 'downstream', 'upstream' or 'both'"}), 400
+    try:
+        # Column-level lineage when a column is given, table-level otherwise
+        start = (keyspace_name, table_name) + ((column_name,) if column_name else ())
+        nodes, edges = get_relations_graph().traverse(start, direction, depth, _published_filter())
+        return jsonify({
+            'root': _node_payload(start),
+            'nodes': [_node_payload(node, hops) for node, hops in nodes.items()],
+            'edges': edges,
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/relations/path', methods=['GET'])
+def get_relation_path():
+    required = ['from_keyspace', 'from_table', 'to_keyspace', 'to_table']
+    if not all(request.args.get(field) for field in required):
+        return jsonify({'error': f"{', '.join(required)} are required parameters"}), 400
+    source = (request.args['from_keyspace'], request.args['from_table'])
+    target = (request.args['to_keyspace'], request.args['to_table'])
+    # directed=false also follows relations backwards
+    directed = request.args.get('directed', 'true').lower() not in ('0', 'false')
+    try:
+        path = get_relations_graph().shortest_path(source, target, directed, _published_filter())
+        if path is None:
+            return jsonify({'message': 'No path found between the given tables'}), 404
+        return jsonify({'hops': len(path), 'edges': path}), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/relations/components', methods=['GET'])
+def get_relation_components():
+    try:
+        components = get_relations_graph().components(_published_filter())
+        return jsonify([[_node_payload(node) for node in component] for component in components]), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/history', methods=['GET'])
+def get_history():
+    # Change log of a keyspace, table or column, newest first; filters are optional and combinable
+    filters = {field: request.args.get(field) for field in
+               ('keyspace_name', 'table_name', 'column_name', 'since', 'until', 'batch_id', 'action')}
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', default=DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    # Each keyspace shard numbers its own change log: one keyspace's history at a time
+    if shards.ENABLED and not filters['keyspace_name']:
+        return jsonify({'error': 'keyspace_name is required with sharded storage'}), 400
+    try:
+        entries, next_after = query_history(after=after, limit=limit,
+                                            db_file=shards.shard_for(filters['keyspace_name']), **filters)
+        return jsonify({'data': entries, 'next_after': next_after}), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/history/compact', methods=['POST'])
+def compact_history():
+    # Apply retention limits now and convert any pre-structured entries
+    data = request.get_json(silent=True) or {}
+    try:
+        max_age_days = data.get('max_age_days')
+        keep_batches = data.get('keep_batches')
+        for value in (max_age_days, keep_batches):
+            if value is not None and (not isinstance(value, (int, float)) or value < 0):
+                return jsonify({'error': 'max_age_days and keep_batches must be non-negative numbers'}), 400
+        # The main database and, when sharded, every keyspace shard keep a change log of their own
+        results = [compact_update_logs(max_age_days, keep_batches, db_file=path)
+                   for path in [None] + [path for _, path in shards.shard_files()]]
+        return jsonify({field: sum(result[field] for result in results) for field in results[0]}), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/snapshots', methods=['GET'])
+def get_snapshots():
+    # Catalog snapshots recorded by ingestions, newest first
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', default=DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    try:
+        snapshots, next_after = list_snapshots(after=after, limit=limit)
+        return jsonify({'data': snapshots, 'next_after': next_after}), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/snapshots/diff', methods=['GET'])
+def diff_catalog_snapshots():
+    # What changed between two snapshots, each given by id or by date/timestamp (`to` defaults to the newest)
+    old_ref, new_ref = request.args.get('from'), request.args.get('to')
+    if not old_ref:
+        return jsonify({'error': 'from is required'}), 400
+    try:
+        old, new = resolve_snapshot(old_ref), resolve_snapshot(new_ref)
+        if old is None or new is None:
+            return jsonify({'error': f'No snapshot found for {old_ref if old is None else new_ref}'}), 404
+        return jsonify(diff_snapshots(old, new, request.args.get('keyspace_name'))), 200
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+
+
+@cassandra_routes.route('/api/export/<table_name>', methods=['GET'])
+def export_catalog_table(table_name):
+    # Bulk export of columns, table_description, relations or update_logs, streamed batch by batch
+    keyspace = request.args.get('keyspace')
+    # A sharded catalog table is exported from one keyspace's shard; relations stay in the main database
+    sharded = table_name in shards.SHARD_TABLES
+    if shards.ENABLED and sharded and not keyspace:
+        return jsonify({'error': f"keyspace is required to export '{table_name}' with sharded storage"}), 400
+    try:
+        chunks, mimetype, filename = export_table(table_name, request.args.get('format', 'ndjson'),
+                                                  keyspace=keyspace, status=request.args.get('status'),
+                                                  db_file=shards.shard_for(keyspace) if sharded else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        return jsonify({'error': f'An unexpected error occurred: {e}'}), 500
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
 @cassandra_routes.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -565,33 +705,54 @@ def register():
     query_database(query, (email, hashed_password), fetchall=False)
     return jsonify({"msg": "User created successfully"}), 201
 
+
+# Tables /api/db_data serves; the others are internal bookkeeping (jobs, fingerprints, snapshots, statistics,
+# the search index), some without a rowid to page on or holding BLOBs
+DB_DATA_TABLES = ('columns', 'table_description', 'relations', 'update_logs', 'users')
+
+
 @cassandra_routes.route( '/api/db_data',methods=['GET'])
 def get_all_db_data():
     table_name = request.args.get('table_name')
     if not table_name:
         return jsonify({"error": "Table name is required"}), 400
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    stream = request.args.get('stream')
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
         if not cursor.fetchone():
             return jsonify({"error": f"Table '{table_name}' does not exist"}), 404
-        query = f"SELECT * FROM {table_name}"
+        if table_name not in DB_DATA_TABLES:
+            return jsonify({"error": f"Table '{table_name}' is internal and cannot be browsed"}), 400
+        if shards.ENABLED and table_name in shards.SHARD_TABLES:
+            return jsonify({"error": f"Table '{table_name}' is kept in keyspace shards and cannot be browsed "
+                                     f"here; use /api/export/{table_name}?keyspace=..."}), 501
+
+        # Keyset pagination over rowid when `after` or `limit` is given, otherwise the whole table
+        paged = after is not None or limit is not None
+        limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if paged:
+            query = f'SELECT *, rowid AS _rowid FROM "{table_name}" WHERE rowid > ? ORDER BY rowid LIMIT ?'
+            params = (after or 0, limit)
+        else:
+            query, params = f'SELECT * FROM "{table_name}"', ()
+
+        # Stream NDJSON lines or a chunked JSON document straight from the cursor
+        if stream in STREAM_MIMETYPES:
+            rows = stream_rows(query, params, fmt=stream, hidden_fields=('_rowid',),
+                               prefix=f'{{"table": {json.dumps(table_name)}, "data": [', suffix=']}')
+            return Response(stream_with_context(rows), mimetype=STREAM_MIMETYPES[stream])
+
+        if paged:
+            data, next_after = fetch_page(query, params, ('_rowid',), limit)
+            return jsonify({"table": table_name, "data": data, "next_after": next_after}), 200
         cursor.execute(query)
-        rows = cursor.fetchall()
         columns = [description[0] for description in cursor.description]
-        data = [dict(zip(columns, row)) for row in rows]
+        data = [dict(zip(columns, row)) for row in cursor]
         return jsonify({"table": table_name, "data": data}), 200
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
-
-
-
-
-
-
-
-
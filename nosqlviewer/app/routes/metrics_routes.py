@@ -0,0 +1,72 @@
+import cProfile
+import os
+import time
+import uuid
+
+from flask import Blueprint, Response, g, request
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended import verify_jwt_in_request
+
+from ..services import metrics as settings
+from ..services.metrics import (REQUEST_LATENCY, REQUEST_PHASES, RESPONSE_SIZE, add_phase, begin_request,
+                                end_request, render_metrics)
+
+metrics_routes = Blueprint('metrics_routes', __name__)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that books the time spent serializing into the request's `serialize` phase."""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_phase('serialize', time.perf_counter() - started)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@metrics_routes.before_app_request
+def start_timer():
+    # Opt-in profiling: with PROFILE_REQUESTS=true, a request carrying ?profile=1 or an X-Profile: 1 header
+    # runs under cProfile and its stats are written to PROFILE_DIR (readable with pstats or snakeviz)
+    if settings.PROFILE_REQUESTS and '1' in (request.args.get('profile'), request.headers.get('X-Profile')):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+    if settings.ENABLED:
+        g.request_started = time.perf_counter()
+        begin_request(_route())
+
+
+@metrics_routes.after_app_request
+def record_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        path = os.path.join(settings.PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.prof')
+        profiler.dump_stats(path)
+        # Streamed bodies are produced after this point and are not part of the profile
+        response.headers['X-Profile-File'] = path
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    route = _route()
+    REQUEST_LATENCY.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.calculate_content_length() or 0, request.method, route)
+    for phase, seconds in end_request().items():
+        REQUEST_PHASES.observe(seconds, route, phase)
+    return response
+
+
+@metrics_routes.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format; every worker process reports its own series. Scrapers send a JWT as bearer
+    # token unless METRICS_AUTH=false
+    if settings.REQUIRE_AUTH:
+        verify_jwt_in_request()
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
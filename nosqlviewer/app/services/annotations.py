@@ -0,0 +1,61 @@
+from .catalog_cache import bump_generation
+from .db import get_connection, transaction
+from .history import finish_batch, now, register_diff_function, start_batch
+
+COLUMN_ANNOTATIONS = ('columns', ('keyspace_name', 'table_name', 'column_name'))
+TABLE_ANNOTATIONS = ('table_description', ('keyspace_name', 'table_name'))
+
+
+def apply_annotations(target, edits, user_name='admin', db_file=None):
+    """Set the note and tag of many `columns` or `table_description` rows in one transaction.
+
+    `target` is COLUMN_ANNOTATIONS or TABLE_ANNOTATIONS. Edits missing a field are reported as invalid
+    and edits for unknown rows as not_found; the rest are applied in order with one executemany and
+    logged to `update_logs` as one batch with a single statement. Returns one result per edit, in order.
+    """
+    table, keys = target
+    required = keys + ('note', 'tag')
+    results, valid = [], []
+    for index, edit in enumerate(edits):
+        if not isinstance(edit, dict) or not all(edit.get(field) for field in required):
+            results.append({'index': index, 'status': 'invalid', 'error': f"{', '.join(required)} are required"})
+        else:
+            results.append({'index': index, 'status': 'not_found'})
+            valid.append((index, *(edit[field] for field in required)))
+    if not valid:
+        return results
+
+    key_match = ' AND '.join(f'e.{key} = t.{key}' for key in keys)
+    key_columns = ', '.join(f't.{key}' for key in keys) + ('' if 'column_name' in keys else ', NULL')
+    with transaction(get_connection(db_file)) as conn:
+        cursor = conn.cursor()
+        register_diff_function(conn, 'annotation_diff', ('note', 'tag'))
+        cursor.execute('DROP TABLE IF EXISTS temp.annotation_edits')
+        cursor.execute(f"CREATE TEMP TABLE annotation_edits (idx INTEGER PRIMARY KEY, {', '.join(required)})")
+        try:
+            cursor.executemany(f"INSERT INTO temp.annotation_edits VALUES ({', '.join('?' * (len(required) + 1))})",
+                               valid)
+            found = [index for (index,) in cursor.execute(f'''
+                SELECT e.idx FROM temp.annotation_edits e JOIN {table} t ON {key_match} ORDER BY e.idx
+            ''')]
+            if found:
+                batch_id = start_batch(cursor, 'annotation', user_name)
+                cursor.execute(f'''
+                    INSERT INTO update_logs (user_name, timestamp, batch_id, action, keyspace_name, table_name,
+                                             column_name, changes)
+                    SELECT ?, ?, ?, 'annotate', {key_columns}, annotation_diff(t.note, t.tag, e.note, e.tag)
+                    FROM temp.annotation_edits e JOIN {table} t ON {key_match}
+                    ORDER BY e.idx
+                ''', (user_name, now(), batch_id))
+                finish_batch(cursor, batch_id, {'rows': len(valid), 'updated': len(found)})
+                edits_by_index = {edit[0]: edit[1:] for edit in valid}
+                cursor.executemany(
+                    f"UPDATE {table} SET note = ?, tag = ? WHERE {' AND '.join(f'{key} = ?' for key in keys)}",
+                    (edits_by_index[index][-2:] + edits_by_index[index][:-2] for index in found))
+                bump_generation(cursor)
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS temp.annotation_edits')
+
+    for index in found:
+        results[index]['status'] = 'updated'
+    return results
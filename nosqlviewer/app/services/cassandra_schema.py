@@ -0,0 +1,372 @@
+import csv
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import shards
+from .catalog_cache import bump_generation
+from .db import get_connection, transaction
+from .fingerprints import TableFingerprint, drop_fingerprints, save_fingerprints, stored_fingerprints
+from .history import finish_batch, start_batch
+from .ingest import (carry_annotations, create_scope_table, create_staging_table, drop_staging_table,
+                     reconcile_staged, scope_tables, stage_rows)
+from .jobs import run_ingestion
+from .snapshots import record_snapshot
+from .stats import refresh_stats
+
+MAX_WORKERS = 8
+SYSTEM_KEYSPACES = frozenset(('system', 'system_auth', 'system_distributed', 'system_schema', 'system_traces',
+                              'system_views', 'system_virtual_schema'))
+# The system_schema.columns fields a table's fingerprint covers; notes and tags are ours, not the cluster's
+SCHEMA_FIELDS = ('column_name', 'clustering_order', 'column_name_bytes', 'kind', 'position', 'type')
+
+
+class SchemaSource(ABC):
+    """Where schema sync reads `system_schema` from. Methods may be called from several threads at once."""
+
+    @abstractmethod
+    def keyspaces(self):
+        """Names of all keyspaces."""
+
+    @abstractmethod
+    def tables(self, keyspace):
+        """{table_name: comment} for the tables of a keyspace (system_schema.tables)."""
+
+    @abstractmethod
+    def columns(self, keyspace):
+        """The system_schema.columns rows of a keyspace, as dicts."""
+
+    def close(self):
+        pass
+
+
+class CassandraSchemaSource(SchemaSource):
+    """Reads a live cluster through the DataStax driver (`pip install cassandra-driver`), whose sessions
+    are safe to share between the fetching threads."""
+
+    def __init__(self, contact_points, port=9042, username=None, password=None):
+        try:
+            from cassandra.auth import PlainTextAuthProvider
+            from cassandra.cluster import Cluster
+            from cassandra.query import dict_factory
+        except ImportError as e:
+            raise RuntimeError('Schema sync from Cassandra requires the cassandra-driver package') from e
+        auth = PlainTextAuthProvider(username=username, password=password) if username else None
+        self.cluster = Cluster(contact_points, port=port, auth_provider=auth)
+        self.session = self.cluster.connect()
+        self.session.row_factory = dict_factory
+
+    def keyspaces(self):
+        rows = self.session.execute('SELECT keyspace_name FROM system_schema.keyspaces')
+        return [row['keyspace_name'] for row in rows]
+
+    def tables(self, keyspace):
+        rows = self.session.execute('SELECT table_name, comment FROM system_schema.tables WHERE keyspace_name = %s',
+                                    (keyspace,))
+        return {row['table_name']: row['comment'] for row in rows}
+
+    def columns(self, keyspace):
+        return self.session.execute(f'''
+            SELECT keyspace_name, table_name, {', '.join(SCHEMA_FIELDS)}
+            FROM system_schema.columns WHERE keyspace_name = %s
+        ''', (keyspace,))
+
+    def close(self):
+        self.cluster.shutdown()
+
+
+class InMemorySchemaSource(SchemaSource):
+    """Offline stand-in for a cluster, holding system_schema rows in memory.
+
+    `latency` seconds are slept in every call to imitate round trips, and `max_in_flight` records the
+    highest number of calls that overlapped, so the concurrency of a sync can be checked.
+    """
+
+    def __init__(self, rows=(), comments=None, latency=0.0):
+        self.lock = threading.Lock()
+        self.schema = defaultdict(lambda: defaultdict(list))
+        self.comments = dict(comments or {})
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        for row in rows:
+            self.schema[row['keyspace_name']][row['table_name']].append(dict(row))
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        """Load a `SELECT * FROM system_schema.columns` CSV export, such as app/schemas/cassandra_schema_columns.csv."""
+        with open(path, newline='') as file:
+            return cls(csv.DictReader(file), **kwargs)
+
+    def put_table(self, keyspace, table, rows, comment=''):
+        with self.lock:
+            self.schema[keyspace][table] = [dict(row, keyspace_name=keyspace, table_name=table) for row in rows]
+            self.comments[(keyspace, table)] = comment
+
+    def drop_table(self, keyspace, table):
+        with self.lock:
+            self.schema[keyspace].pop(table, None)
+            self.comments.pop((keyspace, table), None)
+
+    def drop_keyspace(self, keyspace):
+        with self.lock:
+            self.schema.pop(keyspace, None)
+
+    def _call(self, read):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            with self.lock:
+                return read()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def keyspaces(self):
+        return self._call(lambda: list(self.schema))
+
+    def tables(self, keyspace):
+        return self._call(lambda: {table: self.comments.get((keyspace, table), '')
+                                   for table in self.schema.get(keyspace, {})})
+
+    def columns(self, keyspace):
+        return self._call(lambda: [dict(row) for rows in self.schema.get(keyspace, {}).values() for row in rows])
+
+
+def _schema_row(row):
+    """A system_schema.columns row in the shape normalize_row expects (the driver returns blobs as bytes)."""
+    row = dict(row)
+    if isinstance(row.get('column_name_bytes'), (bytes, bytearray)):
+        row['column_name_bytes'] = '0x' + row['column_name_bytes'].hex()
+    row.pop('note', None)
+    row.pop('tag', None)
+    row.pop('status', None)
+    return row
+
+
+def fetch_keyspace(source, keyspace):
+    """Read one keyspace: {table_name: (rows, fingerprint, comment)}."""
+    comments = source.tables(keyspace)
+    rows_by_table = defaultdict(list)
+    fingerprints = defaultdict(TableFingerprint)
+    for row in source.columns(keyspace):
+        row = _schema_row(row)
+        table = row['table_name']
+        rows_by_table[table].append(row)
+        fingerprints[table].step(*(row.get(field) for field in SCHEMA_FIELDS))
+    # Materialized views have columns but no system_schema.tables row: they are kept, without a comment
+    return {table: (rows, fingerprints[table].finalize(), comments.get(table) or '')
+            for table, rows in rows_by_table.items()}
+
+
+def fetch_schema(source, max_workers=MAX_WORKERS):
+    """Read every non-system keyspace, `max_workers` keyspaces at a time.
+
+    Returns {(keyspace_name, table_name): (rows, fingerprint, comment)}.
+    """
+    keyspaces = [keyspace for keyspace in source.keyspaces() if keyspace not in SYSTEM_KEYSPACES]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='schema-sync') as pool:
+        fetched = pool.map(lambda keyspace: fetch_keyspace(source, keyspace), keyspaces)
+        return {(keyspace, table): entry
+                for keyspace, tables in zip(keyspaces, fetched) for table, entry in tables.items()}
+
+
+def sync_schema(source, user_name='schema-sync', max_workers=MAX_WORKERS, db_file=None):
+    """Bring `columns` in line with the cluster behind `source`, reconciling only the tables that changed.
+
+    Tables whose fingerprint matches the one stored at the previous sync are skipped; tables that are
+    no longer in the cluster have their columns marked deleted. Notes and tags are not part of the
+    cluster schema: existing ones are kept, and a new table's comment becomes its description.
+    With sharded storage every keyspace is reconciled into its own shard, several at a time.
+    The sync runs as an ingestion job (see jobs.run_ingestion), after any upload in progress.
+    Returns the row counts and, per kind, the number of tables.
+    """
+    return run_ingestion(lambda progress: _sync_schema(source, user_name, max_workers, db_file, progress),
+                         user_name=user_name, db_file=db_file)
+
+
+def _sync_schema(source, user_name, max_workers, db_file, progress):
+    started = time.perf_counter()
+    schema = fetch_schema(source, max_workers)
+    fetched_at = time.perf_counter()
+    if shards.ENABLED and db_file is None:
+        parts = defaultdict(dict)
+        for key, entry in schema.items():
+            parts[key[0]][key] = entry
+        result = shards.map_shards(parts, lambda keyspace, part, shard: reconcile_schema(part, user_name, shard,
+                                                                                         progress))
+    else:
+        result = reconcile_schema(schema, user_name, db_file, progress)
+    result['keyspaces'] = len({keyspace for keyspace, _ in schema})
+    result['tables'] = len(schema)
+    result['rows'] = sum(len(rows) for rows, _, _ in schema.values())
+    result['timings'] = {'fetch': fetched_at - started, 'reconcile': time.perf_counter() - fetched_at}
+    return result
+
+
+def reconcile_schema(schema, user_name='schema-sync', db_file=None, progress=None):
+    """Apply fetched tables ({(keyspace_name, table_name): (rows, fingerprint, comment)}) to `columns`;
+    see sync_schema. `progress` is called with the number of staged rows inside the reconciliation
+    transaction, as process_runs does. Returns the row counts and the number of changed and dropped tables."""
+    cursor = get_connection(db_file).cursor()
+    create_staging_table(cursor)
+    create_scope_table(cursor)
+    try:
+        with transaction(cursor.connection):
+            # Decide under the write lock, so that no ingestion can commit between the decisions and the
+            # changes they lead to
+            stored = stored_fingerprints(cursor, 'schema-sync')
+            changed = {key: entry for key, entry in schema.items() if stored.get(key) != entry[1]}
+            cursor.execute("SELECT DISTINCT keyspace_name, table_name FROM columns WHERE status = 'active'")
+            dropped = {tuple(row) for row in cursor.fetchall()} - set(schema)
+            result = {'tables': len(schema), 'changed_tables': len(changed), 'dropped_tables': len(dropped),
+                      'inserted': 0, 'updated': 0, 'deleted': 0}
+            if not changed and not dropped:
+                return result
+
+            for rows, _, _ in changed.values():
+                stage_rows(cursor, rows)
+            carry_annotations(cursor)
+            scope_tables(cursor, [*changed, *dropped])
+            batch_id = start_batch(cursor, 'schema-sync', user_name)
+            result.update(reconcile_staged(cursor, user_name, batch_id, scoped=True))
+            cursor.executemany('''
+                UPDATE table_description SET note = ?
+                WHERE keyspace_name = ? AND table_name = ? AND note = 'no note'
+            ''', [(comment, *key) for key, (_, _, comment) in changed.items() if comment])
+            refresh_stats(cursor)
+            save_fingerprints(cursor, {key: (fingerprint, len(rows)) for key, (rows, fingerprint, _) in changed.items()},
+                              'schema-sync')
+            drop_fingerprints(cursor, dropped)
+            result['snapshot_id'] = record_snapshot(cursor, 'schema-sync', batch_id, [*changed, *dropped])
+            finish_batch(cursor, batch_id, dict(result, rows=sum(len(entry[0]) for entry in changed.values())))
+            if result['inserted'] or result['updated'] or result['deleted']:
+                bump_generation(cursor)
+            if progress:
+                progress(sum(len(entry[0]) for entry in changed.values()))
+    finally:
+        drop_staging_table(cursor)
+    return result
+
+
+def source_from_env():
+    """The CassandraSchemaSource configured by CASSANDRA_CONTACT_POINTS (comma separated), CASSANDRA_PORT,
+    CASSANDRA_USERNAME and CASSANDRA_PASSWORD, or None when no contact point is set."""
+    contact_points = [point.strip() for point in os.getenv('CASSANDRA_CONTACT_POINTS', '').split(',') if point.strip()]
+    if not contact_points:
+        return None
+    return CassandraSchemaSource(contact_points, port=int(os.getenv('CASSANDRA_PORT', '9042')),
+                                 username=os.getenv('CASSANDRA_USERNAME'), password=os.getenv('CASSANDRA_PASSWORD'))
+
+
+class SchemaSyncScheduler:
+    """Runs sync_schema every `interval` seconds on a daemon thread; run_once() also serves manual syncs.
+
+    The source is created lazily by `source_factory` and reused; it is recreated after a failed sync.
+    Every worker process has a scheduler, but a scheduled sync only runs in the one that claims its period
+    (see claim_period), so the database is synced once per interval whatever the number of workers.
+    """
+
+    def __init__(self, source_factory, interval, max_workers=MAX_WORKERS, db_file=None):
+        self.source_factory = source_factory
+        self.interval = interval
+        self.max_workers = max_workers
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.source = None
+        self.last_run = None
+
+    def run_once(self):
+        with self.lock:
+            started_at = datetime.now().isoformat(timespec='seconds')
+            try:
+                if self.source is None:
+                    self.source = self.source_factory()
+                result = sync_schema(self.source, max_workers=self.max_workers, db_file=self.db_file)
+                self.last_run = {'status': 'completed', 'started_at': started_at, 'result': result}
+            except Exception as e:
+                print(f"Schema sync failed: {e}")
+                if self.source is not None:
+                    self.source.close()
+                self.source = None
+                self.last_run = {'status': 'failed', 'started_at': started_at, 'error': str(e)}
+            return self.last_run
+
+    def claim_period(self):
+        """Claim the current scheduling period for this process: True when no scheduled sync started in
+        the last `interval` seconds, in any worker sharing the database."""
+        now = time.time()
+        with transaction(get_connection(self.db_file)) as conn:
+            cursor = conn.execute('''
+                INSERT INTO catalog_meta (name, value) VALUES ('schema_sync_due', ?)
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value WHERE value <= ?
+            ''', (now + self.interval, now))
+            return cursor.rowcount == 1
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            try:
+                claimed = self.claim_period()
+            except Exception as e:
+                print(f"Schema sync scheduling failed: {e}")
+                claimed = False
+            if claimed:
+                self.run_once()
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._loop, name='schema-sync-scheduler', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def after_fork(self):
+        # The sync thread and the cluster session stay behind in the parent; get_scheduler() starts afresh
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.source = None
+
+
+_scheduler = None
+
+
+def _reset_after_fork():
+    if _scheduler is not None:
+        _scheduler.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_scheduler():
+    """The process-wide scheduler for the cluster configured in the environment, or None if there is none.
+
+    SCHEMA_SYNC_INTERVAL (seconds) starts periodic syncs; without it the scheduler only runs on demand.
+    Every worker process runs its own schedule, but only one of them syncs in each period (see
+    SchemaSyncScheduler.claim_period); a manual sync that overlaps it waits for its ingestion claim. A forked
+    process starts its own schedule on its first call.
+    """
+    global _scheduler
+    if _scheduler is None and os.getenv('CASSANDRA_CONTACT_POINTS'):
+        _scheduler = SchemaSyncScheduler(source_from_env, float(os.getenv('SCHEMA_SYNC_INTERVAL') or 0),
+                                         max_workers=int(os.getenv('SCHEMA_SYNC_WORKERS') or MAX_WORKERS))
+    if _scheduler is not None and _scheduler.interval > 0:
+        _scheduler.start()
+    return _scheduler
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import db
+
+# How long a worker trusts the generation it last read before checking SQLite again
+GENERATION_TTL = 1.0
+MAX_ENTRIES = 10000
+
+
+def create_meta_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+
+
+def bump_generation(cursor, name='catalog'):
+    """Record that the catalog changed. Call it inside the transaction that made the change."""
+    cursor.execute('''
+        INSERT INTO catalog_meta (name, value) VALUES (?, 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1
+    ''', (name,))
+    catalog_cache.invalidate()
+
+
+def read_generation(name='catalog', db_file=None):
+    row = db.get_connection(db_file).execute('SELECT value FROM catalog_meta WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+class CatalogCache:
+    """Serialized responses of the catalog navigation endpoints, keyed by the catalog generation.
+
+    Every worker reads the generation counter stored in SQLite at most once per GENERATION_TTL; when it
+    moved, all entries are dropped. Writes made by this process invalidate immediately, but another worker
+    keeps its cached generation for up to GENERATION_TTL (1 s): until then it still serves the older data,
+    and answers 304 to an ETag of that generation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.cached_generation = None
+        self.checked_at = 0.0
+
+    def generation(self):
+        now = time.monotonic()
+        if now - self.checked_at >= GENERATION_TTL:
+            generation = read_generation()
+            with self.lock:
+                if generation != self.cached_generation:
+                    self.entries.clear()
+                    self.cached_generation = generation
+                self.checked_at = now
+        return self.cached_generation
+
+    def invalidate(self):
+        self.checked_at = 0.0
+
+    def etag(self, key):
+        """Strong validator for the entry: changes whenever the catalog generation does."""
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return f'{self.generation()}-{digest}'
+
+    def get(self, key, load):
+        """Return the cached value for `key`, computing it with `load()` on a miss."""
+        generation = self.generation()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        # The generation `load` will read, exactly so inside a read_snapshot: a request whose snapshot predates
+        # the generation another thread already saw must not cache its older data under the newer generation
+        loaded_generation = read_generation()
+        value = load()
+        with self.lock:
+            if generation == self.cached_generation == loaded_generation:
+                self.entries[key] = value
+                if len(self.entries) > MAX_ENTRIES:
+                    self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.cached_generation = None
+        self.checked_at = 0.0
+
+    def after_fork(self):
+        # The parent's lock may have been held: replace rather than acquire it. The entries are kept, so a
+        # worker forked from a warmed up parent starts with them; the generation is checked on first use
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+
+
+catalog_cache = CatalogCache()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=catalog_cache.after_fork)
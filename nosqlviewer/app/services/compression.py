@@ -0,0 +1,112 @@
+import gzip
+import os
+import zlib
+from functools import lru_cache
+
+# Settings, read from the environment by configure()
+ENABLED = True
+MIN_SIZE = 1024
+
+# Server preference between encodings the client accepts with the same quality
+ENCODINGS = ('zstd', 'br', 'gzip')
+# Levels for bodies compressed on every request, and for cached ones, compressed once per catalog generation
+LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+CACHED_LEVELS = {'zstd': 12, 'br': 9, 'gzip': 9}
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'application/vnd.apache.arrow.stream',
+                          'text/csv', 'text/plain', 'text/html'}
+
+
+def configure():
+    """Read the compression settings from the environment (called by create_app, after .env is loaded).
+
+    COMPRESSION_ENABLED=false serves every response as is. Bodies smaller than COMPRESSION_MIN_SIZE
+    bytes are not worth the encoding headers and are never compressed.
+    """
+    global ENABLED, MIN_SIZE
+    ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE') or MIN_SIZE)
+
+
+@lru_cache(maxsize=None)
+def available_encodings():
+    """ENCODINGS whose codec is installed: zstd needs zstandard, br needs brotli (or brotlipy)."""
+    available = []
+    for encoding, module in (('zstd', 'zstandard'), ('br', 'brotli'), ('gzip', 'zlib')):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        available.append(encoding)
+    return tuple(available)
+
+
+def negotiate(accept_encodings):
+    """The encoding to use for a request's Accept-Encoding (werkzeug's request.accept_encodings), or None
+    for an identity response."""
+    if not ENABLED:
+        return None
+    return accept_encodings.best_match(available_encodings())
+
+
+def compressible(response):
+    return (ENABLED and 200 <= response.status_code < 300 and response.status_code not in (204, 206)
+            and 'Content-Encoding' not in response.headers and not response.direct_passthrough
+            and response.mimetype in COMPRESSIBLE_MIMETYPES)
+
+
+def compress(data, encoding, level=None):
+    """Compress a whole body with one of available_encodings()."""
+    level = LEVELS[encoding] if level is None else level
+    if encoding == 'zstd':
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == 'br':
+        import brotli
+
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding, level=None):
+    """Compress a streamed body chunk by chunk, flushing after each one so the client is not kept waiting
+    for data the server has already produced."""
+    level = LEVELS[encoding] if level is None else level
+    if encoding == 'zstd':
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        process = compressor.compress
+        flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)  # noqa: E731
+        finish = compressor.flush
+    elif encoding == 'br':
+        import brotli
+
+        compressor = brotli.Compressor(quality=level)
+        # Google's brotli calls it process(), brotlipy compress()
+        process = getattr(compressor, 'process', None) or compressor.compress
+        flush, finish = compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)  # noqa: E731
+        finish = compressor.flush
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield process(chunk) + flush()
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+def encoded(response, encoding):
+    """Mark a response as holding a body in `encoding`. Its ETag becomes weak: the bytes differ from the
+    identity representation's, while If-None-Match (weak comparison) still matches either."""
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from . import metrics
+
+DB_FILE = 'nosql_viewer.db'
+
+# Applied to every new connection. journal_mode=WAL lets readers run while a writer holds the lock,
+# synchronous=NORMAL is durable in WAL mode without an fsync per commit.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64000),  # KiB, i.e. 64MB page cache per connection
+    ('mmap_size', 268435456),
+    ('busy_timeout', 5000),
+)
+
+_local = threading.local()
+# Connections inherited from the parent process, kept referenced for as long as the child lives
+_inherited = []
+
+
+def _reset_after_fork():
+    # Connections inherited from the parent must never be used or closed by the child, and letting them be
+    # garbage collected would close them: closing the last connection a process sees can checkpoint and
+    # delete the WAL the parent still uses. Keep them aside, unused, and let every thread reconnect lazily.
+    global _local
+    _inherited.extend(getattr(_local, 'connections', {}).values())
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def set_db_file(db_file):
+    """Point the connection manager at another database file."""
+    global DB_FILE
+    DB_FILE = db_file
+    close_connections()
+
+
+def connect(db_file=None):
+    """Open a new, unpooled connection with the standard pragmas applied."""
+    conn = sqlite3.connect(db_file or DB_FILE, isolation_level=None,
+                           factory=metrics.InstrumentedConnection if metrics.ENABLED else sqlite3.Connection)
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def _connections():
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _inherited.extend(getattr(_local, 'connections', {}).values())
+        _local.pid = pid
+        _local.connections = {}
+    return _local.connections
+
+
+def get_connection(db_file=None):
+    """Return the long-lived connection of the current thread for the given database file.
+
+    Connections run in autocommit mode; use `transaction()` to group writes.
+    """
+    db_file = db_file or DB_FILE
+    connections = _connections()
+    conn = connections.get(db_file)
+    if conn is None:
+        conn = connections[db_file] = connect(db_file)
+    return conn
+
+
+def close_connections():
+    """Close every pooled connection owned by the current thread."""
+    connections = _connections()
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+@contextmanager
+def transaction(conn=None, mode='IMMEDIATE'):
+    """Run the enclosed statements in one transaction, joining an already open one."""
+    conn = conn or get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute(f'BEGIN {mode}')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@contextmanager
+def read_snapshot(conn=None):
+    """Serve the enclosed reads from one committed version of the database.
+
+    In WAL mode a read transaction sees the database as of its first statement and never waits for the
+    writer: an ingestion reconciling meanwhile stays invisible until it commits, and then appears as a
+    whole on the next snapshot. Joins an already open transaction. Nothing inside may write, since a
+    snapshot that fell behind a commit cannot be upgraded to a write transaction.
+    """
+    conn = conn or get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN DEFERRED')
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+
+
+def query_database(query, params=(), fetchall=True, db_file=None):
+    """Helper function to execute database queries."""
+    cur = get_connection(db_file).cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute(query, params)
+    results = cur.fetchall() if fetchall else cur.fetchone()
+    started = time.perf_counter()
+    rows = [dict(row) for row in results] if fetchall else dict(results) if results else None
+    metrics.add_phase('rows', time.perf_counter() - started)
+    return rows
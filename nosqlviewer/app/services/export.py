@@ -0,0 +1,151 @@
+import csv
+import io
+
+from .db import connect
+from .pagination import stream_rows
+
+# Rows fetched per cursor batch; each batch becomes one Arrow record batch or Parquet row group
+EXPORT_BATCH_SIZE = 50000
+CSV_BATCH_SIZE = 5000
+
+# Exportable tables and the fields their `keyspace` and `status` filters apply to
+EXPORT_TABLES = {
+    'columns': {'keyspace': ('keyspace_name',), 'status': 'status'},
+    'table_description': {'keyspace': ('keyspace_name',), 'status': None},
+    'relations': {'keyspace': ('from_keyspace', 'to_keyspace'), 'status': None},
+    'update_logs': {'keyspace': ('keyspace_name',), 'status': None},
+}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def build_export_query(table, keyspace=None, status=None):
+    """SELECT for one exportable table, in rowid order; raises ValueError for an unknown table or filter."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table '{table}'; expected one of {', '.join(EXPORT_TABLES)}")
+    filters = EXPORT_TABLES[table]
+    conditions, params = [], []
+    if keyspace:
+        conditions.append('(' + ' OR '.join(f'{field} = ?' for field in filters['keyspace']) + ')')
+        params += [keyspace] * len(filters['keyspace'])
+    if status:
+        if not filters['status']:
+            raise ValueError(f"Table '{table}' cannot be filtered by status")
+        conditions.append(f"{filters['status']} = ?")
+        params.append(status)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'SELECT * FROM "{table}"{where} ORDER BY rowid', params
+
+
+def _batches(query, params, batch_size, db_file=None):
+    """Yield the column names, then lists of row tuples, from a dedicated connection reading one snapshot
+    (see stream_rows)."""
+    conn = connect(db_file)
+    try:
+        cursor = conn.execute(query, params)
+        yield [description[0] for description in cursor.description]
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        conn.close()
+
+
+def stream_csv(query, params=(), db_file=None):
+    """Yield the query's rows as CSV text, header first."""
+    batches = _batches(query, params, CSV_BATCH_SIZE, db_file)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(batches))
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def arrow_schema(table, db_file=None):
+    """Arrow schema of a table, from its declared SQLite column types."""
+    import pyarrow as pa
+
+    types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    conn = connect(db_file)
+    try:
+        info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+    finally:
+        conn.close()
+    return pa.schema([(name, types.get(declared.upper(), pa.string())) for _, name, declared, *_ in info])
+
+
+def _arrow_column(values, data_type):
+    import pyarrow as pa
+
+    if pa.types.is_string(data_type):
+        try:
+            return pa.array(values, type=data_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # SQLite does not enforce declared types: a text column may hold the odd number
+            return pa.array([None if value is None else str(value) for value in values], type=data_type)
+    return pa.array(values, type=data_type)
+
+
+def _record_batches(query, params, schema, db_file=None):
+    """Yield Arrow record batches built column-wise from cursor batches, without per-row dicts."""
+    import pyarrow as pa
+
+    batches = _batches(query, params, EXPORT_BATCH_SIZE, db_file)
+    next(batches)
+    for batch in batches:
+        yield pa.RecordBatch.from_arrays(
+            [_arrow_column(values, field.type) for values, field in zip(zip(*batch), schema)], schema=schema)
+
+
+def stream_columnar(query, params, schema, fmt, db_file=None):
+    """Yield the query's rows as an Arrow IPC stream or a zstd-compressed Parquet file, a record batch
+    (Parquet row group) at a time."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema) if fmt == 'arrow' else pq.ParquetWriter(sink, schema,
+                                                                                    compression='zstd')
+    try:
+        for batch in _record_batches(query, params, schema, db_file):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    finally:
+        writer.close()
+    yield sink.getvalue()
+
+
+def export_table(table, fmt='ndjson', keyspace=None, status=None, db_file=None):
+    """Stream a catalog table in one of EXPORT_FORMATS. Returns (chunks, mimetype, filename).
+
+    The query is validated before anything is streamed: an unknown table, format or filter raises
+    ValueError, and a columnar format without pyarrow installed raises RuntimeError.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'; expected one of {', '.join(EXPORT_FORMATS)}")
+    query, params = build_export_query(table, keyspace, status)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f'{table}.{extension}'
+    if fmt == 'csv':
+        return stream_csv(query, params, db_file), mimetype, filename
+    if fmt == 'ndjson':
+        return stream_rows(query, params, db_file=db_file), mimetype, filename
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError('Arrow and Parquet exports require the pyarrow package') from e
+    return stream_columnar(query, params, arrow_schema(table, db_file), fmt, db_file), mimetype, filename
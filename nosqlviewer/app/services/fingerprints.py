@@ -0,0 +1,115 @@
+import hashlib
+from datetime import datetime
+
+_MASK = (1 << 128) - 1
+
+
+def create_fingerprint_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_fingerprints (
+            keyspace_name TEXT,
+            table_name TEXT,
+            fingerprint TEXT,
+            column_count INTEGER,
+            updated_at TEXT,
+            PRIMARY KEY (keyspace_name, table_name)
+        )
+    ''')
+    # A fingerprint vouches for the rows as last ingested: any other change to the table (an annotation,
+    # a manual edit) drops it, so the next ingestion compares that table row by row again
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS columns_fingerprint_invalidate AFTER UPDATE ON columns BEGIN
+            DELETE FROM table_fingerprints
+            WHERE keyspace_name = old.keyspace_name AND table_name = old.table_name;
+        END
+    ''')
+
+
+def key_fingerprints_by_source(cursor):
+    # Uploads hash whole rows, annotations included, and schema syncs only the fields the cluster knows
+    # (cassandra_schema.SCHEMA_FIELDS): each keeps fingerprints of its own. The existing ones are dropped,
+    # so every table is compared row by row once more.
+    cursor.execute('DROP TABLE table_fingerprints')
+    cursor.execute('''
+        CREATE TABLE table_fingerprints (
+            keyspace_name TEXT,
+            table_name TEXT,
+            source TEXT,
+            fingerprint TEXT,
+            column_count INTEGER,
+            updated_at TEXT,
+            PRIMARY KEY (keyspace_name, table_name, source)
+        )
+    ''')
+    # A new column invalidates the table's fingerprints like an update does: the source that inserted it
+    # saves its own again after reconciling, the other one compares the table row by row next time
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS columns_fingerprint_invalidate_insert AFTER INSERT ON columns BEGIN
+            DELETE FROM table_fingerprints
+            WHERE keyspace_name = new.keyspace_name AND table_name = new.table_name;
+        END
+    ''')
+
+
+def row_text(values):
+    """The text a row is hashed as; `'\x1e'.join` of several row texts hashes a run of rows at once."""
+    return '\x1f'.join('\x00' if value is None else str(value) for value in values)
+
+
+class TableFingerprint:
+    """Digest of the rows of one table, independent of their order.
+
+    Each row, or run of consecutive rows, is hashed on its own and the hashes are summed, so rows can be
+    fed as they arrive (or from an SQL GROUP BY, as an aggregate) without sorting. A run hashed in one
+    piece is order dependent within itself. Rows of different shapes never hash alike.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, text, count=1):
+        """Add the hash of `text`, the row_text of one row or the joined row texts of `count` rows."""
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        self.total = (self.total + int.from_bytes(digest, 'big')) & _MASK
+        self.count += count
+
+    def step(self, *values):
+        self.add(row_text(values))
+
+    def merge(self, other):
+        """Fold in the rows of another fingerprint of the same table."""
+        self.total = (self.total + other.total) & _MASK
+        self.count += other.count
+
+    def finalize(self):
+        return f'{self.count}-{self.total:032x}'
+
+
+def register_fingerprint_aggregate(conn):
+    """Make table_fingerprint(values...) available in SQL as an aggregate."""
+    conn.create_aggregate('table_fingerprint', -1, TableFingerprint)
+
+
+def stored_fingerprints(cursor, source):
+    """{(keyspace_name, table_name): fingerprint} for every table with a valid fingerprint from `source`
+    ('upload' or 'schema-sync')."""
+    cursor.execute('SELECT keyspace_name, table_name, fingerprint FROM table_fingerprints WHERE source = ?', (source,))
+    return {(keyspace_name, table_name): fingerprint for keyspace_name, table_name, fingerprint in cursor.fetchall()}
+
+
+def save_fingerprints(cursor, fingerprints, source):
+    """Store {(keyspace_name, table_name): (fingerprint, column_count)} for `source`. Call it after reconciling
+    those tables."""
+    updated_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+    cursor.executemany('''
+        INSERT INTO table_fingerprints (keyspace_name, table_name, source, fingerprint, column_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (keyspace_name, table_name, source) DO UPDATE
+        SET fingerprint = excluded.fingerprint, column_count = excluded.column_count, updated_at = excluded.updated_at
+    ''', [(*key, source, fingerprint, count, updated_at) for key, (fingerprint, count) in fingerprints.items()])
+
+
+def drop_fingerprints(cursor, tables):
+    """Drop the fingerprints of every source for the given tables."""
+    cursor.executemany('DELETE FROM table_fingerprints WHERE keyspace_name = ? AND table_name = ?', list(tables))
@@ -0,0 +1,137 @@
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from . import db
+
+DEFAULT_THRESHOLD = 0.5
+
+_word_split = re.compile(r'[^0-9a-z]+')
+
+
+def trigrams(text):
+    """pg_trgm style trigrams: every lower-cased word padded with two leading blanks and one trailing blank."""
+    grams = set()
+    for word in _word_split.split(text.lower()):
+        if word:
+            padded = f'  {word} '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramIndex:
+    """Inverted index from trigram to the ids of the terms containing it."""
+
+    def __init__(self):
+        self.terms = []
+        self.term_ids = {}
+        self.gram_counts = []
+        self.postings = defaultdict(list)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, term):
+        if term in self.term_ids:
+            return
+        term_id = self.term_ids[term] = len(self.terms)
+        grams = trigrams(term)
+        self.terms.append(term)
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(term_id)
+
+    def search(self, query, threshold=DEFAULT_THRESHOLD, limit=None):
+        """Return (term, score) pairs whose score reaches `threshold`, best first.
+
+        The score is the share of the query's trigrams found in the term (pg_trgm's word similarity), so a
+        typo or a prefix still finds longer names; ties are broken by plain trigram similarity.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.postings.get(gram, ()))
+        needed = threshold * len(query_grams)
+        matches = []
+        for term_id, count in shared.items():
+            if count >= needed:
+                similarity = count / (len(query_grams) + self.gram_counts[term_id] - count)
+                matches.append((count / len(query_grams), similarity, self.terms[term_id]))
+        matches.sort(key=lambda match: (-match[0], -match[1], match[2]))
+        return [(term, score) for score, _, term in matches[:limit]]
+
+
+class ColumnNameIndex:
+    """NgramIndex over the distinct column names of `columns`, cached in memory and kept current incrementally.
+
+    Ingestion only ever appends rows to `columns` (removed columns are just marked deleted), so every
+    refresh indexes the rows above the highest rowid seen so far, which also picks up uploads handled by
+    other workers. The index is rebuilt from scratch only if the table shrank.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self.index = NgramIndex()
+        self.max_rowid = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        conn = db.get_connection(self.db_file)
+        if self._max_rowid(conn) == self.max_rowid:
+            return
+        with self.lock:
+            max_rowid = self._max_rowid(conn)
+            if max_rowid < self.max_rowid:
+                self.index, self.max_rowid = NgramIndex(), 0
+            new_names = conn.execute('SELECT DISTINCT column_name FROM columns WHERE rowid > ? AND rowid <= ?',
+                                     (self.max_rowid, max_rowid))
+            for (column_name,) in new_names:
+                self.index.add(column_name)
+            self.max_rowid = max(self.max_rowid, max_rowid)
+
+    @staticmethod
+    def _max_rowid(conn):
+        return conn.execute('SELECT MAX(rowid) FROM columns').fetchone()[0] or 0
+
+    def search(self, query, threshold=DEFAULT_THRESHOLD, limit=None):
+        self.refresh()
+        return self.index.search(query, threshold, limit)
+
+
+_indexes = {}
+
+
+def _reset_after_fork():
+    # Indexes loaded by the parent (see warm_up) stay valid and are shared copy-on-write; their locks may
+    # have been held at fork
+    for index in _indexes.values():
+        index.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_column_name_index(db_file=None):
+    db_file = db_file or db.DB_FILE
+    if db_file not in _indexes:
+        _indexes[db_file] = ColumnNameIndex(db_file)
+    return _indexes[db_file]
+
+
+def fuzzy_search_columns(search, threshold=DEFAULT_THRESHOLD, limit=100, db_file=None):
+    """Return up to `limit` rows of `columns` whose column name is similar to `search`, most similar first,
+    each with its `similarity` score."""
+    names = dict(get_column_name_index(db_file).search(search, threshold, limit))
+    if not names:
+        return []
+    rows = db.query_database('SELECT * FROM columns WHERE column_name IN (SELECT value FROM json_each(?))',
+                             (json.dumps(list(names)),), db_file=db_file)
+    for row in rows:
+        row['similarity'] = round(names[row['column_name']], 4)
+    rows.sort(key=lambda row: (-row['similarity'], row['keyspace_name'], row['table_name'], row['column_name']))
+    return rows[:limit]
@@ -0,0 +1,179 @@
+import ast
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from .db import get_connection, query_database, transaction
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+LEGACY_BATCH_SIZE = 5000
+ENTRY_FIELDS = ('id', 'batch_id', 'user_name', 'timestamp', 'action', 'keyspace_name', 'table_name', 'column_name',
+                'changes', 'existing_data', 'updated_data')
+LEGACY_COLUMN_FIELDS = ('keyspace_name', 'table_name', 'column_name', 'clustering_order', 'column_name_bytes', 'kind',
+                        'position', 'type', 'note', 'tag', 'status')
+LEGACY_TABLE_FIELDS = ('keyspace_name', 'table_name', 'note', 'tag')
+
+
+def create_history_tables(cursor):
+    for column in ('batch_id', 'action', 'keyspace_name', 'table_name', 'column_name', 'changes'):
+        cursor.execute(f'ALTER TABLE update_logs ADD COLUMN {column} TEXT')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_batches (
+            id TEXT PRIMARY KEY,
+            source TEXT,
+            user_name TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            rows INTEGER,
+            inserted INTEGER,
+            updated INTEGER,
+            deleted INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_update_logs_entity
+        ON update_logs (keyspace_name, table_name, column_name, timestamp)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_update_logs_timestamp ON update_logs (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_update_logs_batch ON update_logs (batch_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ingest_batches_started_at ON ingest_batches (started_at)')
+
+
+def now():
+    """Log timestamps: sortable text with millisecond resolution."""
+    return datetime.now().isoformat(sep=' ', timespec='milliseconds')
+
+
+def _diff(fields, old, new):
+    return {field: [before, after] for field, before, after in zip(fields, old, new) if before != after}
+
+
+def register_diff_function(conn, name, fields):
+    """Make name(old values..., new values...) available in SQL, returning the JSON field-level diff."""
+    count = len(fields)
+    conn.create_function(name, 2 * count, lambda *values: json.dumps(_diff(fields, values[:count], values[count:])),
+                         deterministic=True)
+
+
+def start_batch(cursor, source, user_name='admin'):
+    """Open an ingest batch that the following update_logs entries are attached to."""
+    batch_id = uuid.uuid4().hex
+    cursor.execute('INSERT INTO ingest_batches (id, source, user_name, started_at) VALUES (?, ?, ?, ?)',
+                   (batch_id, source, user_name, now()))
+    return batch_id
+
+
+def finish_batch(cursor, batch_id, counts):
+    cursor.execute('''
+        UPDATE ingest_batches SET finished_at = ?, rows = ?, inserted = ?, updated = ?, deleted = ? WHERE id = ?
+    ''', (now(), counts.get('rows'), counts.get('inserted'), counts.get('updated'), counts.get('deleted'), batch_id))
+
+
+def query_history(keyspace_name=None, table_name=None, column_name=None, since=None, until=None, batch_id=None,
+                  action=None, after=None, limit=DEFAULT_PAGE_SIZE, db_file=None):
+    """Return one page of update_logs entries, newest first, and the `after` id of the next page."""
+    conditions, params = [], []
+    for field, value in (('keyspace_name', keyspace_name), ('table_name', table_name),
+                         ('column_name', column_name), ('batch_id', batch_id), ('action', action)):
+        if value:
+            conditions.append(f'{field} = ?')
+            params.append(value)
+    if since:
+        conditions.append('timestamp >= ?')
+        params.append(since)
+    if until:
+        conditions.append('timestamp < ?')
+        params.append(until)
+    if after:
+        conditions.append('id < ?')
+        params.append(int(after))
+    limit = min(limit, MAX_PAGE_SIZE)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    entries = query_database(f"SELECT {', '.join(ENTRY_FIELDS)} FROM update_logs {where} ORDER BY id DESC LIMIT ?",
+                             (*params, limit), db_file=db_file)
+    for entry in entries:
+        entry['changes'] = json.loads(entry['changes']) if entry['changes'] else None
+        # Only entries written before structured logging carry the tuple text
+        if entry['existing_data'] is None and entry['updated_data'] is None:
+            del entry['existing_data'], entry['updated_data']
+    return entries, (entries[-1]['id'] if len(entries) == limit else None)
+
+
+def _structure_legacy_entry(existing_data, updated_data):
+    """(action, keyspace, table, column, changes) for an entry holding Python tuple text, or None if unparsable."""
+    try:
+        old = None if existing_data in (None, 'None') else ast.literal_eval(existing_data)
+        new = None if updated_data in (None, 'none') else ast.literal_eval(updated_data)
+    except (ValueError, SyntaxError):
+        return None
+    row = old or new
+    if not isinstance(row, tuple) or len(row) not in (len(LEGACY_COLUMN_FIELDS), len(LEGACY_TABLE_FIELDS)):
+        return None
+    fields = LEGACY_COLUMN_FIELDS if len(row) == len(LEGACY_COLUMN_FIELDS) else LEGACY_TABLE_FIELDS
+    keys = row[:3] if fields is LEGACY_COLUMN_FIELDS else (*row[:2], None)
+    if old is None:
+        action, changes = 'insert', _diff(fields, [None] * len(fields), new)
+    elif new is None:
+        action, changes = 'delete', {'status': [old[-1], 'deleted']}
+    else:
+        action, changes = 'update', _diff(fields, old, new)
+    return (action, *keys, json.dumps(changes))
+
+
+def compact_update_logs(max_age_days=None, keep_batches=None, db_file=None):
+    """Keep update_logs small: drop entries older than `max_age_days` or outside the newest `keep_batches`
+    batches, and rewrite pre-structured entries (Python tuple text) as keyed JSON diffs.
+
+    Returns the number of deleted and rewritten entries. Freed pages are reused by later writes.
+    """
+    conn = get_connection(db_file)
+    result = {'deleted': 0, 'restructured': 0}
+    with transaction(conn):
+        if max_age_days is not None:
+            cutoff = (datetime.now() - timedelta(days=float(max_age_days))).isoformat(sep=' ')
+            result['deleted'] += conn.execute('DELETE FROM update_logs WHERE timestamp < ?', (cutoff,)).rowcount
+            conn.execute('DELETE FROM ingest_batches WHERE started_at < ?', (cutoff,))
+        if keep_batches is not None:
+            conn.execute('''
+                DELETE FROM ingest_batches WHERE id NOT IN (
+                    SELECT id FROM ingest_batches ORDER BY started_at DESC LIMIT ?
+                )
+            ''', (int(keep_batches),))
+            result['deleted'] += conn.execute('''
+                DELETE FROM update_logs
+                WHERE batch_id IS NOT NULL AND batch_id NOT IN (SELECT id FROM ingest_batches)
+            ''').rowcount
+
+    # Legacy entries are rewritten in bounded chunks so the write lock is never held for long
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, existing_data, updated_data FROM update_logs
+            WHERE id > ? AND changes IS NULL AND (existing_data IS NOT NULL OR updated_data IS NOT NULL)
+            ORDER BY id LIMIT ?
+        ''', (last_id, LEGACY_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        structured = [(entry, entry_id) for entry_id, existing, updated in rows
+                      for entry in [_structure_legacy_entry(existing, updated)] if entry]
+        with transaction(conn):
+            conn.executemany('''
+                UPDATE update_logs
+                SET action = ?, keyspace_name = ?, table_name = ?, column_name = ?, changes = ?,
+                    existing_data = NULL, updated_data = NULL
+                WHERE id = ?
+            ''', [(*entry, entry_id) for entry, entry_id in structured])
+        result['restructured'] += len(structured)
+        last_id = rows[-1][0]
+    return result
+
+
+def apply_retention(db_file=None):
+    """Run compact_update_logs with the limits set by UPDATE_LOG_RETENTION_DAYS and UPDATE_LOG_KEEP_BATCHES,
+    if any. Read on every call, so values loaded from .env after import are honoured."""
+    max_age_days = os.getenv('UPDATE_LOG_RETENTION_DAYS')
+    keep_batches = os.getenv('UPDATE_LOG_KEEP_BATCHES')
+    if max_age_days or keep_batches:
+        return compact_update_logs(max_age_days=max_age_days or None, keep_batches=keep_batches or None,
+                                   db_file=db_file)
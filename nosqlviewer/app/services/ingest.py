@@ -0,0 +1,300 @@
+import time
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from .catalog_cache import bump_generation
+from .db import get_connection, transaction
+from .fingerprints import TableFingerprint, drop_fingerprints, row_text, save_fingerprints, stored_fingerprints
+from .history import apply_retention, finish_batch, now, register_diff_function, start_batch
+from .metrics import observe_ingestion
+from .snapshots import record_snapshot
+from .stats import refresh_stats
+
+BATCH_SIZE = 5000
+
+COLUMN_FIELDS = ('keyspace_name', 'table_name', 'column_name', 'clustering_order', 'column_name_bytes', 'kind',
+                 'position', 'type', 'note', 'tag', 'status')
+KEY_FIELDS = COLUMN_FIELDS[:3]
+VALUE_FIELDS = COLUMN_FIELDS[3:]
+
+_changed = ' OR '.join(f's.{field} IS NOT c.{field}' for field in VALUE_FIELDS)
+_key_match = ' AND '.join(f's.{field} = c.{field}' for field in KEY_FIELDS)
+_columns = ', '.join(COLUMN_FIELDS)
+
+
+def _value(row, field, default=''):
+    value = row.get(field)
+    return value.strip() if isinstance(value, str) else default
+
+
+def normalize_row(row):
+    """Turn one CSV dict into a `columns` tuple, or None when the key fields are missing."""
+    keyspace_name = _value(row, 'keyspace_name')
+    table_name = _value(row, 'table_name')
+    column_name = _value(row, 'column_name')
+    if not keyspace_name or not table_name or not column_name:
+        return None
+    try:
+        position = int(row.get('position', ''))
+    except (ValueError, TypeError):
+        position = 0
+    if not -2 ** 63 <= position < 2 ** 63:
+        # Beyond what SQLite can store
+        position = 0
+    return (keyspace_name, table_name, column_name,
+            _value(row, 'clustering_order'),
+            _value(row, 'column_name_bytes'),
+            _value(row, 'kind'),
+            position,
+            _value(row, 'type'),
+            _value(row, 'note') or 'no note',
+            _value(row, 'tag') or 'no tags',
+            _value(row, 'status') or 'active')
+
+
+def create_staging_table(cursor):
+    cursor.execute('DROP TABLE IF EXISTS temp.staged_columns')
+    cursor.execute('''
+        CREATE TEMP TABLE staged_columns (
+            keyspace_name TEXT,
+            table_name TEXT,
+            column_name TEXT,
+            clustering_order TEXT,
+            column_name_bytes TEXT,
+            kind TEXT,
+            position INTEGER,
+            type TEXT,
+            note TEXT,
+            tag TEXT,
+            status TEXT,
+            PRIMARY KEY (keyspace_name, table_name, column_name)
+        )
+    ''')
+
+
+def drop_staging_table(cursor):
+    cursor.execute('DROP TABLE IF EXISTS temp.staged_columns')
+    cursor.execute('DROP TABLE IF EXISTS temp.staged_tables')
+
+
+def create_scope_table(cursor):
+    """Create `temp.staged_tables`, the tables a scoped reconcile may mark columns deleted in."""
+    cursor.execute('DROP TABLE IF EXISTS temp.staged_tables')
+    cursor.execute('''
+        CREATE TEMP TABLE staged_tables (
+            keyspace_name TEXT,
+            table_name TEXT,
+            PRIMARY KEY (keyspace_name, table_name)
+        )
+    ''')
+
+
+def scope_tables(cursor, tables):
+    cursor.executemany('INSERT OR IGNORE INTO temp.staged_tables (keyspace_name, table_name) VALUES (?, ?)',
+                       list(tables))
+
+
+def carry_annotations(cursor):
+    """Give staged rows the note and tag their column already has, for sources that carry no annotations."""
+    cursor.execute(f'''
+        UPDATE temp.staged_columns AS s SET note = c.note, tag = c.tag
+        FROM columns c WHERE {_key_match}
+    ''')
+
+
+def _insert_staged(cursor, rows):
+    before = cursor.connection.total_changes
+    cursor.executemany(f'INSERT OR IGNORE INTO temp.staged_columns ({_columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       rows)
+    return cursor.connection.total_changes - before
+
+
+def stage_rows(cursor, rows):
+    """Normalize CSV dicts and bulk load them into the staging table. Returns the number of staged rows."""
+    return _insert_staged(cursor, filter(None, map(normalize_row, rows)))
+
+
+def restage_table(cursor, keyspace_name, table_name):
+    """Stage a table's columns as they were last ingested, from `columns` itself.
+
+    Only valid while the table's stored fingerprint matches: the export's rows were then applied as is
+    and nothing has updated them since.
+    """
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO temp.staged_columns ({_columns})
+        SELECT {_columns} FROM columns
+        WHERE keyspace_name = ? AND table_name = ? AND status = 'active'
+    ''', (keyspace_name, table_name))
+
+
+def table_runs(rows):
+    """Group `columns` tuples into runs of consecutive rows of one table: yields (key, fingerprint, rows).
+
+    Schema exports list a table's columns together, so a table normally comes as a single run. The
+    fingerprint hashes the run's rows in one piece, in order.
+    """
+    for key, run in groupby(rows, key=itemgetter(0, 1)):
+        run = list(run)
+        fingerprint = TableFingerprint()
+        fingerprint.add('\x1e'.join(row_text(row[2:]) for row in run), len(run))
+        yield key, fingerprint, run
+
+
+def reconcile_staged(cursor, user_name='admin', batch_id=None, scoped=False):
+    """Apply the staging table to `columns` with set-based statements, logging every change to `update_logs`.
+
+    Rows that differ are updated, unknown rows inserted and rows missing from the staging table marked
+    deleted; with `scoped`, only rows of the tables listed in `temp.staged_tables` can be marked deleted.
+    Each change is logged once, keyed by column, with a JSON diff of the fields that moved.
+    Returns the inserted/updated/deleted counts.
+    """
+    register_diff_function(cursor.connection, 'column_diff', VALUE_FIELDS)
+    log = ('INSERT INTO update_logs (user_name, timestamp, batch_id, action, keyspace_name, table_name, column_name, '
+           'changes)')
+    entry = (user_name, now(), batch_id)
+    staged_values = ', '.join(f's.{field}' for field in VALUE_FIELDS[:-1]) + ", 'active'"
+    counts = {}
+
+    # Changed rows: log the previous values before overwriting them
+    cursor.execute(f'''
+        {log}
+        SELECT ?, ?, ?, 'update', c.keyspace_name, c.table_name, c.column_name,
+               column_diff({', '.join('c.' + field for field in VALUE_FIELDS)}, {staged_values})
+        FROM temp.staged_columns s JOIN columns c ON {_key_match}
+        WHERE {_changed}
+    ''', entry)
+    counts['updated'] = cursor.rowcount
+    cursor.execute(f'''
+        UPDATE columns AS c
+        SET clustering_order = s.clustering_order, column_name_bytes = s.column_name_bytes, kind = s.kind,
+            position = s.position, type = s.type, note = s.note, tag = s.tag, status = 'active'
+        FROM temp.staged_columns s
+        WHERE {_key_match} AND ({_changed})
+    ''')
+
+    # Rows no longer present in the export; those already marked deleted are left alone
+    missing = f"c.status IS NOT 'deleted' AND NOT EXISTS (SELECT 1 FROM temp.staged_columns s WHERE {_key_match})"
+    if scoped:
+        missing += ' AND (c.keyspace_name, c.table_name) IN (SELECT keyspace_name, table_name FROM temp.staged_tables)'
+    cursor.execute(f'''
+        {log}
+        SELECT ?, ?, ?, 'delete', c.keyspace_name, c.table_name, c.column_name,
+               json_object('status', json_array(c.status, 'deleted'))
+        FROM columns c
+        WHERE {missing}
+    ''', entry)
+    counts['deleted'] = cursor.rowcount
+    cursor.execute(f"UPDATE columns AS c SET status = 'deleted' WHERE {missing}")
+
+    # Give new tables a description row to annotate. This goes before the new columns: the search index
+    # triggers then read it when indexing them, instead of rewriting their index rows table by table
+    cursor.execute('''
+        INSERT OR IGNORE INTO table_description (keyspace_name, table_name, note, tag)
+        SELECT DISTINCT keyspace_name, table_name, 'no note', 'no tag'
+        FROM temp.staged_columns
+    ''')
+
+    # New rows
+    cursor.execute(f'''
+        {log}
+        SELECT ?, ?, ?, 'insert', s.keyspace_name, s.table_name, s.column_name,
+               column_diff({', '.join('NULL' for _ in VALUE_FIELDS)}, {staged_values})
+        FROM temp.staged_columns s
+        WHERE NOT EXISTS (SELECT 1 FROM columns c WHERE {_key_match})
+    ''', entry)
+    counts['inserted'] = cursor.rowcount
+    cursor.execute(f'''
+        INSERT INTO columns ({_columns})
+        SELECT {', '.join('s.' + field for field in COLUMN_FIELDS[:-1])}, 'active'
+        FROM temp.staged_columns s
+        WHERE NOT EXISTS (SELECT 1 FROM columns c WHERE {_key_match})
+    ''')
+
+    return counts
+
+
+def process_csv_data(csv_data, user_name='admin', batch_size=BATCH_SIZE, progress=None, db_file=None):
+    """Reconcile the `columns` table with a full schema export given as CSV dicts. See process_runs."""
+    return process_runs(table_runs(filter(None, map(normalize_row, csv_data))), user_name, batch_size, progress,
+                        db_file)
+
+
+def process_runs(runs, user_name='admin', batch_size=BATCH_SIZE, progress=None, db_file=None):
+    """Reconcile the `columns` table with a full schema export, given as table runs (see table_runs).
+
+    `runs` may be lazy, such as a reader over the request stream: rows are staged in batches of
+    `batch_size` so memory stays bounded, and the write lock is only held for the final reconciliation.
+    A run's rows may be any iterable, or None for a table's first run when the caller already found it
+    unchanged (see process_sharded_runs); they are only iterated when the run has to be staged. `progress`
+    is called with the number of rows read so far every `batch_size` rows, and once more inside the
+    reconciliation transaction so that a job's heartbeat commits along with it.
+
+    A table whose fingerprint matches the one stored when it was last uploaded is neither staged nor
+    reconciled. Tables missing from the export still have their columns marked deleted. The resulting
+    schema is snapshotted (see record_snapshot) in the same transaction.
+
+    Skipping is decided while reading, before the write lock is taken, and checked again under it: a
+    skipped table whose fingerprint was dropped meanwhile, by an annotation or a manual edit, keeps that
+    edit and is compared row by row on the next upload (counted as `edited_tables`). The tables to mark
+    deleted are only listed under the lock.
+    """
+    cursor = get_connection(db_file).cursor()
+    create_staging_table(cursor)
+    create_scope_table(cursor)
+    try:
+        started = time.perf_counter()
+        stored = stored_fingerprints(cursor, 'upload')
+        fingerprints = defaultdict(TableFingerprint)
+        skipped = set()
+        pending = []
+        read = reported = 0
+        for key, fingerprint, run in runs:
+            first_run = key not in fingerprints
+            fingerprints[key].merge(fingerprint)
+            read += fingerprint.count
+            if first_run and (run is None or stored.get(key) == fingerprint.finalize()):
+                skipped.add(key)
+            else:
+                if key in skipped:
+                    # More rows of a table already skipped as unchanged: it has changed after all
+                    skipped.discard(key)
+                    restage_table(cursor, *key)
+                pending.extend(run)
+                if len(pending) >= batch_size:
+                    _insert_staged(cursor, pending)
+                    pending = []
+            if progress and read - reported >= batch_size:
+                reported = read
+                progress(read)
+        _insert_staged(cursor, pending)
+        changed = {key: (fingerprint.finalize(), fingerprint.count)
+                   for key, fingerprint in fingerprints.items() if key not in skipped}
+        staged_at = time.perf_counter()
+        with transaction(cursor.connection):
+            current = stored_fingerprints(cursor, 'upload')
+            edited = {key for key in skipped if current.get(key) != fingerprints[key].finalize()}
+            cursor.execute("SELECT DISTINCT keyspace_name, table_name FROM columns WHERE status = 'active'")
+            dropped = {tuple(row) for row in cursor.fetchall()} - set(fingerprints)
+            scope_tables(cursor, [*changed, *dropped])
+            counts = {'rows': read, 'tables': len(fingerprints), 'changed_tables': len(changed),
+                      'dropped_tables': len(dropped), 'edited_tables': len(edited), 'inserted': 0, 'updated': 0,
+                      'deleted': 0}
+            counts['batch_id'] = start_batch(cursor, 'upload', user_name)
+            if changed or dropped:
+                counts.update(reconcile_staged(cursor, user_name, counts['batch_id'], scoped=True))
+                refresh_stats(cursor)
+                save_fingerprints(cursor, changed, 'upload')
+            drop_fingerprints(cursor, [*dropped, *edited])
+            counts['snapshot_id'] = record_snapshot(cursor, 'upload', counts['batch_id'], [*changed, *dropped])
+            finish_batch(cursor, counts['batch_id'], counts)
+            if counts['inserted'] or counts['updated'] or counts['deleted']:
+                bump_generation(cursor)
+            if progress:
+                progress(read)
+        counts['timings'] = {'staging': staged_at - started, 'reconcile': time.perf_counter() - staged_at}
+    finally:
+        drop_staging_table(cursor)
+    observe_ingestion(counts)
+    apply_retention(db_file)
+    return counts
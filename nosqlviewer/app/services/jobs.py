@@ -0,0 +1,314 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import db
+from .shards import ingest_runs
+from .upload_formats import read_upload, upload_format
+
+MAX_WORKERS = 2
+# Uploads read in the request that must be seekable (see spool_upload) stay in memory up to this size, larger
+# ones spill to an unlinked temp file
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+POLL_INTERVAL = 0.5
+# A running job whose heartbeat is older than this is assumed to belong to a dead worker
+STALE_AFTER = 600
+# How often a running job refreshes its heartbeat, whatever phase it is in
+HEARTBEAT_INTERVAL = 30
+
+# Directory, next to the database, holding the uploads of background jobs until they have run
+UPLOAD_DIR = 'job_uploads'
+
+JOB_FIELDS = ('id', 'db_file', 'status', 'filename', 'user_name', 'rows_processed', 'inserted', 'updated',
+              'deleted', 'error', 'created_at', 'started_at', 'finished_at', 'heartbeat_at', 'staging_seconds',
+              'reconcile_seconds')
+
+_executor = None
+_executor_lock = threading.Lock()
+# {job id: database file} of the jobs this process created that have not been claimed yet
+_queued = {}
+_keepalive = None
+
+
+def _reset_after_fork():
+    global _executor, _executor_lock, _keepalive
+    _executor = None
+    _executor_lock = threading.Lock()
+    _queued.clear()
+    _keepalive = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_jobs_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id TEXT PRIMARY KEY,
+            db_file TEXT,
+            status TEXT,
+            filename TEXT,
+            user_name TEXT,
+            rows_processed INTEGER DEFAULT 0,
+            inserted INTEGER,
+            updated INTEGER,
+            deleted INTEGER,
+            error TEXT,
+            created_at REAL,
+            started_at REAL,
+            finished_at REAL,
+            heartbeat_at REAL,
+            staging_seconds REAL,
+            reconcile_seconds REAL
+        )
+    ''')
+
+
+def add_upload_path(cursor):
+    cursor.execute('ALTER TABLE ingest_jobs ADD COLUMN upload_path TEXT')
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='ingest')
+        return _executor
+
+
+def _update_job(db_file, job_id, **fields):
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    db.query_database(f'UPDATE ingest_jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id),
+                      fetchall=False, db_file=db_file)
+
+
+def spool_upload(chunks):
+    """Copy an upload stream into a rewound spooled temp file, for readers that need to seek."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _keep_queued_alive():
+    """Refresh the heartbeat of this process's queued jobs, so that recover_jobs can tell them from those
+    of a process that exited before running them."""
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        for job_id, db_file in list(_queued.items()):
+            try:
+                _update_job(db_file, job_id, heartbeat_at=time.time())
+            except sqlite3.OperationalError:
+                pass
+
+
+def _create_job(db_file, filename, user_name, upload_path=None):
+    global _keepalive
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    db.query_database('''
+        INSERT INTO ingest_jobs (id, db_file, status, filename, user_name, created_at, heartbeat_at, upload_path)
+        VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)
+    ''', (job_id, os.path.abspath(db_file), filename, user_name, now, now, upload_path), fetchall=False,
+                      db_file=db_file)
+    _queued[job_id] = db_file
+    with _executor_lock:
+        if _keepalive is None:
+            _keepalive = threading.Thread(target=_keep_queued_alive, name='ingest-keepalive', daemon=True)
+            _keepalive.start()
+    return job_id
+
+
+def upload_dir(db_file=None):
+    return os.path.join(os.path.dirname(os.path.abspath(db_file or db.DB_FILE)), UPLOAD_DIR)
+
+
+def submit_ingestion(chunks, filename, user_name='admin'):
+    """Queue an upload for reconciliation and return the new job id. `filename` tells its format.
+
+    The upload is written to UPLOAD_DIR first, so that a job left queued by a process that exited can be
+    run by another one (see recover_jobs).
+    """
+    directory = upload_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{uuid.uuid4().hex}.upload')
+    with open(path, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+    job_id = _create_job(db.DB_FILE, filename, user_name, path)
+    _get_executor().submit(_run_job, job_id, db.DB_FILE, path, filename, user_name)
+    return job_id
+
+
+def recover_jobs(db_file=None):
+    """Settle the jobs of processes that exited: a running job whose heartbeat is older than STALE_AFTER is
+    marked failed, and a queued one is run again by this process if its upload is still there, or marked
+    failed. Called when a serving process starts and when a stale job is polled. Returns the ids of the
+    jobs queued again."""
+    db_file = db_file or db.DB_FILE
+    now = time.time()
+    stale = (os.path.abspath(db_file), now - STALE_AFTER)
+    # A connection of its own: the caller may be reading from a request's snapshot
+    conn = db.connect(db_file)
+    try:
+        with db.transaction(conn):
+            conn.execute('''
+                UPDATE ingest_jobs SET status = 'failed', finished_at = ?,
+                    error = 'The process running this job exited before it finished'
+                WHERE db_file = ? AND status = 'running' AND heartbeat_at < ?
+            ''', (now, *stale))
+            orphans = conn.execute('''
+                SELECT id, filename, user_name, upload_path FROM ingest_jobs
+                WHERE db_file = ? AND status = 'queued' AND IFNULL(heartbeat_at, created_at) < ?
+            ''', stale).fetchall()
+            requeued = []
+            for job_id, filename, user_name, upload_path in orphans:
+                if upload_path and os.path.exists(upload_path):
+                    conn.execute('UPDATE ingest_jobs SET heartbeat_at = ? WHERE id = ?', (now, job_id))
+                    requeued.append((job_id, filename, user_name, upload_path))
+                else:
+                    conn.execute('''
+                        UPDATE ingest_jobs SET status = 'failed', finished_at = ?,
+                            error = 'The process holding this upload exited before running it'
+                        WHERE id = ?
+                    ''', (now, job_id))
+    finally:
+        conn.close()
+    for job_id, filename, user_name, upload_path in requeued:
+        _queued[job_id] = db_file
+        _get_executor().submit(_run_job, job_id, db_file, upload_path, filename, user_name)
+    return [job_id for job_id, *_ in requeued]
+
+
+def run_ingestion(work, filename=None, user_name='admin', db_file=None):
+    """Run an ingestion in the calling thread, as a job like those of submit_ingestion: it waits for the
+    database's other ingestions (see _claim) and is recorded in ingest_jobs. `work` is called with the
+    progress callback to pass to ingest_runs or sync_schema and returns their counts; its errors are
+    recorded, then raised."""
+    db_file = db_file or db.DB_FILE
+    return _run_claimed(_create_job(db_file, filename, user_name), db_file, work)
+
+
+def _claim(job_id, db_file):
+    """Block until no other live job runs against the same database, then mark this job as running."""
+    while True:
+        now = time.time()
+        try:
+            claimed = db.get_connection(db_file).execute('''
+                UPDATE ingest_jobs SET status = 'running', started_at = ?, heartbeat_at = ?
+                WHERE id = ? AND NOT EXISTS (
+                    SELECT 1 FROM ingest_jobs
+                    WHERE db_file = ? AND status = 'running' AND heartbeat_at > ?
+                )
+            ''', (now, now, job_id, os.path.abspath(db_file), now - STALE_AFTER)).rowcount
+        except sqlite3.OperationalError:
+            claimed = 0
+        if claimed:
+            return
+        time.sleep(POLL_INTERVAL)
+
+
+@contextmanager
+def _heartbeat(job_id, db_file):
+    """Refresh the job's heartbeat every HEARTBEAT_INTERVAL seconds from a thread of its own, so that a
+    phase reporting no progress, such as the shards reconciling in other processes, does not let the
+    claim go stale.
+
+    While the job's own reconciliation holds the write lock the refresh fails and is retried; that
+    reconciliation refreshes the heartbeat in its transaction instead (see process_runs), so the claim is
+    current again the moment the lock is released.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        conn = db.connect(db_file)
+        try:
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                try:
+                    conn.execute('UPDATE ingest_jobs SET heartbeat_at = ? WHERE id = ?', (time.time(), job_id))
+                except sqlite3.OperationalError:
+                    pass
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=beat, name='ingest-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def _run_claimed(job_id, db_file, work):
+    try:
+        _claim(job_id, db_file)
+        _queued.pop(job_id, None)
+        with _heartbeat(job_id, db_file):
+            counts = work(lambda staged: _update_job(db_file, job_id, rows_processed=staged, heartbeat_at=time.time()))
+        timings = counts.get('timings', {})
+        _update_job(db_file, job_id, status='succeeded', rows_processed=counts['rows'],
+                    inserted=counts['inserted'], updated=counts['updated'], deleted=counts['deleted'],
+                    finished_at=time.time(), staging_seconds=timings.get('staging', timings.get('fetch')),
+                    reconcile_seconds=timings.get('reconcile'))
+        return counts
+    except Exception as e:
+        _queued.pop(job_id, None)
+        _update_job(db_file, job_id, status='failed', error=str(e), finished_at=time.time())
+        raise
+
+
+def _run_job(job_id, db_file, upload_path, filename, user_name):
+    def work(progress):
+        with open(upload_path, 'rb') as upload:
+            return ingest_runs(read_upload(upload, *upload_format(filename)), user_name=user_name,
+                               db_file=db_file, progress=progress)
+
+    try:
+        _run_claimed(job_id, db_file, work)
+    except Exception as e:
+        print(f"Ingestion job {job_id} failed: {e}")
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def get_job(job_id):
+    """Return the job's status, counts and timings, or None for an unknown id."""
+    query = f"SELECT {', '.join(JOB_FIELDS)} FROM ingest_jobs WHERE id = ?"
+    job = db.query_database(query, (job_id,), fetchall=False)
+    if job is None:
+        return None
+    now = time.time()
+    if job['status'] in ('queued', 'running') and (job['heartbeat_at'] or job['created_at']) < now - STALE_AFTER:
+        # Its process exited: settle it now rather than let the client poll forever, and read the outcome
+        # past the request's snapshot
+        recover_jobs(job['db_file'])
+        conn = db.connect(job['db_file'])
+        try:
+            job = dict(zip(JOB_FIELDS, conn.execute(query, (job_id,)).fetchone()))
+        finally:
+            conn.close()
+    started, finished = job.pop('started_at'), job.pop('finished_at')
+    job['timings'] = {
+        'queued': (started or finished or now) - job['created_at'],
+        'staging': job.pop('staging_seconds'),
+        'reconcile': job.pop('reconcile_seconds'),
+        'total': (finished or now) - started if started else None,
+    }
+    job['created_at'] = _isoformat(job['created_at'])
+    job['started_at'] = _isoformat(started)
+    job['finished_at'] = _isoformat(finished)
+    job['heartbeat_at'] = _isoformat(job['heartbeat_at'])
+    return job
+
+
+def _isoformat(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(timestamp)) if timestamp else None
@@ -0,0 +1,305 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+
+# Settings, read from the environment by configure()
+ENABLED = True
+SLOW_QUERY_MS = float('inf')
+PROFILE_REQUESTS = False
+PROFILE_DIR = 'profiles'
+REQUIRE_AUTH = True
+
+PREFIX = 'nosqlviewer_'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+# Distinct label sets per metric before new ones are folded into "other"
+MAX_SERIES = 500
+# SQL statements are timed per route and kind of statement; others (DDL, pragmas, transaction control)
+# only count towards the request's `sql` phase
+STATEMENT_KINDS = {'select': 'select', 'with': 'select', 'insert': 'insert', 'replace': 'insert',
+                   'update': 'update', 'delete': 'delete'}
+ITER_BATCH_SIZE = 1000
+
+slow_query_log = logging.getLogger('nosqlviewer.slow_query')
+
+
+def configure():
+    """Read the instrumentation settings from the environment (called by create_app, after .env is loaded).
+
+    METRICS_ENABLED=false turns instrumentation off: new connections are plain sqlite3 ones and requests
+    are not timed. SLOW_QUERY_MS logs statements slower than that many milliseconds to
+    `nosqlviewer.slow_query`. PROFILE_REQUESTS=true lets a request opt into profiling (see metrics_routes),
+    writing to PROFILE_DIR. /metrics requires a JWT unless METRICS_AUTH=false.
+    """
+    global ENABLED, SLOW_QUERY_MS, PROFILE_REQUESTS, PROFILE_DIR, REQUIRE_AUTH
+    ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS') or 'inf')
+    PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'false').lower() in ('1', 'true')
+    PROFILE_DIR = os.getenv('PROFILE_DIR', PROFILE_DIR)
+    REQUIRE_AUTH = os.getenv('METRICS_AUTH', 'true').lower() not in ('0', 'false', 'no')
+
+
+configure()
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def _series(self, label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            if len(self.series) >= MAX_SERIES:
+                label_values = ('other',) * len(self.labels)
+                series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = self._new_series()
+        return series
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                lines.extend(self._render_series(label_values, series))
+        return lines
+
+    def clear(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return [0]
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self._series(label_values)[0] += amount
+
+    def _render_series(self, label_values, series):
+        yield f'{self.name}_total{_format_labels(self.labels, label_values)} {series[0]}'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def _new_series(self):
+        # One count per bucket plus +Inf, then the sum of the observed values
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self._series(label_values)
+            series[index] += 1
+            series[-1] += value
+
+    def _render_series(self, label_values, series):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), series):
+            cumulative += count
+            yield f'{self.name}_bucket{_format_labels(self.labels, label_values, [("le", bound)])} {cumulative}'
+        labels = _format_labels(self.labels, label_values)
+        yield f'{self.name}_sum{labels} {series[-1]}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time spent handling requests.',
+                            ('method', 'route', 'status'))
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Size of response bodies (streamed bodies excluded).',
+                          ('method', 'route'), SIZE_BUCKETS)
+REQUEST_PHASES = Histogram('http_request_phase_seconds',
+                           'Time per request spent executing SQL, building row dicts and serializing JSON.',
+                           ('route', 'phase'))
+QUERY_LATENCY = Histogram('sql_query_duration_seconds',
+                          'Time spent executing and fetching SQL statements, per route (background outside requests) '
+                          'and statement kind.', ('route', 'statement'))
+QUERY_ROWS = Histogram('sql_query_rows', 'Rows returned (or changed) per SQL statement.', ('route', 'statement'),
+                       ROW_BUCKETS)
+INGEST_PHASES = Histogram('ingest_phase_duration_seconds', 'Time spent per phase of a schema upload.', ('phase',))
+INGEST_ROWS = Counter('ingest_rows', 'Rows staged and applied by schema uploads.', ('action',))
+STARTUP_PHASES = Histogram('startup_phase_seconds',
+                           'Time spent per startup phase: configure, migrate, warmup and create_app in the process '
+                           'that created the app, worker_start in the serving process.', ('phase',))
+METRICS = (REQUEST_LATENCY, RESPONSE_SIZE, REQUEST_PHASES, QUERY_LATENCY, QUERY_ROWS, INGEST_PHASES, INGEST_ROWS,
+           STARTUP_PHASES)
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format."""
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+def reset_metrics():
+    # Used after fork: a worker reports its own requests, not the ones its parent served. It keeps the
+    # startup phases though, those of the app it serves, which under --preload its parent built
+    for metric in METRICS:
+        if metric is STARTUP_PHASES:
+            metric.lock = threading.Lock()
+        else:
+            metric.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_metrics)
+
+
+# Per-request phase totals, accumulated by the thread serving the request
+_request = threading.local()
+
+
+def begin_request(route):
+    # The route stays set after the request, for the statements of a streamed body
+    _request.route = route
+    _request.phases = defaultdict(float)
+
+
+def end_request():
+    """Return and forget the phase totals of the current request."""
+    phases = getattr(_request, 'phases', None)
+    _request.phases = None
+    return phases or {}
+
+
+def add_phase(phase, seconds):
+    phases = getattr(_request, 'phases', None)
+    if phases is not None:
+        phases[phase] += seconds
+
+
+@lru_cache(maxsize=1024)
+def statement_kind(sql):
+    """The STATEMENT_KINDS label of a statement, from its first keyword, or None for statements not timed."""
+    words = sql.split(None, 1)
+    return STATEMENT_KINDS.get(words[0].lower()) if words else None
+
+
+def observe_query(sql, seconds, rows):
+    kind = statement_kind(sql)
+    if kind:
+        route = getattr(_request, 'route', None) or 'background'
+        QUERY_LATENCY.observe(seconds, route, kind)
+        QUERY_ROWS.observe(rows, route, kind)
+    add_phase('sql', seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        slow_query_log.warning('%.1f ms, %d rows: %s', seconds * 1000, rows, ' '.join(sql.split()))
+
+
+def observe_ingestion(counts):
+    """Record the phase timings and row counts returned by process_runs."""
+    for phase, seconds in counts.get('timings', {}).items():
+        INGEST_PHASES.observe(seconds, phase)
+    for action in ('rows', 'inserted', 'updated', 'deleted'):
+        INGEST_ROWS.inc(counts.get(action) or 0, 'staged' if action == 'rows' else action)
+
+
+def observe_startup(phase, seconds):
+    STARTUP_PHASES.observe(seconds, phase)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor timing each statement from execute() until its rows are fetched.
+
+    A SELECT is recorded once fetchall() returns, fetchmany() comes back short or fetchone() is called
+    (typically a single-row lookup); other statements are recorded right after they run.
+    """
+    _pending = None
+
+    def _finish(self):
+        if self._pending:
+            sql, seconds, rows = self._pending
+            self._pending = None
+            observe_query(sql, seconds, rows)
+
+    def _timed(self, sql, run):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            self._pending = [sql, time.perf_counter() - started, 0]
+            if self.description is None:
+                self._pending[2] = max(self.rowcount, 0)
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sql, lambda: super(InstrumentedCursor, self).execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sql, lambda: super(InstrumentedCursor, self).executemany(sql, seq_of_parameters))
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        rows = fetch(*args)
+        if self._pending:
+            self._pending[1] += time.perf_counter() - started
+        return rows
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if self._pending:
+            self._pending[2] += row is not None
+        self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._fetch(super().fetchmany, size)
+        if self._pending:
+            self._pending[2] += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        if self._pending:
+            self._pending[2] += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        # Iterate in fetchmany batches so that rows read with a for loop are counted too
+        while True:
+            rows = self.fetchmany(ITER_BATCH_SIZE)
+            yield from rows
+            if len(rows) < ITER_BATCH_SIZE:
+                return
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the implicit ones of execute(), are InstrumentedCursors."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
@@ -0,0 +1,139 @@
+from .catalog_cache import create_meta_table
+from .db import get_connection, transaction
+from .fingerprints import create_fingerprint_table, key_fingerprints_by_source
+from .history import create_history_tables
+from .jobs import add_upload_path, create_jobs_table
+from .search import create_search_index
+from .shards import create_shard_index
+from .snapshots import create_snapshot_tables
+from .stats import create_stats_tables
+
+
+def _create_base_tables(cursor):
+    # Create relations table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS relations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_keyspace TEXT,
+            from_table TEXT,
+            from_column TEXT,
+            to_keyspace TEXT,
+            to_table TEXT,
+            to_column TEXT,
+            is_published TEXT
+        )
+    ''')
+
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_name TEXT,
+            password TEXT
+        )
+    ''')
+
+    # Create table_description table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_description (
+            keyspace_name TEXT,
+            table_name TEXT,
+            note TEXT,
+            tag TEXT,
+            PRIMARY KEY (keyspace_name, table_name)
+        )
+    ''')
+
+    # Create columns table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS columns (
+            keyspace_name TEXT,
+            table_name TEXT,
+            column_name TEXT,
+            clustering_order TEXT,
+            column_name_bytes TEXT,
+            kind TEXT,
+            position INTEGER,
+            type TEXT,
+            note TEXT DEFAULT 'no note',
+            tag TEXT DEFAULT 'no tags',
+            status TEXT DEFAULT 'active',
+            PRIMARY KEY (keyspace_name, table_name, column_name)
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO table_description (keyspace_name, table_name, note, tag)
+        SELECT DISTINCT keyspace_name, table_name, 'no note', 'no tag'
+        FROM columns
+    ''')
+
+    # Create update_logs table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS update_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_name TEXT,
+            timestamp TEXT,
+            existing_data TEXT,
+            updated_data TEXT
+        )
+    ''')
+
+
+def _create_lookup_indexes(cursor):
+    # Relations are looked up by their source table, and by their target for reverse lineage
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_relations_from ON relations (from_keyspace, from_table)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_relations_to ON relations (to_keyspace, to_table)')
+    # Logins
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_user_name ON users (user_name)')
+    # Covering index for filtering columns by status without touching the table rows
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_columns_status
+        ON columns (status, keyspace_name, table_name, column_name)
+    ''')
+    # Claiming an ingestion job checks for other running jobs against the same database
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_db_file ON ingest_jobs (db_file, status)')
+    cursor.execute('ANALYZE')
+
+
+# (version, description, function applying it). Append only: never edit or reorder an applied migration.
+MIGRATIONS = (
+    (1, 'base tables', _create_base_tables),
+    (2, 'ingestion jobs', create_jobs_table),
+    (3, 'full-text search index', create_search_index),
+    (4, 'catalog generation counter', create_meta_table),
+    (5, 'lookup indexes', _create_lookup_indexes),
+    (6, 'structured change log', create_history_tables),
+    (7, 'table fingerprints', create_fingerprint_table),
+    (8, 'shard index', create_shard_index),
+    (9, 'catalog snapshots', create_snapshot_tables),
+    (10, 'catalog statistics', create_stats_tables),
+    (11, 'fingerprints per source', key_fingerprints_by_source),
+    (12, 'durable job uploads', add_upload_path),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_file=None):
+    """Bring the database schema up to LATEST_VERSION, recording it in PRAGMA user_version.
+
+    An up-to-date database costs a single header read. Pending migrations run in one write
+    transaction, so concurrent workers starting together apply each of them exactly once.
+    Returns the list of applied versions.
+    """
+    conn = get_connection(db_file)
+    if schema_version(conn) >= LATEST_VERSION:
+        return []
+    applied = []
+    with transaction(conn):
+        cursor = conn.cursor()
+        current = schema_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if version > current:
+                apply(cursor)
+                applied.append(version)
+        cursor.execute(f'PRAGMA user_version = {LATEST_VERSION}')
+    return applied
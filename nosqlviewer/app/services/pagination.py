@@ -0,0 +1,73 @@
+import json
+
+from .db import connect, query_database
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+STREAM_BATCH_SIZE = 1000
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+
+def encode_cursor(values):
+    """Serialize keyset values into an opaque `after` token (floats round-trip exactly through repr)."""
+    return ':'.join(repr(value) for value in values)
+
+
+def decode_cursor(token, types):
+    """Parse an `after` token produced by `encode_cursor`; raises ValueError when it is malformed."""
+    parts = token.split(':')
+    if len(parts) != len(types):
+        raise ValueError(f"Invalid 'after' cursor: {token!r}")
+    return tuple(cast(part) for cast, part in zip(types, parts))
+
+
+def fetch_page(query, params, cursor_fields, limit):
+    """Run a keyset query whose rows carry `cursor_fields`; return the rows without those fields and the
+    `after` token of the next page (None on the last page)."""
+    rows = query_database(query, params)
+    next_after = encode_cursor([rows[-1][field] for field in cursor_fields]) if rows and len(rows) == limit else None
+    for row in rows:
+        for field in cursor_fields:
+            row.pop(field)
+    return rows, next_after
+
+
+def stream_rows(query, params=(), fmt='ndjson', hidden_fields=(), prefix='[', suffix=']', transform=None,
+                db_file=None):
+    """Yield the query's rows as NDJSON lines or as chunks of one JSON document, fetching
+    STREAM_BATCH_SIZE rows at a time so memory stays flat whatever the result size.
+
+    A dedicated connection is used so that an abandoned response cannot leave a pooled connection
+    pinned to an old read snapshot. Its cursor still reads one snapshot until the last row is sent:
+    the rows are consistent, but WAL checkpoints cannot get past that snapshot before the download
+    ends, so the WAL grows for as long as a slow client takes while ingestions commit.
+    """
+    conn = connect(db_file)
+    try:
+        cursor = conn.execute(query, params)
+        names = [description[0] for description in cursor.description]
+        keep = [index for index, name in enumerate(names) if name not in hidden_fields]
+        names = [names[index] for index in keep]
+        first = True
+        if fmt == 'json':
+            yield prefix
+        while True:
+            batch = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not batch:
+                break
+            chunk = []
+            for row in batch:
+                record = dict(zip(names, (row[index] for index in keep)))
+                if transform:
+                    transform(record)
+                if fmt == 'json':
+                    chunk.append(('' if first else ',') + json.dumps(record))
+                    first = False
+                else:
+                    chunk.append(json.dumps(record) + '\n')
+            yield ''.join(chunk)
+        if fmt == 'json':
+            yield suffix
+    finally:
+        conn.close()
+
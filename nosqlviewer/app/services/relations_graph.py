@@ -0,0 +1,176 @@
+import os
+import threading
+from collections import deque
+
+from . import db
+
+MAX_DEPTH = 50
+EDGE_FIELDS = ('id', 'from_keyspace', 'from_table', 'from_column', 'to_keyspace', 'to_table', 'to_column',
+               'is_published')
+
+
+def _sort_key(node):
+    return tuple('' if part is None else str(part) for part in node)
+
+
+def parse_published(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'published')
+
+
+class GraphIndex:
+    """One version of the edges and their adjacency lists. Never changed once published: a refresh extends
+    a copy, so readers holding a version can walk it while another thread refreshes."""
+
+    def __init__(self, previous=None):
+        self.edges = dict(previous.edges) if previous else {}
+        self.forward = dict(previous.forward) if previous else {}
+        self.reverse = dict(previous.reverse) if previous else {}
+        self.column_forward = dict(previous.column_forward) if previous else {}
+        self.column_reverse = dict(previous.column_reverse) if previous else {}
+        self.max_id = previous.max_id if previous else 0
+
+    def add(self, row):
+        edge = dict(zip(EDGE_FIELDS, row))
+        edge_id = edge['id']
+        self.edges[edge_id] = edge
+        source = (edge['from_keyspace'], edge['from_table'])
+        target = (edge['to_keyspace'], edge['to_table'])
+        # New lists rather than appends: the previous version still shares the old ones
+        for adjacency, node in ((self.forward, source), (self.reverse, target),
+                                (self.column_forward, source + (edge['from_column'],)),
+                                (self.column_reverse, target + (edge['to_column'],))):
+            adjacency[node] = [*adjacency.get(node, ()), edge_id]
+
+
+class RelationsGraph:
+    """Adjacency index over `relations`, with forward and reverse edges at table and column level.
+
+    Relations are only ever inserted, so a refresh loads the rows above the highest id seen so far (which
+    also picks up relations saved by other workers); it rebuilds from scratch only if the table shrank.
+    Refreshes are serialized by the lock and publish a new GraphIndex; queries read whichever version is
+    current when they start, without locking.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.index = GraphIndex()
+
+    def refresh(self):
+        conn = db.get_connection(self.db_file)
+        if self._max_id(conn) == self.index.max_id:
+            return self
+        with self.lock:
+            max_id = self._max_id(conn)
+            index = GraphIndex(self.index if max_id >= self.index.max_id else None)
+            rows = conn.execute(f'''
+                SELECT {', '.join(EDGE_FIELDS)} FROM relations WHERE id > ? AND id <= ? ORDER BY id
+            ''', (index.max_id, max_id))
+            for row in rows:
+                index.add(row)
+            index.max_id = max(index.max_id, max_id)
+            self.index = index
+        return self
+
+    @staticmethod
+    def _max_id(conn):
+        return conn.execute('SELECT MAX(id) FROM relations').fetchone()[0] or 0
+
+    @staticmethod
+    def _steps(index, node, direction, published):
+        """Yield (edge, next node) for the edges of `index` leaving `node` in the given direction.
+
+        Nodes are (keyspace, table) pairs, or (keyspace, table, column) triples for column-level lineage.
+        """
+        column_level = len(node) == 3
+        directions = ('downstream', 'upstream') if direction == 'both' else (direction,)
+        for step in directions:
+            if step == 'downstream':
+                adjacency, side = (index.column_forward if column_level else index.forward), 'to'
+            else:
+                adjacency, side = (index.column_reverse if column_level else index.reverse), 'from'
+            for edge_id in adjacency.get(node, ()):
+                edge = index.edges[edge_id]
+                if published is not None and parse_published(edge['is_published']) != published:
+                    continue
+                next_node = (edge[f'{side}_keyspace'], edge[f'{side}_table'])
+                if column_level:
+                    next_node += (edge[f'{side}_column'],)
+                yield edge, next_node
+
+    def traverse(self, start, direction='downstream', depth=1, published=None, index=None):
+        """Breadth-first walk up to `depth` hops from `start`. Returns {node: hops} and the edges crossed."""
+        index = index or self.index
+        seen = {start: 0}
+        edges = {}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if seen[node] >= depth:
+                continue
+            for edge, next_node in self._steps(index, node, direction, published):
+                edges[edge['id']] = edge
+                if next_node not in seen:
+                    seen[next_node] = seen[node] + 1
+                    queue.append(next_node)
+        return seen, list(edges.values())
+
+    def shortest_path(self, source, target, directed=True, published=None):
+        """Fewest-hop list of edges from `source` to `target`, or None when they are not connected."""
+        if source == target:
+            return []
+        index = self.index
+        came_from = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for edge, next_node in self._steps(index, node, 'downstream' if directed else 'both', published):
+                if next_node in came_from:
+                    continue
+                came_from[next_node] = (node, edge)
+                if next_node == target:
+                    path = []
+                    while came_from[next_node]:
+                        next_node, edge = came_from[next_node]
+                        path.append(edge)
+                    return path[::-1]
+                queue.append(next_node)
+        return None
+
+    def components(self, published=None):
+        """Weakly connected components of the table graph, largest first."""
+        index = self.index
+        nodes = set(index.forward) | set(index.reverse)
+        seen = set()
+        components = []
+        for start in sorted(nodes, key=_sort_key):
+            if start in seen:
+                continue
+            component, _ = self.traverse(start, 'both', float('inf'), published, index)
+            # With a published filter a table may have no matching edge left
+            if len(component) > 1:
+                components.append(sorted(component, key=_sort_key))
+            seen.update(component)
+        components.sort(key=lambda component: (-len(component), _sort_key(component[0])))
+        return components
+
+
+_graphs = {}
+
+
+def _reset_after_fork():
+    # Graphs loaded by the parent (see warm_up) stay valid; their locks may have been held at fork
+    for graph in _graphs.values():
+        graph.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_relations_graph(db_file=None):
+    """The process-wide graph for the database, brought up to date."""
+    db_file = db_file or db.DB_FILE
+    if db_file not in _graphs:
+        _graphs[db_file] = RelationsGraph(db_file)
+    return _graphs[db_file].refresh()
@@ -0,0 +1,115 @@
+from .pagination import decode_cursor, fetch_page
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# The trigram tokenizer cannot match terms shorter than three characters
+MIN_TERM_LENGTH = 3
+
+FTS_FIELDS = ('keyspace_name', 'table_name', 'column_name', 'note', 'tag', 'table_note', 'table_tag')
+# bm25 weights, in FTS_FIELDS order: a hit in the column name counts most, table annotations least
+RANK_WEIGHTS = (2.0, 2.0, 10.0, 1.0, 1.0, 0.5, 0.5)
+
+_table_annotations = '''
+    LEFT JOIN table_description td ON td.keyspace_name = c.keyspace_name AND td.table_name = c.table_name
+'''
+
+
+def create_search_index(cursor):
+    """Create the `columns_fts` trigram index and the triggers that keep it in sync with
+    `columns` and `table_description`, filling it from the existing rows on first use."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'columns_fts'")
+    if cursor.fetchone():
+        return
+    cursor.execute(f"CREATE VIRTUAL TABLE columns_fts USING fts5({', '.join(FTS_FIELDS)}, tokenize = 'trigram')")
+    cursor.execute("INSERT INTO columns_fts (columns_fts, rank) VALUES ('rank', ?)",
+                   (f"bm25({', '.join(map(str, RANK_WEIGHTS))})",))
+    cursor.execute(f'''
+        INSERT INTO columns_fts (rowid, {', '.join(FTS_FIELDS)})
+        SELECT c.rowid, c.keyspace_name, c.table_name, c.column_name, c.note, c.tag, td.note, td.tag
+        FROM columns c {_table_annotations}
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER columns_fts_insert AFTER INSERT ON columns BEGIN
+            INSERT INTO columns_fts (rowid, {', '.join(FTS_FIELDS)})
+            SELECT new.rowid, new.keyspace_name, new.table_name, new.column_name, new.note, new.tag,
+                   (SELECT note FROM table_description
+                    WHERE keyspace_name = new.keyspace_name AND table_name = new.table_name),
+                   (SELECT tag FROM table_description
+                    WHERE keyspace_name = new.keyspace_name AND table_name = new.table_name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER columns_fts_update AFTER UPDATE OF keyspace_name, table_name, column_name, note, tag
+        ON columns BEGIN
+            UPDATE columns_fts
+            SET keyspace_name = new.keyspace_name, table_name = new.table_name, column_name = new.column_name,
+                note = new.note, tag = new.tag
+            WHERE rowid = old.rowid;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER columns_fts_delete AFTER DELETE ON columns BEGIN
+            DELETE FROM columns_fts WHERE rowid = old.rowid;
+        END
+    ''')
+    for event, row in (('INSERT', 'new'), ('UPDATE OF note, tag', 'new'), ('DELETE', 'old')):
+        values = 'new.note, new.tag' if row == 'new' else 'NULL, NULL'
+        cursor.execute(f'''
+            CREATE TRIGGER table_description_fts_{event.split()[0].lower()} AFTER {event} ON table_description BEGIN
+                UPDATE columns_fts SET (table_note, table_tag) = ({values})
+                WHERE rowid IN (SELECT rowid FROM columns
+                                WHERE keyspace_name = {row}.keyspace_name AND table_name = {row}.table_name);
+            END
+        ''')
+
+
+def rebuild_search_index(cursor):
+    """Repopulate `columns_fts` from scratch, e.g. after a VACUUM renumbered the rowids of `columns`."""
+    cursor.execute('DELETE FROM columns_fts')
+    cursor.execute(f'''
+        INSERT INTO columns_fts (rowid, {', '.join(FTS_FIELDS)})
+        SELECT c.rowid, c.keyspace_name, c.table_name, c.column_name, c.note, c.tag, td.note, td.tag
+        FROM columns c {_table_annotations}
+    ''')
+
+
+def _match_expression(terms):
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def build_search_query(search, limit=DEFAULT_LIMIT, after=None):
+    """Build the keyset query for one page of `columns` rows matching every whitespace separated term of
+    `search` in a column, keyspace or table name, note or tag, best matches first.
+
+    Returns (query, params, cursor_fields); the rows carry the cursor fields needed to build the `after`
+    token of the next page. An empty search pages through `columns` in storage order.
+    """
+    terms = search.split()
+    if terms and all(len(term) >= MIN_TERM_LENGTH for term in terms):
+        rank, rowid = decode_cursor(after, (float, int)) if after else (float('-inf'), 0)
+        return ('''
+            SELECT c.*, f.rank AS _rank, f.rowid AS _rowid FROM columns_fts f JOIN columns c ON c.rowid = f.rowid
+            WHERE columns_fts MATCH ? AND (f.rank > ? OR (f.rank = ? AND f.rowid > ?))
+            ORDER BY f.rank, f.rowid
+            LIMIT ?
+        ''', (_match_expression(terms), rank, rank, rowid, limit), ('_rank', '_rowid'))
+
+    (rowid,) = decode_cursor(after, (int,)) if after else (0,)
+    if not terms:
+        return ('SELECT *, rowid AS _rowid FROM columns WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (rowid, limit), ('_rowid',))
+
+    # Too short for the trigram index: scan, but still bounded
+    pattern = f"%{search.lower()}%"
+    return ('''
+        SELECT *, rowid AS _rowid FROM columns
+        WHERE (LOWER(column_name) LIKE ? OR LOWER(note) LIKE ? OR LOWER(tag) LIKE ?) AND rowid > ?
+        ORDER BY rowid
+        LIMIT ?
+    ''', (pattern, pattern, pattern, rowid, limit), ('_rowid',))
+
+
+def search_columns(search, limit=DEFAULT_LIMIT, after=None):
+    """Return one page of matching `columns` rows and the `after` token of the next page."""
+    query, params, cursor_fields = build_search_query(search, limit, after)
+    return fetch_page(query, params, cursor_fields, limit)
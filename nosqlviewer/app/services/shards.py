@@ -0,0 +1,373 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import db
+from .catalog_cache import bump_generation
+from .db import connect, get_connection, query_database, transaction
+from .fingerprints import stored_fingerprints
+from .ingest import BATCH_SIZE, process_runs
+from .metrics import observe_ingestion
+from .pagination import decode_cursor, encode_cursor, stream_rows
+from .snapshots import latest_root, latest_snapshot, record_snapshot, save_root
+
+# Settings, read from the environment by configure()
+ENABLED = False
+SHARD_DIR = None
+MAX_WORKERS = os.cpu_count() or 1
+
+# Counts summed over the shards of one ingestion
+SUMMED_COUNTS = ('tables', 'changed_tables', 'dropped_tables', 'edited_tables', 'inserted', 'updated', 'deleted')
+# Upper bound of SQLite rowids, for keyset conditions that must exclude a whole shard
+MAX_ROWID = 2 ** 63 - 1
+# Catalog tables kept in the keyspace shards; the main database's copies stay empty when sharded
+SHARD_TABLES = ('columns', 'table_description', 'update_logs')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def configure():
+    """Read the storage layout settings from the environment (called by create_app, after .env is loaded).
+
+    SHARDED_STORAGE=true keeps every keyspace's columns, table descriptions and change log in a SQLite file
+    of its own under SHARD_DIR (default: `shards` next to the main database), which then only holds the
+    shard index, relations, users and jobs. SHARD_WORKERS processes reconcile the keyspaces of an upload
+    in parallel.
+    """
+    global ENABLED, SHARD_DIR, MAX_WORKERS
+    ENABLED = os.getenv('SHARDED_STORAGE', 'false').lower() in ('1', 'true')
+    SHARD_DIR = os.getenv('SHARD_DIR') or None
+    MAX_WORKERS = int(os.getenv('SHARD_WORKERS') or os.cpu_count() or 1)
+
+
+configure()
+
+
+def create_shard_index(cursor):
+    """The keyspaces and tables held by the shards, maintained in the main database after each ingestion."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_tables (
+            keyspace_name TEXT,
+            table_name TEXT,
+            PRIMARY KEY (keyspace_name, table_name)
+        ) WITHOUT ROWID
+    ''')
+
+
+def shard_file(keyspace):
+    """Path of a keyspace's shard. Names that are not plain identifiers are made safe and disambiguated."""
+    directory = SHARD_DIR or os.path.join(os.path.dirname(os.path.abspath(db.DB_FILE)), 'shards')
+    name = keyspace
+    if not re.fullmatch(r'\w+', keyspace):
+        name = re.sub(r'\W', '_', keyspace) + '-' + hashlib.sha1(keyspace.encode()).hexdigest()[:8]
+    return os.path.join(directory, f'{name}.db')
+
+
+def shard_for(keyspace):
+    """The database file a keyspace's catalog reads and writes go to, for the db_file arguments: its shard
+    when sharded storage is on and the shard exists, otherwise None, the main database (whose catalog
+    tables are empty when sharded, so an unknown keyspace simply finds nothing)."""
+    if not ENABLED or not keyspace:
+        return None
+    path = shard_file(keyspace)
+    return path if os.path.exists(path) else None
+
+
+def indexed_keyspaces():
+    return [row['keyspace_name'] for row in query_database(
+        'SELECT DISTINCT keyspace_name FROM shard_tables ORDER BY keyspace_name')]
+
+
+def indexed_tables(keyspace):
+    return [row['table_name'] for row in query_database(
+        'SELECT table_name FROM shard_tables WHERE keyspace_name = ? ORDER BY table_name', (keyspace,))]
+
+
+def shard_files():
+    """(keyspace, path) of every shard, in keyspace order: the order fanned out results are merged in."""
+    return [(keyspace, path) for keyspace in indexed_keyspaces() for path in [shard_for(keyspace)] if path]
+
+
+def migrate_shards():
+    """Bring every shard's schema up to date, as migrate() does for the main database."""
+    from .migrations import migrate
+
+    for _, path in shard_files():
+        migrate(path)
+        db.close_connections()
+
+
+def bump_index_generation():
+    """Invalidate the catalog caches after a shard changed: they follow the main database's generation."""
+    with transaction() as conn:
+        bump_generation(conn.cursor())
+
+
+def _publish(results, source):
+    """Record in the shard index the tables of the shards that gained some, snapshot the whole catalog
+    from the shards' newest snapshots, then invalidate the caches if anything changed. `results` maps
+    keyspaces to their ingestion counts. Returns the snapshot id."""
+    with transaction() as conn:
+        cursor = conn.cursor()
+        root = dict(latest_root(cursor))
+        for keyspace, counts in results.items():
+            shard = connect(shard_file(keyspace))
+            try:
+                if counts['inserted']:
+                    tables = shard.execute('SELECT DISTINCT keyspace_name, table_name FROM columns').fetchall()
+                    cursor.executemany('INSERT OR IGNORE INTO shard_tables (keyspace_name, table_name) '
+                                       'VALUES (?, ?)', tables)
+                # The main database only keeps the roots: manifests and blobs stay in the shards
+                shard_cursor = shard.cursor()
+                if latest_snapshot(shard_cursor) is None:
+                    with transaction(shard):
+                        record_snapshot(shard_cursor, source)
+                entry = latest_root(shard_cursor).get(keyspace)
+            finally:
+                shard.close()
+            if entry:
+                root[keyspace] = entry
+            else:
+                root.pop(keyspace, None)
+        snapshot_id = save_root(cursor, root, source)
+        if any(counts['inserted'] or counts['updated'] or counts['deleted'] for counts in results.values()):
+            bump_generation(cursor)
+    return snapshot_id
+
+
+def _combine(results, extra):
+    counts = {field: sum(result.get(field, 0) for result in results.values()) for field in SUMMED_COUNTS}
+    counts.update(extra)
+    # Every shard records a batch of its own: there is no single batch id to follow in /api/history
+    counts['batch_ids'] = {keyspace: result.get('batch_id') for keyspace, result in results.items()}
+    counts['shards'] = results
+    return counts
+
+
+def _load_runs(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+def _ingest_shard(spool, shard, user_name, batch_size):
+    """Process pool entry point: reconcile one keyspace's spooled runs into its shard."""
+    from .migrations import migrate
+
+    os.makedirs(os.path.dirname(shard), exist_ok=True)
+    try:
+        migrate(shard)
+        return process_runs(_load_runs(spool), user_name, batch_size, db_file=shard)
+    finally:
+        db.close_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Forked workers start with the app already imported; the register_at_fork hooks give them
+            # fresh connections, locks and caches
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _executor
+
+
+def process_sharded_runs(runs, user_name='admin', batch_size=BATCH_SIZE, progress=None):
+    """process_runs for sharded storage: the upload is partitioned by keyspace, then every keyspace is
+    reconciled into its own shard on a process pool, in parallel.
+
+    Runs are spooled to one temporary file per keyspace. A table's first run is spooled without its rows
+    when its fingerprint matches the shard's, so unchanged tables are still never materialized. Shards
+    of keyspaces missing from the upload are reconciled with nothing, marking all their columns deleted.
+    Each shard commits on its own: if one keyspace fails, the others stay applied and the error is raised
+    once they are published. Each also records its own batch, so `batch_id` is None and `batch_ids` maps
+    every keyspace to the batch to look up in its history.
+    """
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        spools, stored, seen = {}, {}, set()
+        read = reported = 0
+        try:
+            for key, fingerprint, run in runs:
+                keyspace = key[0]
+                if keyspace not in spools:
+                    spools[keyspace] = open(os.path.join(directory, f'{len(spools)}.pickle'), 'wb')
+                    shard = shard_for(keyspace)
+                    stored[keyspace] = stored_fingerprints(get_connection(shard).cursor(), 'upload') if shard else {}
+                unchanged = key not in seen and stored[keyspace].get(key) == fingerprint.finalize()
+                seen.add(key)
+                pickle.dump((key, fingerprint, None if unchanged else list(run)), spools[keyspace],
+                            pickle.HIGHEST_PROTOCOL)
+                read += fingerprint.count
+                if progress and read - reported >= batch_size:
+                    reported = read
+                    progress(read)
+        finally:
+            for spool in spools.values():
+                spool.close()
+        for keyspace in indexed_keyspaces():
+            if keyspace not in spools:
+                spools[keyspace] = open(os.path.join(directory, f'{len(spools)}.pickle'), 'wb')
+                spools[keyspace].close()
+
+        spooled_at = time.perf_counter()
+        executor = _get_executor()
+        futures = {keyspace: executor.submit(_ingest_shard, spool.name, shard_file(keyspace), user_name, batch_size)
+                   for keyspace, spool in spools.items()}
+        results, errors = {}, []
+        for keyspace, future in futures.items():
+            try:
+                results[keyspace] = future.result()
+            except Exception as e:
+                errors.append(e)
+    snapshot_id = _publish(results, 'upload')
+    counts = _combine(results, {'rows': read, 'batch_id': None, 'snapshot_id': snapshot_id, 'timings': {
+        'staging': spooled_at - started, 'reconcile': time.perf_counter() - spooled_at}})
+    observe_ingestion(counts)
+    if errors:
+        raise errors[0]
+    return counts
+
+
+def ingest_runs(runs, user_name='admin', batch_size=BATCH_SIZE, progress=None, db_file=None):
+    """Reconcile an upload's table runs with process_runs, or process_sharded_runs when sharded (the shards
+    of the main database, whatever `db_file`)."""
+    if ENABLED:
+        return process_sharded_runs(runs, user_name, batch_size, progress)
+    return process_runs(runs, user_name, batch_size, progress, db_file)
+
+
+def map_shards(parts, apply, max_workers=None, source='schema-sync'):
+    """Call apply(keyspace, part, shard) on threads for every keyspace of `parts` and every existing shard
+    (with an empty part when the keyspace is not in `parts`), then publish the results, snapshotted as
+    coming from `source`. `apply` returns ingestion counts. Returns them combined, as process_sharded_runs
+    does."""
+    from .migrations import migrate
+
+    def run(keyspace):
+        shard = shard_file(keyspace)
+        os.makedirs(os.path.dirname(shard), exist_ok=True)
+        try:
+            migrate(shard)
+            return keyspace, apply(keyspace, parts.get(keyspace, {}), shard)
+        finally:
+            db.close_connections()
+
+    keyspaces = sorted(set(parts) | set(indexed_keyspaces()))
+    with ThreadPoolExecutor(max_workers=max_workers or MAX_WORKERS, thread_name_prefix='shard') as pool:
+        results = dict(pool.map(run, keyspaces))
+    snapshot_id = _publish(results, source)
+    return _combine(results, {'snapshot_id': snapshot_id})
+
+
+def apply_sharded_annotations(apply, edits, **kwargs):
+    """Run apply_annotations (passed in as `apply`) once per shard the edits belong to, one transaction
+    per shard, and return the results in the order of `edits`."""
+    groups = {}
+    for index, edit in enumerate(edits):
+        keyspace = edit.get('keyspace_name') if isinstance(edit, dict) else None
+        groups.setdefault(shard_for(keyspace), []).append(index)
+    results = [None] * len(edits)
+    for shard, indexes in groups.items():
+        for index, result in zip(indexes, apply([edits[index] for index in indexes], db_file=shard, **kwargs)):
+            results[index] = dict(result, index=index)
+    if any(result['status'] == 'updated' for result in results) and any(groups):
+        bump_index_generation()
+    return results
+
+
+def _shard_after(after, cursor_types, ordinal):
+    """A shard's own `after` token, from the merged cursor: the sort values, then the shard ordinal.
+
+    Shards before the cursor's shard resume strictly after its sort values, the cursor's shard after its
+    row, and later shards at its sort values, so that the merged order is (sort values, shard, rowid).
+    """
+    if after is None:
+        return None
+    *values, shard = decode_cursor(after, (*cursor_types, int))
+    if ordinal < shard:
+        values[-1] = MAX_ROWID
+    elif ordinal > shard:
+        values[-1] = 0
+    return encode_cursor(values)
+
+
+def search_page(build_query, search, limit, after=None):
+    """One page of a keyset search (search.build_search_query) fanned out over the shards and merged in
+    the order of its cursor fields, shards breaking ties. Returns the rows and the next merged `after`.
+
+    Full-text ranks are computed by every shard over its own rows, so the merge of ranked results is
+    approximate across keyspaces; storage order is exact.
+    """
+    _, _, cursor_fields = build_query(search, limit)
+    cursor_types = tuple(float if field == '_rank' else int for field in cursor_fields)
+    candidates = []
+    for ordinal, (_, path) in enumerate(shard_files()):
+        query, params, _ = build_query(search, limit, _shard_after(after, cursor_types, ordinal))
+        for row in query_database(query, params, db_file=path):
+            candidates.append((tuple(row[field] for field in cursor_fields[:-1]), ordinal, row[cursor_fields[-1]],
+                               row))
+    candidates.sort(key=lambda candidate: candidate[:3])
+    page = candidates[:limit]
+    next_after = None
+    if len(page) == limit:
+        values, ordinal, rowid, _ = page[-1]
+        next_after = encode_cursor([*values, rowid, ordinal])
+    rows = []
+    for *_, row in page:
+        for field in cursor_fields:
+            row.pop(field)
+        rows.append(row)
+    return rows, next_after
+
+
+def stream_shards(query, params=(), fmt='ndjson', hidden_fields=(), transform=None, limit=None):
+    """stream_rows over every shard in turn, as a single NDJSON stream or JSON array of at most `limit`
+    rows (the query's own LIMIT applies per shard)."""
+    first = True
+    remaining = limit
+    if fmt == 'json':
+        yield '['
+    for _, path in shard_files():
+        if remaining == 0:
+            break
+        for chunk in stream_rows(query, params, 'ndjson', hidden_fields, transform=transform, db_file=path):
+            lines = chunk.splitlines()
+            if remaining is not None:
+                lines = lines[:remaining]
+                remaining -= len(lines)
+            if not lines:
+                continue
+            # JSON text never contains a raw newline, so every line is exactly one record
+            yield (('' if first else ',') + ','.join(lines)) if fmt == 'json' else '\n'.join(lines) + '\n'
+            first = False
+            if remaining == 0:
+                break
+    if fmt == 'json':
+        yield ']'
+
+
+def fuzzy_search_shards(search_shard, search, limit, **kwargs):
+    """Run fuzzy_search_columns (passed in as `search_shard`) on every shard and keep the `limit` best."""
+    rows = [row for _, path in shard_files() for row in search_shard(search, limit=limit, db_file=path, **kwargs)]
+    rows.sort(key=lambda row: (-row['similarity'], row['keyspace_name'], row['table_name'], row['column_name']))
+    return rows[:limit]
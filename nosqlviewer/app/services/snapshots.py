@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+
+from .db import get_connection
+from .history import now
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+# The `columns` fields a snapshot keeps. Notes and tags are edited between ingestions and have their own
+# change log: a snapshot records the schema an ingestion brought in
+SNAPSHOT_FIELDS = ('column_name', 'clustering_order', 'column_name_bytes', 'kind', 'position', 'type')
+SNAPSHOT_INFO = ('id', 'created_at', 'source', 'batch_id', 'root', 'keyspaces', 'tables', 'columns')
+# Decoded objects kept in memory; they never change, so entries never go stale
+CACHE_SIZE = 4096
+
+_objects = OrderedDict()
+_objects_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _objects_lock
+    _objects_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_snapshot_tables(cursor):
+    """Content-addressed catalog snapshots.
+
+    A snapshot is a tree of immutable objects stored once per distinct content, under its hash: a root
+    maps keyspaces to manifests, a manifest maps tables to blobs, and a blob holds a table's active
+    columns. A snapshot whose tables mostly did not change shares their objects with the previous one.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_objects (
+            hash TEXT PRIMARY KEY,
+            data BLOB
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT,
+            source TEXT,
+            batch_id TEXT,
+            root TEXT,
+            keyspaces INTEGER,
+            tables INTEGER,
+            columns INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_snapshots_created_at ON snapshots (created_at)')
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode()
+
+
+def put_object(cursor, value):
+    """Store a JSON value unless an identical one is stored already; returns its hash."""
+    data = _encode(value)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    cursor.execute('INSERT OR IGNORE INTO snapshot_objects (hash, data) VALUES (?, ?)',
+                   (digest, zlib.compress(data)))
+    return digest
+
+
+def load_object(cursor, digest):
+    """The value stored under `digest`. Raises KeyError when this database does not hold it."""
+    with _objects_lock:
+        if digest in _objects:
+            _objects.move_to_end(digest)
+            return _objects[digest]
+    row = cursor.execute('SELECT data FROM snapshot_objects WHERE hash = ?', (digest,)).fetchone()
+    if row is None:
+        raise KeyError(digest)
+    value = json.loads(zlib.decompress(row[0]))
+    with _objects_lock:
+        _objects[digest] = value
+        if len(_objects) > CACHE_SIZE:
+            _objects.popitem(last=False)
+    return value
+
+
+def latest_snapshot(cursor):
+    """(id, root) of the newest snapshot, or None before the first one."""
+    return cursor.execute('SELECT id, root FROM snapshots ORDER BY id DESC LIMIT 1').fetchone()
+
+
+def latest_root(cursor):
+    """{keyspace_name: [manifest, tables, columns]} of the newest snapshot, empty before the first one."""
+    latest = latest_snapshot(cursor)
+    return load_object(cursor, latest[1]) if latest else {}
+
+
+def _table_blob(cursor, keyspace_name, table_name):
+    cursor.execute(f'''
+        SELECT {', '.join(SNAPSHOT_FIELDS)} FROM columns
+        WHERE keyspace_name = ? AND table_name = ? AND status = 'active'
+        ORDER BY column_name
+    ''', (keyspace_name, table_name))
+    return [list(row) for row in cursor.fetchall()]
+
+
+def save_root(cursor, root, source, batch_id=None):
+    """Record a snapshot of `root` unless it is the newest one already. Returns the snapshot id."""
+    digest = put_object(cursor, root)
+    latest = latest_snapshot(cursor)
+    if latest and latest[1] == digest:
+        return latest[0]
+    cursor.execute('''
+        INSERT INTO snapshots (created_at, source, batch_id, root, keyspaces, tables, columns)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (now(), source, batch_id, digest, len(root), sum(entry[1] for entry in root.values()),
+          sum(entry[2] for entry in root.values())))
+    return cursor.lastrowid
+
+
+def record_snapshot(cursor, source, batch_id=None, tables=()):
+    """Snapshot the catalog after an ingestion; call it inside the ingestion's transaction.
+
+    Only the blobs of `tables`, the (keyspace_name, table_name) pairs the ingestion reconciled, are
+    rebuilt from `columns`, and only the manifests of their keyspaces: everything else is the previous
+    snapshot's. The first snapshot reads every table. An ingestion that left the schema as it was
+    records nothing. Returns the id of the snapshot describing the catalog.
+    """
+    if latest_snapshot(cursor) is None:
+        cursor.execute("SELECT DISTINCT keyspace_name, table_name FROM columns WHERE status = 'active'")
+        tables = cursor.fetchall()
+    root = dict(latest_root(cursor))
+    by_keyspace = defaultdict(set)
+    for keyspace_name, table_name in tables:
+        by_keyspace[keyspace_name].add(table_name)
+    for keyspace_name, table_names in by_keyspace.items():
+        manifest = dict(load_object(cursor, root[keyspace_name][0])) if keyspace_name in root else {}
+        for table_name in table_names:
+            blob = _table_blob(cursor, keyspace_name, table_name)
+            if blob:
+                manifest[table_name] = [put_object(cursor, blob), len(blob)]
+            else:
+                manifest.pop(table_name, None)
+        if manifest:
+            root[keyspace_name] = [put_object(cursor, manifest), len(manifest),
+                                   sum(count for _, count in manifest.values())]
+        else:
+            root.pop(keyspace_name, None)
+    return save_root(cursor, root, source, batch_id)
+
+
+def list_snapshots(after=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of snapshots, newest first, and the `after` id of the next page."""
+    limit = min(limit, MAX_PAGE_SIZE)
+    cursor = get_connection().cursor()
+    cursor.execute(f'''
+        SELECT {', '.join(SNAPSHOT_INFO)} FROM snapshots
+        WHERE id < ? ORDER BY id DESC LIMIT ?
+    ''', (after or 2 ** 63 - 1, limit))
+    snapshots = [dict(zip(SNAPSHOT_INFO, row)) for row in cursor.fetchall()]
+    return snapshots, (snapshots[-1]['id'] if len(snapshots) == limit else None)
+
+
+def resolve_snapshot(ref=None):
+    """The snapshot a reference names: an id, a timestamp or date (the newest snapshot taken at or before
+    it), or nothing for the newest one. Returns its info, or None when there is no such snapshot."""
+    columns = ', '.join(SNAPSHOT_INFO)
+    cursor = get_connection().cursor()
+    if not ref:
+        cursor.execute(f'SELECT {columns} FROM snapshots ORDER BY id DESC LIMIT 1')
+    elif str(ref).isdigit():
+        cursor.execute(f'SELECT {columns} FROM snapshots WHERE id = ?', (int(ref),))
+    else:
+        cursor.execute(f'SELECT {columns} FROM snapshots WHERE created_at <= ? ORDER BY id DESC LIMIT 1',
+                       (str(ref).replace('T', ' '),))
+    row = cursor.fetchone()
+    return dict(zip(SNAPSHOT_INFO, row)) if row else None
+
+
+def _keyspace_cursor(keyspace_name):
+    # Manifests and blobs live next to the keyspace's columns: in its shard when storage is sharded
+    from .shards import shard_for
+
+    return get_connection(shard_for(keyspace_name)).cursor()
+
+
+def _column_diff(old, new):
+    old = {row[0]: row for row in old}
+    new = {row[0]: row for row in new}
+    changed = []
+    for name in sorted(old.keys() & new.keys()):
+        if old[name] != new[name]:
+            changed.append({'column_name': name, 'changes': {
+                field: [before, after] for field, before, after in zip(SNAPSHOT_FIELDS, old[name], new[name])
+                if before != after}})
+    return {
+        'added': [dict(zip(SNAPSHOT_FIELDS, new[name])) for name in sorted(new.keys() - old.keys())],
+        'removed': sorted(old.keys() - new.keys()),
+        'changed': changed,
+    }
+
+
+def diff_snapshots(old, new, keyspace_name=None):
+    """Tables added, removed and changed between two snapshots (as returned by resolve_snapshot), with
+    their column changes. Subtrees whose hashes match are skipped without being read: a keyspace is only
+    opened when its manifest differs, and a table's columns only compared when its blob does."""
+    cursor = get_connection().cursor()
+    old_root, new_root = load_object(cursor, old['root']), load_object(cursor, new['root'])
+    keyspaces = old_root.keys() | new_root.keys()
+    if keyspace_name:
+        keyspaces &= {keyspace_name}
+    added, removed, changed = [], [], []
+    for keyspace in sorted(keyspaces):
+        before, after = old_root.get(keyspace), new_root.get(keyspace)
+        if before and after and before[0] == after[0]:
+            continue
+        shard = _keyspace_cursor(keyspace)
+        old_tables = load_object(shard, before[0]) if before else {}
+        new_tables = load_object(shard, after[0]) if after else {}
+        for table in sorted(old_tables.keys() | new_tables.keys()):
+            old_entry, new_entry = old_tables.get(table), new_tables.get(table)
+            if old_entry == new_entry:
+                continue
+            entry = {'keyspace_name': keyspace, 'table_name': table}
+            if old_entry is None:
+                added.append(dict(entry, columns=new_entry[1]))
+            elif new_entry is None:
+                removed.append(dict(entry, columns=old_entry[1]))
+            else:
+                changed.append(dict(entry, columns=_column_diff(load_object(shard, old_entry[0]),
+                                                                load_object(shard, new_entry[0]))))
+    return {
+        'from': old,
+        'to': new,
+        'tables': {'added': added, 'removed': removed, 'changed': changed},
+        'summary': {
+            'tables_added': len(added),
+            'tables_removed': len(removed),
+            'tables_changed': len(changed),
+            'columns_added': sum(len(table['columns']['added']) for table in changed),
+            'columns_removed': sum(len(table['columns']['removed']) for table in changed),
+            'columns_changed': sum(len(table['columns']['changed']) for table in changed),
+        },
+    }
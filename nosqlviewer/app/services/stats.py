@@ -0,0 +1,203 @@
+from collections import Counter
+
+from .db import get_connection
+
+# Counts over a table's active columns: (name, SQL aggregate over `columns c`)
+COLUMN_COUNTS = (
+    ('columns', 'COUNT(*)'),
+    ('partition_keys', "SUM(c.kind = 'partition_key')"),
+    ('clustering_keys', "SUM(c.kind = 'clustering')"),
+    ('static_columns', "SUM(c.kind = 'static')"),
+    ('regular_columns', "SUM(c.kind = 'regular')"),
+    ('tagged_columns', "SUM(IFNULL(c.tag, 'no tags') != 'no tags')"),
+    ('noted_columns', "SUM(IFNULL(c.note, 'no note') != 'no note')"),
+)
+# Whether the table itself is annotated, from its table_description row `d`
+TABLE_FLAGS = (
+    ('described', "MAX(IFNULL(d.note, 'no note') != 'no note')"),
+    ('tagged', "MAX(IFNULL(d.tag, 'no tag') != 'no tag')"),
+)
+TABLE_STATS = tuple(name for name, _ in COLUMN_COUNTS + TABLE_FLAGS)
+KEYSPACE_STATS = ('tables',) + tuple(name for name, _ in COLUMN_COUNTS) + ('described_tables', 'tagged_tables')
+
+_in_scope = '(keyspace_name, table_name) IN (SELECT keyspace_name, table_name FROM temp.staged_tables)'
+_keyspace_in_scope = 'keyspace_name IN (SELECT keyspace_name FROM temp.staged_tables)'
+
+
+def create_stats_tables(cursor):
+    """Summary tables of the catalog, per table and per keyspace, with the type distribution of each.
+
+    Ingestions refresh the tables they reconcile (see refresh_stats); note and tag edits are applied as
+    deltas by triggers, so the summaries never need a full pass over `columns` after this one.
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS table_stats (
+            keyspace_name TEXT,
+            table_name TEXT,
+            {', '.join(f'{name} INTEGER' for name in TABLE_STATS)},
+            PRIMARY KEY (keyspace_name, table_name)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS keyspace_stats (
+            keyspace_name TEXT PRIMARY KEY,
+            {', '.join(f'{name} INTEGER' for name in KEYSPACE_STATS)}
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_type_stats (
+            keyspace_name TEXT,
+            table_name TEXT,
+            type TEXT,
+            columns INTEGER,
+            PRIMARY KEY (keyspace_name, table_name, type)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS type_stats (
+            keyspace_name TEXT,
+            type TEXT,
+            columns INTEGER,
+            PRIMARY KEY (keyspace_name, type)
+        ) WITHOUT ROWID
+    ''')
+    # Annotation edits move the coverage counts of one table and its keyspace. Ingestions fire these too,
+    # harmlessly: refresh_stats then recomputes the tables they touched
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS columns_stats_annotate AFTER UPDATE OF note, tag ON columns
+        WHEN old.status = 'active' AND new.status = 'active' AND (old.note IS NOT new.note OR old.tag IS NOT new.tag)
+        BEGIN
+            UPDATE table_stats
+            SET tagged_columns = tagged_columns + (IFNULL(new.tag, 'no tags') != 'no tags')
+                                                - (IFNULL(old.tag, 'no tags') != 'no tags'),
+                noted_columns = noted_columns + (IFNULL(new.note, 'no note') != 'no note')
+                                              - (IFNULL(old.note, 'no note') != 'no note')
+            WHERE keyspace_name = new.keyspace_name AND table_name = new.table_name;
+            UPDATE keyspace_stats
+            SET tagged_columns = tagged_columns + (IFNULL(new.tag, 'no tags') != 'no tags')
+                                                - (IFNULL(old.tag, 'no tags') != 'no tags'),
+                noted_columns = noted_columns + (IFNULL(new.note, 'no note') != 'no note')
+                                              - (IFNULL(old.note, 'no note') != 'no note')
+            WHERE keyspace_name = new.keyspace_name;
+        END
+    ''')
+    # Descriptions of tables without active columns are not counted
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS table_description_stats_annotate AFTER UPDATE OF note, tag ON table_description
+        WHEN old.note IS NOT new.note OR old.tag IS NOT new.tag
+        BEGIN
+            UPDATE keyspace_stats
+            SET described_tables = described_tables + (IFNULL(new.note, 'no note') != 'no note')
+                                                    - (IFNULL(old.note, 'no note') != 'no note'),
+                tagged_tables = tagged_tables + (IFNULL(new.tag, 'no tag') != 'no tag')
+                                              - (IFNULL(old.tag, 'no tag') != 'no tag')
+            WHERE keyspace_name = new.keyspace_name AND EXISTS (
+                SELECT 1 FROM table_stats WHERE keyspace_name = new.keyspace_name AND table_name = new.table_name);
+            UPDATE table_stats
+            SET described = IFNULL(new.note, 'no note') != 'no note', tagged = IFNULL(new.tag, 'no tag') != 'no tag'
+            WHERE keyspace_name = new.keyspace_name AND table_name = new.table_name;
+        END
+    ''')
+    refresh_stats(cursor, scoped=False)
+
+
+def refresh_stats(cursor, scoped=True):
+    """Recompute the summaries of the tables listed in `temp.staged_tables` from their active columns,
+    then those of their keyspaces from the per-table summaries. Call it inside the reconciling
+    transaction, after reconcile_staged. Without `scoped`, every summary is rebuilt from `columns`."""
+    source = 'columns c'
+    tables, keyspaces = '', ''
+    if scoped:
+        source = ('temp.staged_tables s JOIN columns c '
+                  'ON c.keyspace_name = s.keyspace_name AND c.table_name = s.table_name')
+        tables, keyspaces = f'WHERE {_in_scope}', f'WHERE {_keyspace_in_scope}'
+    cursor.execute(f'DELETE FROM table_stats {tables}')
+    cursor.execute(f'''
+        INSERT INTO table_stats (keyspace_name, table_name, {', '.join(TABLE_STATS)})
+        SELECT c.keyspace_name, c.table_name, {', '.join(aggregate for _, aggregate in COLUMN_COUNTS + TABLE_FLAGS)}
+        FROM {source}
+        LEFT JOIN table_description d ON d.keyspace_name = c.keyspace_name AND d.table_name = c.table_name
+        WHERE c.status = 'active'
+        GROUP BY c.keyspace_name, c.table_name
+    ''')
+    cursor.execute(f'DELETE FROM table_type_stats {tables}')
+    cursor.execute(f'''
+        INSERT INTO table_type_stats (keyspace_name, table_name, type, columns)
+        SELECT c.keyspace_name, c.table_name, c.type, COUNT(*)
+        FROM {source}
+        WHERE c.status = 'active'
+        GROUP BY c.keyspace_name, c.table_name, c.type
+    ''')
+
+    sums = ', '.join(f'SUM({name})' for name, _ in COLUMN_COUNTS)
+    cursor.execute(f'DELETE FROM keyspace_stats {keyspaces}')
+    cursor.execute(f'''
+        INSERT INTO keyspace_stats (keyspace_name, {', '.join(KEYSPACE_STATS)})
+        SELECT keyspace_name, COUNT(*), {sums}, SUM(described), SUM(tagged)
+        FROM table_stats {keyspaces}
+        GROUP BY keyspace_name
+    ''')
+    cursor.execute(f'DELETE FROM type_stats {keyspaces}')
+    cursor.execute(f'''
+        INSERT INTO type_stats (keyspace_name, type, columns)
+        SELECT keyspace_name, type, SUM(columns)
+        FROM table_type_stats {keyspaces}
+        GROUP BY keyspace_name, type
+    ''')
+
+
+def _coverage(stats, tables_field):
+    """Add the share of annotated columns (and tables, for keyspaces and totals) to a summary."""
+    columns = stats['columns'] or 0
+    stats['tag_coverage'] = round(stats['tagged_columns'] / columns, 4) if columns else 0.0
+    stats['note_coverage'] = round(stats['noted_columns'] / columns, 4) if columns else 0.0
+    if tables_field:
+        tables = stats['tables'] or 0
+        stats['description_coverage'] = round(stats[tables_field] / tables, 4) if tables else 0.0
+    return stats
+
+
+def _keyspace_rows(cursor, keyspace_name=None):
+    where = 'WHERE keyspace_name = ?' if keyspace_name else ''
+    params = (keyspace_name,) if keyspace_name else ()
+    cursor.execute(f'''
+        SELECT keyspace_name, {', '.join(KEYSPACE_STATS)} FROM keyspace_stats {where} ORDER BY keyspace_name
+    ''', params)
+    keyspaces = [dict(zip(('keyspace_name',) + KEYSPACE_STATS, row)) for row in cursor.fetchall()]
+    cursor.execute(f'SELECT type, SUM(columns) FROM type_stats {where} GROUP BY type', params)
+    return keyspaces, Counter(dict(cursor.fetchall()))
+
+
+def catalog_stats():
+    """Totals, type distribution and per-keyspace summaries of the whole catalog. Reads one row per
+    keyspace and per (keyspace, type), whatever the number of tables and columns."""
+    from . import shards
+
+    sources = shards.shard_files() if shards.ENABLED else [(None, None)]
+    keyspaces, types = [], Counter()
+    for keyspace_name, db_file in sources:
+        rows, counts = _keyspace_rows(get_connection(db_file).cursor(), keyspace_name)
+        keyspaces.extend(rows)
+        types.update(counts)
+    totals = {'keyspaces': len(keyspaces)}
+    totals.update({field: sum(row[field] for row in keyspaces) for field in KEYSPACE_STATS})
+    return {
+        'totals': _coverage(totals, 'described_tables'),
+        'types': dict(types.most_common()),
+        'keyspaces': [_coverage(row, 'described_tables') for row in keyspaces],
+    }
+
+
+def keyspace_stats(keyspace_name):
+    """A keyspace's summary, type distribution and per-table summaries, or None for an unknown keyspace."""
+    from . import shards
+
+    cursor = get_connection(shards.shard_for(keyspace_name)).cursor()
+    rows, types = _keyspace_rows(cursor, keyspace_name)
+    if not rows:
+        return None
+    cursor.execute(f'''
+        SELECT table_name, {', '.join(TABLE_STATS)} FROM table_stats WHERE keyspace_name = ? ORDER BY table_name
+    ''', (keyspace_name,))
+    tables = [_coverage(dict(zip(('table_name',) + TABLE_STATS, row)), None) for row in cursor.fetchall()]
+    return {'keyspace': _coverage(rows[0], 'described_tables'), 'types': dict(types.most_common()), 'tables': tables}
@@ -0,0 +1,336 @@
+import gzip
+import io
+import json
+from collections import deque
+
+from .fingerprints import TableFingerprint
+from .ingest import COLUMN_FIELDS, normalize_row, table_runs
+from .upload_stream import CHUNK_SIZE, UploadError, iter_csv_rows
+
+# Bytes of (decompressed) input parsed at a time
+READ_BLOCK_SIZE = 1024 * 1024
+PARQUET_BATCH_SIZE = 65536
+
+UPLOAD_FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.parquet': 'parquet'}
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+DEFAULTS = {'note': 'no note', 'tag': 'no tags', 'status': 'active'}
+
+
+def upload_format(filename):
+    """(format, compression) of an upload from its file name, e.g. ('csv', 'gzip') for schema.csv.gz.
+
+    Raises UploadError for anything but CSV or NDJSON, optionally gzip or zstd compressed, and Parquet.
+    """
+    name = (filename or '').lower()
+    compression = next((codec for suffix, codec in COMPRESSIONS.items() if name.endswith(suffix)), None)
+    if compression:
+        name = name.rsplit('.', 1)[0]
+    fmt = next((fmt for suffix, fmt in UPLOAD_FORMATS.items() if name.endswith(suffix)), None)
+    if fmt is None or (fmt == 'parquet' and compression):
+        raise UploadError('Only CSV and NDJSON files (optionally .gz or .zst compressed) and Parquet files '
+                          'are allowed')
+    return fmt, compression
+
+
+def needs_seekable(fmt):
+    """Parquet keeps its metadata at the end of the file: it must be spooled before it can be read."""
+    return fmt == 'parquet'
+
+
+class ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterable of byte chunks, such as MultipartFileStream.chunks()."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def open_upload(file, compression=None):
+    """Wrap a binary file object so that reading it yields the decompressed upload, through a buffered
+    reader that supports peek()."""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode='rb')
+    if compression == 'zstd':
+        import zstandard
+
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True),
+                                 buffer_size=CHUNK_SIZE)
+    return file if hasattr(file, 'peek') else io.BufferedReader(file, buffer_size=CHUNK_SIZE)
+
+
+def _text(batch, field):
+    """A batch column as trimmed strings, '' where it is missing or null."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if field not in batch.schema.names:
+        return pa.array([''] * batch.num_rows, pa.string())
+    column = batch.column(field)
+    if pa.types.is_binary(column.type) or pa.types.is_large_binary(column.type):
+        # Blobs such as column_name_bytes are shown as 0x-prefixed hex, as cqlsh exports them
+        return pa.array(['' if value is None else '0x' + value.hex() for value in column.to_pylist()], pa.string())
+    if not pa.types.is_string(column.type):
+        column = pc.cast(column, pa.string())
+    return pc.fill_null(pc.utf8_trim_whitespace(column), '')
+
+
+def _position(batch):
+    """The position column as integers, 0 where it is missing or not a whole number."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if 'position' in batch.schema.names:
+        column = batch.column('position')
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            return pc.fill_null(pc.cast(column, pa.int64(), safe=False), 0)
+    text = _text(batch, 'position')
+    # As int() reads them: an optional sign, then digits that may start with zeros. Values beyond int64
+    # fall back to 0, as they do in normalize_row; same-length digit strings compare like their numbers
+    negative = pc.starts_with(text, '-')
+    digits = pc.replace_substring_regex(text, r'^[+-]?0*(\d)', r'\1')
+    length = pc.utf8_length(digits)
+    limit = pc.if_else(negative, str(2 ** 63), str(2 ** 63 - 1))
+    valid = pc.and_(pc.match_substring_regex(text, r'^[+-]?\d+$'),
+                    pc.or_(pc.less(length, 19), pc.and_(pc.equal(length, 19), pc.less_equal(digits, limit))))
+    signed = pc.if_else(negative, pc.binary_join_element_wise('-', digits, ''), digits)
+    return pc.if_else(valid, pc.cast(pc.if_else(valid, signed, '0'), pa.int64()), 0)
+
+
+def normalize_batch(batch):
+    """Vectorized normalize_row over an Arrow record batch: returns one array per `columns` field, leaving
+    out rows whose key fields are missing."""
+    import pyarrow.compute as pc
+
+    arrays = []
+    for field in COLUMN_FIELDS:
+        if field == 'position':
+            arrays.append(_position(batch))
+            continue
+        values = _text(batch, field)
+        if field in DEFAULTS:
+            values = pc.if_else(pc.equal(values, ''), DEFAULTS[field], values)
+        arrays.append(values)
+    keep = pc.and_(pc.and_(pc.not_equal(arrays[0], ''), pc.not_equal(arrays[1], '')), pc.not_equal(arrays[2], ''))
+    if not pc.all(keep).as_py():
+        arrays = [pc.filter(values, keep) for values in arrays]
+    return arrays
+
+
+class ArrowRows:
+    """The `columns` tuples of a slice of normalized arrays, only turned into Python objects when iterated."""
+
+    def __init__(self, arrays, start, stop):
+        self.arrays = arrays
+        self.start = start
+        self.stop = stop
+
+    def __iter__(self):
+        return zip(*(values.slice(self.start, self.stop - self.start).to_pylist() for values in self.arrays))
+
+
+def arrow_table_runs(batches):
+    """table_runs over Arrow record batches: the runs are found, and their text built for hashing, with
+    Arrow kernels, so the rows of a run that turns out to be unchanged never become Python objects.
+
+    Yields the same fingerprints as table_runs over the same rows.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    carry = None
+    for batch in batches:
+        arrays = normalize_batch(batch)
+        if carry:
+            # The last run of the previous batch may continue in this one
+            arrays = [pa.concat_arrays([tail, values]) for tail, values in zip(carry, arrays)]
+        size = len(arrays[0])
+        if not size:
+            continue
+        keyspaces, tables = arrays[0], arrays[1]
+        boundaries = pc.or_(pc.not_equal(keyspaces.slice(1), keyspaces.slice(0, size - 1)),
+                            pc.not_equal(tables.slice(1), tables.slice(0, size - 1)))
+        starts = [0] + [index + 1 for index in pc.indices_nonzero(boundaries).to_pylist()]
+        carry = [values.slice(starts[-1]) for values in arrays]
+        yield from _runs(arrays, starts)
+    if carry:
+        yield from _runs(carry, [0], len(carry[0]))
+
+
+def _runs(arrays, starts, stop=None):
+    """Yield the runs beginning at `starts`; without `stop`, the last one is held back as incomplete."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if stop is None:
+        starts, stop = starts[:-1], starts[-1]
+    if not starts:
+        return
+    offsets = starts + [stop]
+    rows = pc.binary_join_element_wise(*(pc.cast(values, pa.string()) for values in arrays[2:]), '\x1f')
+    texts = pc.binary_join(pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), rows.slice(0, stop)), '\x1e')
+    keys = zip(arrays[0].take(starts).to_pylist(), arrays[1].take(starts).to_pylist())
+    for key, text, start, end in zip(keys, texts.to_pylist(), offsets, offsets[1:]):
+        fingerprint = TableFingerprint()
+        fingerprint.add(text, end - start)
+        yield key, fingerprint, ArrowRows(arrays, start, end)
+
+
+class LineTracker(io.RawIOBase):
+    """Pass a stream through, remembering the last few blocks read from it and the line each one starts on,
+    so that a record the CSV reader rejects can be reported by its line number."""
+
+    def __init__(self, stream, window=4):
+        self._stream = stream
+        self._blocks = deque(maxlen=window)
+        self._offset = 0
+        self._lines = 1
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        if size:
+            self._blocks.append((self._offset, self._lines, data))
+            self._offset += size
+            self._lines += data.count(b'\n')
+        return size
+
+    def line_of(self, text):
+        """Line number of the first line starting with `text` among the blocks remembered, or None."""
+        if not self._blocks:
+            return None
+        offset, first_line, _ = self._blocks[0]
+        head = b'\n' if offset == 0 else b''
+        window = head + b''.join(data for _, _, data in self._blocks)
+        index = window.find(b'\n' + text.encode('utf-8'))
+        if index < 0:
+            return None
+        return first_line + window.count(b'\n', 0, index + 1) - len(head)
+
+
+def _field_count_error(line, expected, actual):
+    where = f'Line {line}' if line else 'A row'
+    return UploadError(f'{where} has {actual} fields where the header has {expected}')
+
+
+def _csv_batches(stream):
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    if not stream.peek(1):
+        return
+    # A row with more or fewer fields than the header fails the upload: leaving it out would have its
+    # column reconciled as deleted
+    tracker = LineTracker(stream)
+    rejected = []
+
+    def reject(row):
+        rejected.append(row)
+        return 'error'
+
+    # Every known field is read as a string (type inference on the first block would break on a later
+    # block that does not fit); other columns are skipped, missing ones come back as nulls. Blocks are read
+    # one at a time so that the tracker still holds the block of a rejected row.
+    try:
+        yield from pa_csv.open_csv(
+            tracker,
+            read_options=pa_csv.ReadOptions(block_size=READ_BLOCK_SIZE, use_threads=False),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=reject),
+            convert_options=pa_csv.ConvertOptions(column_types={field: pa.string() for field in COLUMN_FIELDS},
+                                                  include_columns=list(COLUMN_FIELDS),
+                                                  include_missing_columns=True, strings_can_be_null=False))
+    except pa.ArrowInvalid as e:
+        if not rejected:
+            raise
+        row = rejected[0]
+        raise _field_count_error(tracker.line_of(row.text) or row.number, row.expected_columns,
+                                 row.actual_columns) from e
+
+
+def _ndjson_batches(stream):
+    import pyarrow as pa
+    from pyarrow import json as pa_json
+
+    while True:
+        lines = stream.readlines(READ_BLOCK_SIZE)
+        if not lines:
+            return
+        block = b''.join(lines)
+        if not block.strip():
+            continue
+        try:
+            yield from pa_json.read_json(io.BytesIO(block)).to_batches()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # A field whose type changes between lines defeats Arrow's inference: normalize row by row
+            rows = filter(None, (normalize_row(json.loads(line)) for line in lines if line.strip()))
+            yield pa.RecordBatch.from_pylist([dict(zip(COLUMN_FIELDS, row)) for row in rows])
+
+
+def _parquet_batches(file):
+    from pyarrow import parquet as pq
+
+    parquet = pq.ParquetFile(file)
+    present = [field for field in COLUMN_FIELDS if field in parquet.schema_arrow.names]
+    yield from parquet.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=present)
+
+
+def _checked_csv_rows(reader):
+    """Rows of a csv.DictReader, failing on the first one whose field count differs from the header's."""
+    for row in reader:
+        extra = row.pop(None, ())
+        missing = sum(value is None for value in row.values())
+        if extra or missing:
+            raise _field_count_error(reader.line_num, len(reader.fieldnames),
+                                     len(row) - missing + len(extra))
+        yield row
+
+
+def _fallback_rows(stream, fmt):
+    """Per-row parsing with the standard library, for CSV and NDJSON when pyarrow is not installed."""
+    if fmt == 'csv':
+        reader = iter_csv_rows(iter(lambda: stream.read(CHUNK_SIZE), b''), encoding='utf-8-sig')
+        return filter(None, map(normalize_row, _checked_csv_rows(reader)))
+    return filter(None, (normalize_row(json.loads(line)) for line in stream if line.strip()))
+
+
+def _reading(runs):
+    """Report a file that cannot be decompressed or parsed as a bad upload rather than a server error.
+    Only errors raised while reading pass through here, not those of the database work in between."""
+    try:
+        yield from runs
+    except UploadError:
+        raise
+    except Exception as e:
+        raise UploadError(f'Could not read the uploaded file: {e}') from e
+
+
+def read_upload(file, fmt, compression=None):
+    """Yield the table runs (see table_runs) of an uploaded file, parsing it a block at a time.
+
+    `file` is a binary file object; Parquet needs it to be seekable (see needs_seekable).
+    """
+    stream = file if fmt == 'parquet' else open_upload(file, compression)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        if fmt == 'parquet':
+            raise UploadError('Parquet uploads require the pyarrow package', status=501)
+        return _reading(table_runs(_fallback_rows(stream, fmt)))
+    batches = {'csv': _csv_batches, 'ndjson': _ndjson_batches, 'parquet': _parquet_batches}[fmt](stream)
+    return _reading(arrow_table_runs(batches))
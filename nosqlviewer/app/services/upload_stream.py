@@ -0,0 +1,91 @@
+import codecs
+import csv
+import os
+from datetime import datetime
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Raised for malformed uploads; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class MultipartFileStream:
+    """Incrementally parse a multipart/form-data body and expose one file part as a stream of chunks.
+
+    Nothing is written to disk and at most one chunk of the body is held in memory.
+    """
+
+    def __init__(self, stream, content_type, field_name='file', chunk_size=CHUNK_SIZE):
+        mimetype, options = parse_options_header(content_type)
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise UploadError('No file part in the request')
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._chunk_size = chunk_size
+        self.field_name = field_name
+        self.filename = self._find_file()
+
+    def _events(self):
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, NeedData):
+                self._decoder.receive_data(self._stream.read(self._chunk_size) or None)
+                continue
+            yield event
+            if isinstance(event, Epilogue):
+                return
+
+    def _find_file(self):
+        self._parts = self._events()
+        for event in self._parts:
+            if isinstance(event, File) and event.name == self.field_name:
+                return event.filename
+        raise UploadError('No file part in the request')
+
+    def chunks(self):
+        """Yield the raw bytes of the file part."""
+        for event in self._parts:
+            if not isinstance(event, Data):
+                break
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                break
+
+
+def iter_lines(text_chunks):
+    """Re-split decoded text chunks into lines, keeping the line terminators the csv module relies on."""
+    pending = ''
+    for text in text_chunks:
+        lines = (pending + text).splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        yield from lines
+    if pending:
+        yield pending
+
+
+def iter_csv_rows(chunks, encoding='utf-8'):
+    """Stream CSV dicts out of an iterable of raw byte chunks."""
+    return csv.DictReader(iter_lines(codecs.iterdecode(chunks, encoding)))
+
+
+def retain_compressed(chunks, uploads_dir, extension='.csv'):
+    """Pass chunks through unchanged while writing a zstd-compressed copy of them to `uploads_dir`."""
+    import zstandard
+
+    os.makedirs(uploads_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')
+    file_path = os.path.join(uploads_dir, f"{timestamp}{extension}.zst")
+    with open(file_path, 'wb') as raw, zstandard.ZstdCompressor().stream_writer(raw) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
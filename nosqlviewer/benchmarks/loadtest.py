@@ -0,0 +1,349 @@
+"""Mixed-workload load test: the app under gunicorn, against a seeded database, hit by concurrent clients.
+
+    python -m nosqlviewer.benchmarks.loadtest --size 100k --workers 4 --clients 32 --duration 60
+    python -m nosqlviewer.benchmarks.loadtest --mix search=40,navigate=40,tag=10,relation=5,upload=5
+
+Every client repeatedly picks an operation from the weighted mix: a search through /api/filtered_data,
+a tree navigation (keyspaces, tables, columns, table description), a column annotation through
+/api/update_column_tag, a new relation through /api/save_relation, or a synchronous schema upload
+(at most --max-uploads at a time, alternating between two exports that differ by a small delta).
+
+Reports throughput, tail latency, error and lock-timeout ("database is locked") rates per operation, and
+the writer-induced read stall: read latency while an upload is in flight against while none is.
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from nosqlviewer.app.services import db
+from nosqlviewer.app.services.db import get_connection
+from nosqlviewer.app.services.ingest import process_csv_data
+from nosqlviewer.app.services.migrations import migrate
+
+from .run import SIZES, _insert_relations, environment, percentile
+from .schema_gen import ATTRIBUTES, NOUNS, TAGS, apply_delta, generate_columns, write_csv
+
+DEFAULT_MIX = 'search=40,navigate=40,tag=10,relation=5,upload=5'
+OPERATIONS = ('search', 'navigate', 'tag', 'relation', 'upload')
+READ_OPERATIONS = ('search', 'navigate')
+DB_NAME = 'nosql_viewer.db'
+STARTUP_TIMEOUT = 120
+REQUEST_TIMEOUT = 300
+# Reads slower than this while an upload is in flight count as stalled
+STALL_THRESHOLD_MS = 1000.0
+LOCKED = b'database is locked'
+
+
+def parse_mix(text):
+    """'search=40,upload=5' -> {'search': 40.0, 'upload': 5.0}; raises ValueError for unknown operations."""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}'; expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight')
+    return mix
+
+
+def seed_database(directory, n_columns, seed=0):
+    """Create and load the database the server will use; returns what the clients need to build requests.
+
+    Writes two exports next to it: the loaded one and a small delta of it, which uploads alternate between
+    so that each one has changes to reconcile.
+    """
+    rng = random.Random(seed)
+    exports = [os.path.join(directory, 'schema.csv'), os.path.join(directory, 'schema_delta.csv')]
+    write_csv(generate_columns(n_columns, seed), exports[0])
+    write_csv(apply_delta(generate_columns(n_columns, seed), seed=seed + 1), exports[1])
+
+    db.set_db_file(os.path.join(directory, DB_NAME))
+    migrate()
+    process_csv_data({key: str(value) for key, value in row.items()} for row in generate_columns(n_columns, seed))
+    tables = [tuple(row) for row in get_connection().execute(
+        'SELECT keyspace_name, table_name FROM table_description ORDER BY keyspace_name, table_name')]
+    _insert_relations(tables, max(10, n_columns // 50), rng)
+    columns = [tuple(row) for row in get_connection().execute(
+        "SELECT keyspace_name, table_name, column_name FROM columns WHERE status = 'active'")]
+    db.close_connections()
+    return {'tables': tables, 'columns': columns, 'exports': exports}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port, workers, threads=1, preload=False):
+    """Start gunicorn serving create_app() from `directory`, where it finds the seeded database."""
+    config = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+    command = [sys.executable, '-m', 'gunicorn', '--config', config, '--workers', str(workers), '--threads',
+               str(threads), '--bind', f'127.0.0.1:{port}', '--chdir', directory, '--timeout', str(REQUEST_TIMEOUT),
+               '--log-level', 'warning']
+    if preload:
+        command.append('--preload')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get('PYTHONPATH')))))
+    log = open(os.path.join(directory, 'gunicorn.log'), 'wb')
+    return subprocess.Popen([*command, 'nosqlviewer.app:create_app()'], env=env, stdout=log,
+                            stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(port, server, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {server.returncode} during startup')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/keyspace_names')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'The server did not answer within {timeout}s')
+
+
+def _multipart(path):
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as file:
+        content = file.read()
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Client(threading.Thread):
+    """One simulated user: issues requests from the mix until `deadline`, recording one sample per request
+    as (operation, started, seconds, status, locked)."""
+
+    def __init__(self, port, mix, targets, uploads, deadline, seed):
+        super().__init__(daemon=True)
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+        self.mix = mix
+        self.targets = targets
+        self.uploads = uploads
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.samples = []
+
+    def request(self, operation, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except OSError:
+            # Includes timeouts: the connection is reopened by the next request
+            self.connection.close()
+            content, status = b'', 0
+        self.samples.append((operation, started, time.perf_counter() - started, status, LOCKED in content))
+
+    def _json(self, operation, method, path, payload):
+        self.request(operation, method, path, json.dumps(payload), {'Content-Type': 'application/json'})
+
+    def search(self):
+        words = NOUNS + ATTRIBUTES + TAGS
+        self.request('search', 'GET', '/api/filtered_data?' + urlencode({'search': self.rng.choice(words)}))
+
+    def navigate(self):
+        keyspace, table = self.rng.choice(self.targets['tables'])
+        self.request('navigate', 'GET', '/api/keyspace_names')
+        self.request('navigate', 'GET', '/api/table_names?' + urlencode({'keyspace_name': keyspace}))
+        query = urlencode({'keyspace_name': keyspace, 'table_name': table})
+        self.request('navigate', 'GET', f'/api/get_columns?{query}')
+        self.request('navigate', 'GET', f'/api/get_table_description?{query}')
+
+    def tag(self):
+        keyspace, table, column = self.rng.choice(self.targets['columns'])
+        self._json('tag', 'PUT', '/api/update_column_tag', {
+            'keyspace_name': keyspace, 'table_name': table, 'column_name': column,
+            'tag': self.rng.choice(TAGS), 'note': f'load test {self.rng.randrange(10 ** 6)}'})
+
+    def relation(self):
+        (from_keyspace, from_table, from_column), (to_keyspace, to_table, to_column) = self.rng.sample(
+            self.targets['columns'], 2)
+        self._json('relation', 'POST', '/api/save_relation', {
+            'from_keyspace': from_keyspace, 'from_table': from_table, 'from_column': from_column,
+            'to_keyspace': to_keyspace, 'to_table': to_table, 'to_column': to_column, 'is_published': 'true'})
+
+    def upload(self):
+        body, content_type = self.uploads.next_body()
+        self.request('upload', 'POST', '/api/upload-file?wait=1', body, {'Content-Type': content_type})
+
+    def run(self):
+        operations, weights = zip(*self.mix.items())
+        while time.perf_counter() < self.deadline:
+            operation = self.rng.choices(operations, weights)[0]
+            if operation == 'upload':
+                if not self.uploads.slots.acquire(blocking=False):
+                    # Another client is uploading: do something else instead
+                    continue
+                try:
+                    self.upload()
+                finally:
+                    self.uploads.slots.release()
+            else:
+                getattr(self, operation)()
+        self.connection.close()
+
+
+class Uploads:
+    """The request bodies uploads alternate between, and the limit on concurrent uploads."""
+
+    def __init__(self, exports, max_uploads):
+        self.bodies = [_multipart(path) for path in exports]
+        self.slots = threading.BoundedSemaphore(max_uploads)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def next_body(self):
+        with self.lock:
+            self.count += 1
+            # The first upload sends the delta: the database holds the full export already
+            return self.bodies[self.count % len(self.bodies)]
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {'requests': 0}
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def summarize(samples, elapsed):
+    """Per-operation and overall statistics, plus read latency split by whether an upload was in flight."""
+    by_operation = defaultdict(list)
+    for sample in samples:
+        by_operation[sample[0]].append(sample)
+    report = {}
+    for operation, group in [*sorted(by_operation.items()), ('all', samples)]:
+        errors = sum(1 for _, _, _, status, _ in group if status == 0 or status >= 500)
+        locked = sum(1 for *_, is_locked in group if is_locked)
+        report[operation] = {
+            **_latency_summary([seconds for _, _, seconds, _, _ in group]),
+            'throughput': round(len(group) / elapsed, 1),
+            'error_rate': round(errors / len(group), 4) if group else 0.0,
+            'lock_timeout_rate': round(locked / len(group), 4) if group else 0.0,
+        }
+
+    uploads = sorted((started, started + seconds) for operation, started, seconds, *_ in samples
+                     if operation == 'upload')
+    during, outside = [], []
+    for operation, started, seconds, *_ in samples:
+        if operation in READ_OPERATIONS:
+            busy = any(begin <= started < end for begin, end in uploads)
+            (during if busy else outside).append(seconds)
+    stalled = sum(1 for seconds in during if seconds * 1000 > STALL_THRESHOLD_MS)
+    report['read_stall'] = {
+        'during_upload': _latency_summary(during),
+        'no_upload': _latency_summary(outside),
+        'upload_busy_seconds': round(sum(end - begin for begin, end in uploads), 2),
+        f'stalled_over_{STALL_THRESHOLD_MS:g}ms': stalled,
+    }
+    return report
+
+
+def print_report(report):
+    print(f"{'operation':<10} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'errors':>7} {'locked':>7}")
+    for operation, m in report.items():
+        if operation == 'read_stall' or not m['requests']:
+            continue
+        print(f"{operation:<10} {m['requests']:>8} {m['throughput']:>8} {m['p50_ms']:>9} {m['p95_ms']:>9} "
+              f"{m['p99_ms']:>9} {m['max_ms']:>9} {m['error_rate']:>7.2%} {m['lock_timeout_rate']:>7.2%}")
+    stall = report['read_stall']
+    print(f"\nReads while an upload was in flight ({stall['upload_busy_seconds']}s of uploads):")
+    for label, key in (('during upload', 'during_upload'), ('no upload', 'no_upload')):
+        m = stall[key]
+        if m['requests']:
+            print(f"  {label:<14} {m['requests']:>8} reads  p50 {m['p50_ms']} ms  p99 {m['p99_ms']} ms  "
+                  f"max {m['max_ms']} ms")
+    print(f"  stalled over {STALL_THRESHOLD_MS:g} ms: {stall[f'stalled_over_{STALL_THRESHOLD_MS:g}ms']}")
+
+
+def run_load(port, mix, targets, duration, clients, max_uploads, seed=0):
+    uploads = Uploads(targets['exports'], max_uploads)
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [Client(port, mix, targets, uploads, deadline, seed + index) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Requests in flight at the deadline finish after it: measure up to the last one
+    elapsed = time.perf_counter() - started
+    return summarize([sample for thread in threads for sample in thread.samples], elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='10k', choices=sorted(SIZES), help='columns in the seeded database')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='operation weights (default %(default)s)')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients (default %(default)s)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes (default %(default)s)')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker (default %(default)s)')
+    parser.add_argument('--preload', action='store_true', help='start gunicorn with --preload')
+    parser.add_argument('--max-uploads', type=int, default=1, help='concurrent uploads (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if importlib.util.find_spec('gunicorn') is None:
+        parser.error('gunicorn is not installed (pip install gunicorn)')
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'Seeding {args.size} columns...', file=sys.stderr)
+        targets = seed_database(directory, SIZES[args.size], args.seed)
+        port = _free_port()
+        server = start_server(directory, port, args.workers, args.threads, args.preload)
+        try:
+            wait_until_ready(port, server)
+            print(f'Running {args.clients} clients for {args.duration:g}s against {args.workers} workers...',
+                  file=sys.stderr)
+            report = run_load(port, mix, targets, args.duration, args.clients, args.max_uploads, args.seed)
+        except RuntimeError:
+            with open(os.path.join(directory, 'gunicorn.log'), errors='replace') as log:
+                print(log.read()[-4000:], file=sys.stderr)
+            raise
+        finally:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'size': args.size, 'mix': mix, 'clients': args.clients,
+                       'duration': args.duration, 'workers': args.workers, 'threads': args.threads,
+                       'report': report}, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
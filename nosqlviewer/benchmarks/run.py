@@ -0,0 +1,288 @@
+"""Benchmarks for the ingestion, search and browsing endpoints, driven through Flask's test client.
+
+    python -m nosqlviewer.benchmarks.run --sizes 10k 100k --save-baseline
+    python -m nosqlviewer.benchmarks.run --sizes 10k 100k --compare
+
+Every size runs in a fresh interpreter against its own temporary database, so peak RSS is per size.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from nosqlviewer.app import create_app
+from nosqlviewer.app.services import db
+from nosqlviewer.app.services.db import get_connection, transaction
+
+from .schema_gen import ATTRIBUTES, NOUNS, TAGS, apply_delta, generate_columns, write_csv
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+DEFAULT_ITERATIONS = 200
+DELTA_FRACTION = 0.01
+RELATIONS_PER_COLUMN = 0.02
+# Relative change beyond which --compare reports a regression
+DEFAULT_TOLERANCE = 0.25
+# Metrics compared against the baseline, and whether a higher value is better
+COMPARED_METRICS = (('throughput', True), ('p50_ms', False), ('p99_ms', False), ('peak_rss_mb', False))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run_scenario(calls, rows=None):
+    """Issue each request in `calls` (zero-argument callables returning a response) and summarize them.
+
+    Throughput is requests per second, or rows per second when `rows` (the rows the requests processed)
+    is given. Peak RSS is the process peak so far, so it grows along the scenarios of a size.
+    """
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for call in calls:
+        sent = time.perf_counter()
+        response = call()
+        # Consume streamed bodies inside the timed region, without holding them in memory
+        for _ in response.iter_encoded():
+            pass
+        latencies.append(time.perf_counter() - sent)
+        errors += response.status_code >= 400
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput': round((rows if rows is not None else len(latencies)) / elapsed, 1),
+        'unit': 'rows/s' if rows is not None else 'req/s',
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _upload(client, path):
+    with open(path, 'rb') as file:
+        return client.post('/api/upload-file?wait=1', data={'file': (file, os.path.basename(path))},
+                           content_type='multipart/form-data')
+
+
+def _insert_relations(tables, count, rng):
+    """Seed `relations` directly: lineage lookups need data, but saving it is not what is measured."""
+    rows = []
+    for _ in range(count):
+        (from_keyspace, from_table), (to_keyspace, to_table) = rng.sample(tables, 2)
+        rows.append((from_keyspace, from_table, rng.choice(ATTRIBUTES), to_keyspace, to_table,
+                     rng.choice(ATTRIBUTES), rng.choice(('true', 'false'))))
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO relations (from_keyspace, from_table, from_column, to_keyspace, to_table, to_column,
+                                   is_published)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return rows
+
+
+def _typo(word, rng):
+    index = rng.randrange(len(word))
+    return word[:index] + word[index + 1:] if rng.random() < 0.5 else word[:index] + 'x' + word[index:]
+
+
+def benchmark_size(n_columns, iterations=DEFAULT_ITERATIONS, seed=0):
+    """Run every scenario against a fresh database holding `n_columns` synthetic columns."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        first_csv, delta_csv = os.path.join(tmp, 'schema.csv'), os.path.join(tmp, 'schema_delta.csv')
+        write_csv(generate_columns(n_columns, seed), first_csv)
+        delta_rows = write_csv(apply_delta(generate_columns(n_columns, seed), DELTA_FRACTION, seed + 1), delta_csv)
+
+        db.set_db_file(os.path.join(tmp, 'benchmark.db'))
+        client = create_app().test_client()
+        results = {
+            'upload_first_load': run_scenario([lambda: _upload(client, first_csv)], rows=n_columns),
+            'upload_small_delta': run_scenario([lambda: _upload(client, delta_csv)], rows=delta_rows),
+            'upload_noop_reload': run_scenario([lambda: _upload(client, delta_csv)], rows=delta_rows),
+        }
+
+        tables = [tuple(row) for row in get_connection().execute(
+            "SELECT keyspace_name, table_name FROM table_description ORDER BY keyspace_name, table_name")]
+        relations = _insert_relations(tables, max(10, int(n_columns * RELATIONS_PER_COLUMN)), rng)
+        words = NOUNS + ATTRIBUTES + TAGS
+
+        terms = [rng.choice(words) if rng.random() < 0.7 else f'{rng.choice(NOUNS)}{rng.choice(ATTRIBUTES)}'
+                 for _ in range(iterations)]
+        results['filtered_data_search'] = run_scenario(
+            [lambda term=term: client.get('/api/filtered_data', query_string={'search': term}) for term in terms])
+        # Terms under three characters fall back to a LIKE scan: fewer of them
+        short_terms = [rng.choice(ATTRIBUTES)[:2] for _ in range(max(5, iterations // 10))]
+        results['filtered_data_short_terms'] = run_scenario(
+            [lambda term=term: client.get('/api/filtered_data', query_string={'search': term})
+             for term in short_terms])
+        typos = [_typo(f'{rng.choice(NOUNS)}{rng.choice(ATTRIBUTES)}', rng) for _ in range(iterations)]
+        results['filtered_data_fuzzy'] = run_scenario(
+            [lambda term=term: client.get('/api/filtered_data', query_string={'search': term, 'mode': 'fuzzy'})
+             for term in typos])
+
+        # Tree navigation as the UI does it: keyspaces, then the tables of one, then a table's columns
+        picks = [rng.choice(tables) for _ in range(iterations)]
+        navigation = []
+        for keyspace, table in picks:
+            navigation += [
+                lambda: client.get('/api/keyspace_names'),
+                lambda keyspace=keyspace: client.get('/api/table_names', query_string={'keyspace_name': keyspace}),
+                lambda keyspace=keyspace, table=table: client.get(
+                    '/api/get_columns', query_string={'keyspace_name': keyspace, 'table_name': table}),
+                lambda keyspace=keyspace, table=table: client.get(
+                    '/api/get_table_description', query_string={'keyspace_name': keyspace, 'table_name': table}),
+            ]
+        results['tree_navigation'] = run_scenario(navigation)
+
+        sources = [rng.choice(relations)[:2] for _ in range(iterations)]
+        results['get_relations'] = run_scenario(
+            [lambda source=source: client.get('/api/get_relations', query_string={
+                'from_keyspace': source[0], 'from_table': source[1]}) for source in sources])
+
+        total = get_connection().execute('SELECT COUNT(*) FROM columns').fetchone()[0]
+        results['db_data_paged'] = run_scenario(_page_through(client, 'columns', 1000), rows=total)
+        results['db_data_stream'] = run_scenario(
+            [lambda: client.get('/api/db_data', query_string={'table_name': 'columns', 'stream': 'ndjson'})],
+            rows=total)
+        db.close_connections()
+    return results
+
+
+def _page_through(client, table_name, limit):
+    """Requests walking the whole table page by page, each following the previous page's cursor."""
+    state = {'after': 0}
+
+    def fetch():
+        response = client.get('/api/db_data', query_string={'table_name': table_name, 'after': state['after'],
+                                                            'limit': limit})
+        state['after'] = response.get_json()['next_after']
+        return response
+
+    while state['after'] is not None:
+        yield fetch
+
+
+def run_isolated(size, iterations, seed):
+    """Benchmark one size in a child interpreter, so its peak RSS is not inflated by the previous size."""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'results.json')
+        subprocess.run([sys.executable, '-m', __spec__.name, '--sizes', size, '--iterations', str(iterations),
+                        '--seed', str(seed), '--in-process', '--quiet', '--output', output], check=True)
+        with open(output) as file:
+            return json.load(file)['results'][size]
+
+
+def environment():
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print every metric next to its baseline value; return the regressions beyond `tolerance`."""
+    regressions = []
+    for size, scenarios in results.items():
+        for scenario, metrics in scenarios.items():
+            reference = baseline.get(size, {}).get(scenario)
+            if not reference:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS:
+                before, after = reference.get(metric), metrics.get(metric)
+                if not before or after is None:
+                    continue
+                change = (after - before) / before
+                worse = -change if higher_is_better else change
+                flag = 'REGRESSION' if worse > tolerance else ''
+                print(f'{size:>5} {scenario:<26} {metric:<12} {before:>12} -> {after:>12} {change:>+8.1%} {flag}')
+                if flag:
+                    regressions.append((size, scenario, metric, change))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'size':>5} {'scenario':<26} {'requests':>8} {'errors':>6} {'throughput':>18} {'p50 ms':>10} "
+          f"{'p99 ms':>10} {'peak RSS MB':>12}")
+    for size, scenarios in results.items():
+        for scenario, m in scenarios.items():
+            print(f"{size:>5} {scenario:<26} {m['requests']:>8} {m['errors']:>6} "
+                  f"{m['throughput']:>11} {m['unit']:<6} {m['p50_ms']:>10} {m['p99_ms']:>10} {m['peak_rss_mb']:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'], choices=sorted(SIZES))
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help='requests per read scenario (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--save-baseline', nargs='?', const='default', metavar='NAME',
+                        help='store the results as benchmarks/baselines/NAME.json')
+    parser.add_argument('--compare', nargs='?', const='default', metavar='NAME',
+                        help='compare with a stored baseline; exits with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative change counted as a regression (default %(default)s)')
+    parser.add_argument('--in-process', action='store_true', help='run every size in this interpreter')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        if not args.quiet:
+            print(f'Benchmarking {size} columns...', file=sys.stderr)
+        if args.in_process:
+            results[size] = benchmark_size(SIZES[size], args.iterations, args.seed)
+        else:
+            results[size] = run_isolated(size, args.iterations, args.seed)
+    report = {'environment': environment(), 'iterations': args.iterations, 'seed': args.seed, 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if not args.quiet:
+        print_results(results)
+
+    regressions = []
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f'{args.compare}.json')) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        print(f'{len(regressions)} regression(s) against baseline {args.compare!r}')
+    if args.save_baseline:
+        path = os.path.join(BASELINE_DIR, f'{args.save_baseline}.json')
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        # Sizes not run this time keep their previous baseline
+        if os.path.exists(path):
+            with open(path) as file:
+                previous = json.load(file)
+            report['results'] = {**previous['results'], **results}
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+        print(f'Baseline saved to {path}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import csv
+import random
+import sys
+
+# Same header as app/schemas/cassandra_schema_columns.csv, the output of `SELECT * FROM system_schema.columns`
+CSV_FIELDS = ('keyspace_name', 'table_name', 'column_name', 'clustering_order', 'column_name_bytes', 'kind',
+              'position', 'type', 'tag', 'note')
+
+DOMAINS = ('educator', 'billing', 'usermanagement', 'inventory', 'analytics', 'messaging', 'catalog', 'payments',
+           'scheduling', 'reporting', 'identity', 'content', 'search', 'notifications', 'logistics', 'audit')
+ENVIRONMENTS = ('', '_v2', '_archive', '_staging', '_eu', '_us', '_apac', '_legacy')
+NOUNS = ('account', 'user', 'course', 'session', 'invoice', 'order', 'payment', 'product', 'event', 'message',
+         'device', 'lesson', 'schedule', 'report', 'team', 'group', 'campaign', 'referral', 'address', 'contract',
+         'ticket', 'shipment', 'review', 'subscription', 'enrollment', 'grade', 'profile', 'token', 'asset', 'quote')
+QUALIFIERS = ('active', 'by', 'daily', 'latest', 'pending', 'archived', 'history', 'summary', 'index', 'lookup',
+              'code', 'status', 'stats', 'audit', 'queue', 'snapshot')
+ATTRIBUTES = ('id', 'name', 'time', 'date', 'count', 'status', 'type', 'amount', 'code', 'email', 'city',
+              'country', 'reason', 'version', 'score', 'flag', 'url', 'owner', 'total', 'level', 'title', 'hash')
+
+# Weighted like the sample export: text and uuid dominate, collections and UDTs are rare
+TYPES = (('text', 38), ('uuid', 18), ('timestamp', 10), ('boolean', 9), ('int', 8), ('double', 4), ('timeuuid', 3),
+         ('date', 3), ('bigint', 2), ('set<text>', 1), ('map<text, text>', 1), ('frozen<fullname>', 1),
+         ('set<frozen<idname>>', 1), ('list<int>', 1))
+TAGS = ('Primary Column', 'pii', 'deprecated', 'finance', 'derived', 'audit trail', 'reporting', 'gdpr', 'internal',
+        'cost center', 'time of closing', 'lookup key')
+NOTE_TEMPLATES = (
+    'This column is used as the primary identifier for the {table} table.',
+    'Stores the {attribute} of the {noun}, updated by the {domain} service.',
+    '{attribute} as reported by the upstream {domain} feed; may lag by a few minutes.',
+    'Set when the {noun} is closed. Null for open records.',
+    'Denormalized copy of {noun}.{attribute} for fast lookups.',
+    'Legacy field kept for the {domain} migration, do not use in new code.',
+)
+
+_type_names, _type_weights = zip(*TYPES)
+
+
+def _table_width(rng):
+    """Columns per table: mostly narrow tables with a long tail of wide ones, like real exports."""
+    draw = rng.random()
+    if draw < 0.70:
+        return rng.randint(3, 15)
+    if draw < 0.95:
+        return rng.randint(16, 60)
+    return rng.randint(100, 500)
+
+
+def _annotation(rng, keyspace, table, noun, attribute):
+    tag = rng.choice(TAGS) if rng.random() < 0.3 else 'no tags'
+    note = ''
+    if rng.random() < 0.3:
+        note = rng.choice(NOTE_TEMPLATES).format(table=table, noun=noun, attribute=attribute,
+                                                 domain=keyspace.split('_')[0])
+    return tag, note
+
+
+def _table_columns(rng, keyspace, table, width):
+    noun = table.split('_')[-1]
+    partition_keys = 1 if width < 4 else rng.randint(1, 2)
+    clustering = min(rng.randint(0, 3), width - partition_keys)
+    seen = set()
+    for index in range(width):
+        attribute = rng.choice(ATTRIBUTES)
+        column = attribute if index == 0 and attribute == 'id' else f'{rng.choice(NOUNS)}{attribute}'
+        if column in seen:
+            column = f'{column}{index}'
+        seen.add(column)
+        if index < partition_keys:
+            kind, position, order = 'partition_key', index, 'none'
+        elif index < partition_keys + clustering:
+            kind, position, order = 'clustering', index - partition_keys, rng.choice(('asc', 'asc', 'asc', 'desc'))
+        else:
+            kind, position, order = 'regular', -1, 'none'
+        tag, note = _annotation(rng, keyspace, table, noun, attribute)
+        yield {
+            'keyspace_name': keyspace,
+            'table_name': table,
+            'column_name': column,
+            'clustering_order': order,
+            'column_name_bytes': '0x' + column.encode().hex(),
+            'kind': kind,
+            'position': position,
+            'type': rng.choices(_type_names, _type_weights)[0],
+            'tag': tag,
+            'note': note,
+        }
+
+
+def keyspace_names(count):
+    """`count` distinct keyspace names built from the domain and environment lists."""
+    names = [domain + environment for environment in ENVIRONMENTS for domain in DOMAINS]
+    names += [f'{domain}_{index}' for index in range(count) for domain in DOMAINS]
+    return names[:count]
+
+
+def generate_columns(n_columns, seed=0):
+    """Yield `n_columns` CSV rows shaped like a system_schema.columns export, deterministically for `seed`.
+
+    Keyspaces scale with the schema (about one per 3000 columns, at least 16) and tables follow the width
+    distribution of _table_width, so large schemas have many keyspaces and a few very wide tables.
+    """
+    rng = random.Random(seed)
+    keyspaces = keyspace_names(max(len(DOMAINS), n_columns // 3000))
+    tables = set()
+    produced = 0
+    while produced < n_columns:
+        keyspace = rng.choice(keyspaces)
+        table = f'{rng.choice(QUALIFIERS)}_{rng.choice(NOUNS)}'
+        if (keyspace, table) in tables:
+            table = f'{table}_{len(tables)}'
+        tables.add((keyspace, table))
+        width = min(_table_width(rng), n_columns - produced)
+        for row in _table_columns(rng, keyspace, table, width):
+            yield row
+        produced += width
+
+
+def apply_delta(rows, fraction=0.01, seed=1):
+    """Yield `rows` as a later export would: about `fraction` of them changed, plus a quarter as many
+    dropped and added columns. Used for the small-delta reload benchmark."""
+    rng = random.Random(seed)
+    for row in rows:
+        draw = rng.random()
+        if draw < fraction / 4:
+            continue
+        if draw < fraction:
+            row = dict(row, type=rng.choices(_type_names, _type_weights)[0], note=f'{row["note"]} (revised)'.strip())
+        yield row
+        if rng.random() < fraction / 4:
+            column = f'added{rng.choice(ATTRIBUTES)}{rng.randrange(10 ** 6)}'
+            yield dict(row, column_name=column, column_name_bytes='0x' + column.encode().hex(), kind='regular',
+                       position=-1, clustering_order='none', tag='no tags', note='')
+
+
+def write_csv(rows, path):
+    """Write rows to `path` in the export's CSV format. Returns the number of rows written."""
+    count = 0
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+if __name__ == '__main__':
+    # python -m nosqlviewer.benchmarks.schema_gen 100000 schema_100k.csv [seed]
+    if len(sys.argv) < 3:
+        sys.exit('usage: schema_gen N_COLUMNS OUTPUT.csv [SEED]')
+    written = write_csv(generate_columns(int(sys.argv[1]), int(sys.argv[3]) if len(sys.argv) > 3 else 0),
+                        sys.argv[2])
+    print(f'Wrote {written} columns to {sys.argv[2]}')
@@ -0,0 +1,149 @@
+"""Startup time: from a fresh interpreter to the first responses, and from fork to the first responses of a
+worker forked from a preloaded app (as gunicorn --preload does), against a seeded database.
+
+    python -m nosqlviewer.benchmarks.startup --size 100k --repeat 5
+    python -m nosqlviewer.benchmarks.startup --size 10k --forks 8 --output startup.json
+
+Every cold start runs in its own interpreter, once with the warmup and once without (WARMUP=false), so
+the cost the warmup moves out of the first requests shows on both sides.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# The app is only imported inside the timed functions: this module must not import it beforehand, which
+# rules out module-level imports of .loadtest and .run
+DEFAULT_REPEAT = 3
+DEFAULT_FORKS = 4
+# What a browser asks for first, and a fuzzy search, which needs the column name index
+FIRST_REQUESTS = (
+    ('/api/keyspace_names', {}),
+    ('/api/stats', {}),
+    ('/api/filtered_data', {'search': 'acount', 'mode': 'fuzzy', 'limit': 10}),
+)
+
+
+def _first_requests(app):
+    client = app.test_client()
+    started = time.perf_counter()
+    for path, query_string in FIRST_REQUESTS:
+        response = client.get(path, query_string=query_string)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} answered {response.status_code}')
+    return time.perf_counter() - started
+
+
+def measure_cold():
+    """Child interpreter entry point: import, build the app and serve the first requests, timing each."""
+    started = time.perf_counter()
+    from nosqlviewer.app import create_app
+
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    first_requests = _first_requests(app)
+    return {'import': imported - started, 'create_app': created - imported, 'first_requests': first_requests,
+            'total': time.perf_counter() - started, 'phases': app.config['STARTUP_TIMINGS']}
+
+
+def measure_forks(forks):
+    """Child interpreter entry point: build the app once, then fork `forks` workers one after the other and
+    time each from fork to its first responses."""
+    from nosqlviewer.app import create_app
+
+    app = create_app()
+    timings = []
+    for _ in range(forks):
+        read_end, write_end = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            _first_requests(app)
+            os.write(write_end, str(time.perf_counter() - started).encode())
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as result:
+            timings.append(float(result.read()))
+        os.waitpid(pid, 0)
+    return timings
+
+
+def _run_child(directory, mode, warmup=True, forks=DEFAULT_FORKS):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, WARMUP='true' if warmup else 'false',
+               PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get('PYTHONPATH')))))
+    output = subprocess.run([sys.executable, '-m', __spec__.name, '--child', mode, '--forks', str(forks)],
+                            cwd=directory, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def run_startup(size, repeat=DEFAULT_REPEAT, forks=DEFAULT_FORKS, seed=0):
+    from .loadtest import seed_database
+    from .run import SIZES, percentile
+
+    with tempfile.TemporaryDirectory() as directory:
+        seed_database(directory, SIZES[size], seed)
+        # The first start applies no migration and finds the page cache warm, like a restart
+        _run_child(directory, 'cold')
+        results = {}
+        for name, warmup in (('cold', True), ('cold_no_warmup', False)):
+            runs = [_run_child(directory, 'cold', warmup) for _ in range(repeat)]
+            results[name] = {field: _ms(percentile([run[field] for run in runs], 0.5))
+                             for field in ('import', 'create_app', 'first_requests', 'total')}
+            results[name]['phases'] = {phase: _ms(percentile([run['phases'].get(phase, 0) for run in runs], 0.5))
+                                       for phase in runs[0]['phases']}
+        timings = _run_child(directory, 'fork', forks=forks)
+        results['preload_fork'] = {'first_requests_p50': _ms(percentile(timings, 0.5)),
+                                   'first_requests_max': _ms(max(timings)), 'forks': len(timings)}
+        return results
+
+
+def print_report(size, results):
+    print(f'{size} columns, milliseconds (median of the cold starts)')
+    for name in ('cold', 'cold_no_warmup'):
+        r = results[name]
+        phases = ', '.join(f'{phase} {value}' for phase, value in r['phases'].items())
+        print(f"  {name:<15} import {r['import']:>8}  create_app {r['create_app']:>8}  "
+              f"first requests {r['first_requests']:>8}  total {r['total']:>8}  ({phases})")
+    fork = results['preload_fork']
+    print(f"  {'preload_fork':<15} fork to first responses: p50 {fork['first_requests_p50']}, "
+          f"max {fork['first_requests_max']} over {fork['forks']} workers")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='10k', choices=('10k', '100k', '1m'))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='cold starts per mode')
+    parser.add_argument('--forks', type=int, default=DEFAULT_FORKS, help='workers forked from the preloaded app')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--child', choices=('cold', 'fork'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # Run in the seeded directory, where the app finds the database under its default name
+        result = measure_cold() if args.child == 'cold' else measure_forks(args.forks)
+        print(json.dumps(result))
+        return 0
+
+    from .run import environment
+
+    results = run_startup(args.size, args.repeat, args.forks, args.seed)
+    print_report(args.size, results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'size': args.size, 'results': results}, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
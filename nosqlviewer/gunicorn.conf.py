@@ -0,0 +1,23 @@
+"""gunicorn hooks for the app. From the repository root:
+
+    gunicorn -c nosqlviewer/gunicorn.conf.py --preload --workers 4 'nosqlviewer.app:create_app()'
+
+(`app:app` does not work from this directory: the app/ package shadows app.py.)
+
+With --preload the app is created, migrated and warmed up once in the master, and the workers fork from
+it ready to serve. Without it every worker builds its own app.
+"""
+import time
+
+
+def pre_fork(server, worker):
+    worker.fork_started = time.perf_counter()
+
+
+def post_worker_init(worker):
+    # The app is loaded in the worker by now, with or without --preload: start its background work
+    from nosqlviewer.app import start_worker
+
+    start_worker()
+    worker.log.info('Worker %s ready %.1f ms after fork', worker.pid,
+                    (time.perf_counter() - worker.fork_started) * 1000)
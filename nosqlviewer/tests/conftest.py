@@ -0,0 +1,60 @@
+"""Shared fixtures. Run the suite from the repository root: python -m pytest nosqlviewer/tests"""
+import csv
+import io
+
+import pytest
+
+from nosqlviewer.app import create_app
+from nosqlviewer.app.services import db, shards
+from nosqlviewer.app.services.catalog_cache import catalog_cache
+from nosqlviewer.app.services.migrations import migrate
+
+UPLOAD_FIELDS = ('keyspace_name', 'table_name', 'column_name', 'clustering_order', 'column_name_bytes', 'kind',
+                 'position', 'type')
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    """A migrated database in a temporary directory, made the default one for the test."""
+    previous = db.DB_FILE
+    path = str(tmp_path / 'nosql_viewer.db')
+    db.set_db_file(path)
+    migrate()
+    yield path
+    db.set_db_file(previous)
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    """Sharded storage under the test's temporary directory, for the app built by `client`."""
+    monkeypatch.setenv('SHARDED_STORAGE', 'true')
+    monkeypatch.setenv('SHARD_DIR', str(tmp_path / 'shards'))
+    yield
+    monkeypatch.delenv('SHARDED_STORAGE')
+    monkeypatch.delenv('SHARD_DIR')
+    shards.configure()
+
+
+@pytest.fixture
+def client(db_file, monkeypatch):
+    """A test client of the app on the `db_file` database, without warm-up or scheduled schema syncs."""
+    monkeypatch.setenv('JWT_SECRET_KEY', 'test-secret')
+    monkeypatch.setenv('WARMUP', 'false')
+    monkeypatch.delenv('CASSANDRA_CONTACT_POINTS', raising=False)
+    catalog_cache.clear()
+    app = create_app()
+    yield app.test_client()
+    db.close_connections()
+
+
+@pytest.fixture
+def upload(client):
+    """Upload rows of system_schema.columns as a CSV file, reconciled inside the request (?wait=1)."""
+    def upload(rows, filename='schema.csv'):
+        body = io.StringIO()
+        writer = csv.DictWriter(body, UPLOAD_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return client.post('/api/upload-file?wait=1', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(body.getvalue().encode()), filename)})
+    return upload
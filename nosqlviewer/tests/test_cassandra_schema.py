@@ -0,0 +1,87 @@
+from nosqlviewer.app.services.annotations import COLUMN_ANNOTATIONS, apply_annotations
+import pytest
+
+from nosqlviewer.app.services.cassandra_schema import (InMemorySchemaSource, SchemaSource, SchemaSyncScheduler,
+                                                       sync_schema)
+from nosqlviewer.app.services.db import query_database
+
+
+def _column(name, type='text', kind='regular', position=-1):
+    return {'column_name': name, 'clustering_order': 'none', 'column_name_bytes': '0x' + name.encode().hex(),
+            'kind': kind, 'position': position, 'type': type}
+
+
+def _source():
+    source = InMemorySchemaSource()
+    source.put_table('shop', 'orders', [_column('id', 'uuid', 'partition_key', 0), _column('total', 'decimal')],
+                     comment='Customer orders')
+    source.put_table('shop', 'items', [_column('sku', kind='partition_key', position=0), _column('price', 'decimal')])
+    source.put_table('system_auth', 'roles', [_column('role', kind='partition_key', position=0)])
+    return source
+
+
+def _columns():
+    return {(row['table_name'], row['column_name']): row for row in query_database(
+        'SELECT table_name, column_name, type, note, tag, status FROM columns')}
+
+
+def test_sync_loads_the_cluster_schema(db_file):
+    result = sync_schema(_source(), max_workers=2)
+
+    columns = _columns()
+    assert (result['tables'], result['changed_tables'], result['inserted']) == (2, 2, 4)
+    assert set(columns) == {('orders', 'id'), ('orders', 'total'), ('items', 'sku'), ('items', 'price')}
+    assert columns['orders', 'total']['type'] == 'decimal'
+    # System keyspaces are left out, and a table's comment becomes its description
+    assert query_database("SELECT note FROM table_description WHERE table_name = 'orders'")[0]['note'] == \
+        'Customer orders'
+
+
+def test_unchanged_resync_is_a_no_op(db_file):
+    source = _source()
+    sync_schema(source)
+    batches = query_database('SELECT COUNT(*) AS n FROM ingest_batches')[0]['n']
+
+    result = sync_schema(source)
+
+    assert (result['changed_tables'], result['dropped_tables']) == (0, 0)
+    assert (result['inserted'], result['updated'], result['deleted']) == (0, 0, 0)
+    assert query_database('SELECT COUNT(*) AS n FROM ingest_batches')[0]['n'] == batches
+
+
+def test_resync_applies_changes_and_keeps_annotations(db_file):
+    source = _source()
+    sync_schema(source)
+    apply_annotations(COLUMN_ANNOTATIONS, [{'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': 'total',
+                                            'note': 'Gross amount', 'tag': 'finance'}])
+
+    source.put_table('shop', 'orders', [_column('id', 'uuid', 'partition_key', 0), _column('total', 'varint'),
+                                        _column('placed_at', 'timestamp')])
+    source.drop_table('shop', 'items')
+    result = sync_schema(source)
+
+    columns = _columns()
+    assert (result['inserted'], result['updated'], result['deleted']) == (1, 1, 2)
+    assert (columns['orders', 'total']['type'], columns['orders', 'total']['note'],
+            columns['orders', 'total']['tag']) == ('varint', 'Gross amount', 'finance')
+    assert columns['items', 'sku']['status'] == 'deleted'
+    assert {row['status'] for row in query_database('SELECT status FROM ingest_jobs')} == {'succeeded'}
+
+
+def test_schema_sources_must_implement_every_read():
+    class KeyspacesOnly(SchemaSource):
+        def keyspaces(self):
+            return []
+
+    with pytest.raises(TypeError):
+        KeyspacesOnly()
+
+
+def test_one_worker_syncs_per_scheduled_period(db_file):
+    workers = [SchemaSyncScheduler(_source, interval=60) for _ in range(3)]
+
+    assert [worker.claim_period() for worker in workers] == [True, False, False]
+
+    # Once the period is over, whichever worker wakes first takes the next one
+    query_database("UPDATE catalog_meta SET value = value - 60 WHERE name = 'schema_sync_due'", fetchall=False)
+    assert [worker.claim_period() for worker in reversed(workers)] == [True, False, False]
@@ -0,0 +1,52 @@
+import pytest
+
+from nosqlviewer.app.services.cassandra_schema import InMemorySchemaSource, sync_schema
+
+ROWS = [{'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x00', 'kind': 'regular', 'position': '-1', 'type': 'text'}
+        for column in ('id', 'total')]
+
+
+@pytest.fixture
+def catalog(client, upload):
+    assert upload(ROWS).status_code == 200
+    return client
+
+
+def _etag(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    return response.headers['ETag']
+
+
+def _changes(catalog, upload):
+    """Each kind of catalog write, as functions returning whether it succeeded."""
+    column = {'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': 'id', 'note': 'Key', 'tag': 'pk'}
+    table = {'keyspace_name': 'shop', 'table_name': 'orders', 'note': 'All orders', 'tag': 'sales'}
+    yield lambda: catalog.put('/api/update_column_tag', json=column).status_code == 200
+    yield lambda: catalog.put('/api/update_table_description', json=table).status_code == 200
+    yield lambda: upload([*ROWS, dict(ROWS[0], column_name='placed_at', type='timestamp')]).status_code == 200
+    # Drops placed_at again
+    yield lambda: sync_schema(InMemorySchemaSource(ROWS))['deleted'] == 1
+
+
+def test_unchanged_catalog_answers_304(catalog):
+    etag = _etag(catalog, '/api/get_columns?keyspace_name=shop&table_name=orders')
+
+    response = catalog.get('/api/get_columns?keyspace_name=shop&table_name=orders',
+                           headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_every_kind_of_change_moves_the_etag(catalog, upload):
+    path = '/api/get_columns?keyspace_name=shop&table_name=orders'
+    etags = [_etag(catalog, path)]
+    for change in _changes(catalog, upload):
+        assert change()
+        response = catalog.get(path, headers={'If-None-Match': etags[-1]})
+        assert response.status_code == 200
+        etags.append(response.headers['ETag'])
+    assert len(set(etags)) == len(etags)
@@ -0,0 +1,70 @@
+import gzip
+import json
+
+import pytest
+from werkzeug.http import parse_accept_header
+
+from nosqlviewer.app.services import compression
+
+ROWS = [{'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': f'column_{index}',
+         'clustering_order': 'none', 'column_name_bytes': '0x00', 'kind': 'regular', 'position': '-1',
+         'type': 'text'} for index in range(100)]
+
+
+def _decode(response):
+    body = response.get_data()
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'zstd':
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding == 'br':
+        import brotli
+
+        return brotli.decompress(body)
+    return gzip.decompress(body) if encoding == 'gzip' else body
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', 'gzip'),
+    ('gzip, zstd', 'zstd'),
+    ('zstd;q=0.5, gzip', 'gzip'),
+    ('identity', None),
+    ('', None),
+])
+def test_negotiate_prefers_the_best_accepted_encoding(monkeypatch, header, expected):
+    monkeypatch.setattr(compression, 'ENABLED', True)
+    monkeypatch.setattr(compression, 'available_encodings', lambda: ('zstd', 'br', 'gzip'))
+
+    assert compression.negotiate(parse_accept_header(header)) == expected
+
+
+def test_negotiate_only_offers_installed_codecs(monkeypatch):
+    monkeypatch.setattr(compression, 'ENABLED', True)
+    monkeypatch.setattr(compression, 'available_encodings', lambda: ('gzip',))
+
+    assert compression.negotiate(parse_accept_header('zstd, br')) is None
+    assert compression.negotiate(parse_accept_header('zstd, gzip;q=0.2')) == 'gzip'
+
+
+@pytest.mark.parametrize('path', ['/api/get_columns?keyspace_name=shop&table_name=orders',
+                                  '/api/export/columns?format=ndjson'])
+def test_responses_are_compressed_in_the_negotiated_encoding(client, upload, path):
+    assert upload(ROWS).status_code == 200
+    identity = client.get(path)
+    assert 'Content-Encoding' not in identity.headers
+
+    for encoding in compression.available_encodings():
+        response = client.get(path, headers={'Accept-Encoding': f'identity;q=0.1, {encoding}'})
+        assert response.headers['Content-Encoding'] == encoding
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert _decode(response) == identity.get_data()
+
+
+def test_small_bodies_are_sent_as_is(client, upload):
+    assert upload(ROWS[:1]).status_code == 200
+
+    response = client.get('/api/keyspace_names', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.get_data()) == ['shop']
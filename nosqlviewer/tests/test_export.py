@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+
+import pytest
+
+from nosqlviewer.app.services.db import query_database
+
+ROWS = [{'keyspace_name': keyspace, 'table_name': 'orders', 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x00', 'kind': 'regular', 'position': str(position), 'type': 'text'}
+        for keyspace in ('shop', 'billing') for position, column in enumerate(('id', 'total', 'note, "quoted"'))]
+
+
+@pytest.fixture
+def catalog(client, upload):
+    assert upload(ROWS).status_code == 200
+    return client
+
+
+def _read(fmt, body):
+    if fmt == 'csv':
+        return [dict(row, position=int(row['position'])) for row in csv.DictReader(io.StringIO(body.decode()))]
+    if fmt == 'ndjson':
+        return [json.loads(line) for line in body.decode().splitlines()]
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.ipc.open_stream(body).read_all() if fmt == 'arrow' else pq.read_table(io.BytesIO(body))
+    return table.to_pylist()
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson', 'arrow', 'parquet'])
+def test_export_round_trips_the_table(catalog, fmt):
+    if fmt in ('arrow', 'parquet'):
+        pytest.importorskip('pyarrow')
+
+    response = catalog.get(f'/api/export/columns?format={fmt}&keyspace=shop')
+
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename="columns.{fmt}"'
+    expected = query_database("SELECT * FROM columns WHERE keyspace_name = 'shop' ORDER BY rowid")
+    assert _read(fmt, response.get_data()) == expected
+
+
+def test_export_rejects_unknown_tables_and_filters(catalog):
+    assert catalog.get('/api/export/users').status_code == 400
+    assert catalog.get('/api/export/relations?status=active').status_code == 400
+    assert catalog.get('/api/export/columns?format=xml').status_code == 400
@@ -0,0 +1,33 @@
+from nosqlviewer.app.services.fuzzy import NgramIndex
+
+ROWS = [{'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x00', 'kind': 'regular', 'position': '-1', 'type': 'text'}
+        for column in ('customer_id', 'total_amount', 'placed_at')]
+
+
+def test_ngram_index_ranks_by_word_similarity():
+    index = NgramIndex()
+    for term in ('customer_id', 'customer_name', 'order_total', 'id'):
+        index.add(term)
+
+    matches = index.search('custmer', threshold=0.3)
+
+    assert [term for term, _ in matches] == ['customer_id', 'customer_name']
+    assert index.search('zzz') == []
+
+
+def _fuzzy(client, search, **args):
+    response = client.get('/api/filtered_data', query_string={'search': search, 'mode': 'fuzzy', **args})
+    assert response.status_code == 200
+    return [(row['column_name'], row['similarity']) for row in response.get_json()]
+
+
+def test_fuzzy_search_finds_typos_and_new_columns(client, upload):
+    assert upload(ROWS).status_code == 200
+    assert [name for name, _ in _fuzzy(client, 'totl amount')] == ['total_amount']
+
+    # Columns added by a later upload are indexed on the next search
+    assert _fuzzy(client, 'shiping adress') == []
+    assert upload([*ROWS, dict(ROWS[0], column_name='shipping_address')]).status_code == 200
+    [(name, similarity)] = _fuzzy(client, 'shiping adress')
+    assert name == 'shipping_address' and 0.5 <= similarity < 1
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+from nosqlviewer.app.services.db import query_database, transaction
+from nosqlviewer.app.services.history import compact_update_logs, query_history, start_batch
+
+COLUMN = ('shop', 'orders', 'total', 'none', '0x00', 'regular', -1, 'int', 'no note', 'no tags', 'active')
+
+
+def _ago(days):
+    return (datetime.now() - timedelta(days=days)).isoformat(sep=' ', timespec='milliseconds')
+
+
+def _batch(days_ago):
+    with transaction() as conn:
+        batch_id = start_batch(conn.cursor(), 'upload')
+        conn.execute('UPDATE ingest_batches SET started_at = ? WHERE id = ?', (_ago(days_ago), batch_id))
+    return batch_id
+
+
+def _log(batch_id, days_ago, column_name, existing_data=None, updated_data=None, action='insert'):
+    query_database('''
+        INSERT INTO update_logs (user_name, timestamp, batch_id, action, keyspace_name, table_name, column_name,
+                                 changes, existing_data, updated_data)
+        VALUES ('admin', ?, ?, ?, 'shop', 'orders', ?, ?, ?, ?)
+    ''', (_ago(days_ago), batch_id, None if existing_data or updated_data else action, column_name,
+          None if existing_data or updated_data else '{}', existing_data, updated_data), fetchall=False)
+
+
+def _logged():
+    return sorted(row['column_name'] for row in query_database('SELECT column_name FROM update_logs'))
+
+
+def test_retention_by_age_and_by_batch(db_file):
+    old, previous, latest = _batch(100), _batch(2), _batch(1)
+    _log(old, 100, 'old')
+    _log(previous, 2, 'previous')
+    _log(latest, 1, 'latest')
+    _log(None, 100, 'unbatched_old')
+    _log(None, 1, 'unbatched')
+
+    assert compact_update_logs(max_age_days=30)['deleted'] == 2
+    assert _logged() == ['latest', 'previous', 'unbatched']
+
+    # Entries outside the newest batches go; those of no batch are only subject to the age limit
+    assert compact_update_logs(keep_batches=1)['deleted'] == 1
+    assert _logged() == ['latest', 'unbatched']
+    assert [row['id'] for row in query_database('SELECT id FROM ingest_batches')] == [latest]
+
+
+def test_legacy_entries_become_json_diffs(db_file):
+    retyped = COLUMN[:7] + ('bigint',) + COLUMN[8:]
+    _log(None, 1, None, 'None', str(COLUMN))
+    _log(None, 1, None, str(COLUMN), str(retyped))
+    _log(None, 1, None, str(retyped), 'none')
+    _log(None, 1, None, str(('shop', 'orders', 'no note', 'no tag')), str(('shop', 'orders', 'Orders', 'sales')))
+    _log(None, 1, None, 'garbled', 'text')
+
+    assert compact_update_logs() == {'deleted': 0, 'restructured': 4}
+
+    entries, _ = query_history(limit=10)
+    inserted, updated, deleted, described, garbled = reversed(entries)
+    assert (inserted['action'], inserted['column_name']) == ('insert', 'total')
+    assert inserted['changes']['type'] == [None, 'int']
+    assert (updated['action'], updated['changes']) == ('update', {'type': ['int', 'bigint']})
+    assert (deleted['action'], deleted['changes']) == ('delete', {'status': ['active', 'deleted']})
+    assert (described['column_name'], described['changes']) == (None, {'note': ['no note', 'Orders'],
+                                                                      'tag': ['no tag', 'sales']})
+    assert 'existing_data' not in inserted
+    # Entries that cannot be parsed are kept as they are
+    assert (garbled['changes'], garbled['existing_data']) == (None, 'garbled')
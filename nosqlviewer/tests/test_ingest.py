@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+from nosqlviewer.app.services.annotations import COLUMN_ANNOTATIONS, apply_annotations
+from nosqlviewer.app.services.cassandra_schema import InMemorySchemaSource, sync_schema
+from nosqlviewer.app.services.db import query_database
+from nosqlviewer.app.services.ingest import normalize_row, process_csv_data, process_runs, table_runs
+
+ROWS = [{'keyspace_name': 'shop', 'table_name': table, 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x' + column.encode().hex(), 'kind': 'regular', 'position': '-1', 'type': 'text'}
+        for table, columns in (('orders', ('id', 'total')), ('items', ('sku', 'price'))) for column in columns]
+
+
+def _per_row_reconcile(stored, csv_data):
+    """The row by row reconciliation uploads were first made with, over a dict of `columns` tuples."""
+    stored = dict(stored)
+    seen = set()
+    for row in csv_data:
+        values = [row.get(field, '').strip() for field in ('keyspace_name', 'table_name', 'column_name',
+                                                          'clustering_order', 'column_name_bytes', 'kind')]
+        try:
+            position = int(row.get('position', ''))
+        except (ValueError, TypeError):
+            position = 0
+        values += [position, row.get('type', '').strip(), row.get('note', 'no note').strip() or 'no note',
+                   row.get('tag', 'no tags').strip() or 'no tags']
+        key = tuple(values[:3])
+        if not all(key):
+            continue
+        seen.add(key)
+        status = row.get('status', 'active').strip() or 'active'
+        if key not in stored or stored[key][3:] != (*values[3:], status):
+            stored[key] = (*values, 'active')
+    for key, row in stored.items():
+        if key not in seen:
+            stored[key] = (*row[:-1], 'deleted')
+    return stored
+
+
+def _random_export(rng):
+    rows = []
+    for keyspace in rng.sample(['shop', 'billing', 'audit'], rng.randint(1, 3)):
+        for table in rng.sample(['orders', 'items', 'users'], rng.randint(1, 3)):
+            for column in rng.sample(['id', 'total', 'sku', 'name', 'created'], rng.randint(1, 5)):
+                row = {'keyspace_name': keyspace, 'table_name': table, 'column_name': column,
+                       'clustering_order': rng.choice(['none', 'asc']), 'column_name_bytes': '0x00',
+                       'kind': rng.choice(['regular', 'partition_key']),
+                       'position': rng.choice(['-1', '0', '2', '+3', 'x', '']),
+                       'type': rng.choice(['text', 'int', 'bigint'])}
+                if rng.random() < 0.2:
+                    row['note'] = rng.choice(['', 'Primary key', 'Gross amount'])
+                rows.append(row)
+    rows.append({'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': ''})
+    if rng.random() < 0.5:
+        rng.shuffle(rows)
+    return rows
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_set_based_reconcile_matches_the_per_row_one(db_file, seed):
+    rng = random.Random(seed)
+    expected = {}
+    for _ in range(8):
+        export = _random_export(rng)
+        # Re-uploading the same export now and then exercises the unchanged-table skip
+        for _ in range(rng.choice([1, 1, 2])):
+            process_csv_data(export)
+            expected = _per_row_reconcile(expected, export)
+        stored = query_database('SELECT * FROM columns')
+        assert {tuple(row.values())[:3]: tuple(row.values()) for row in stored} == expected
+
+
+def _fingerprint_sources():
+    return sorted((row['table_name'], row['source']) for row in query_database(
+        'SELECT table_name, source FROM table_fingerprints'))
+
+
+def test_reupload_skips_unchanged_tables(db_file):
+    process_csv_data(ROWS)
+    counts = process_csv_data(ROWS)
+
+    assert (counts['changed_tables'], counts['inserted'], counts['updated'], counts['deleted']) == (0, 0, 0, 0)
+
+
+def test_uploads_and_schema_syncs_keep_their_own_fingerprints(db_file):
+    source = InMemorySchemaSource(ROWS)
+    process_csv_data(ROWS)
+    assert sync_schema(source)['inserted'] == 0
+
+    # Neither source invalidates the other's fingerprints when nothing changed
+    assert _fingerprint_sources() == [('items', 'schema-sync'), ('items', 'upload'),
+                                      ('orders', 'schema-sync'), ('orders', 'upload')]
+    assert process_csv_data(ROWS)['changed_tables'] == 0
+    assert sync_schema(source)['changed_tables'] == 0
+
+    # A column inserted by one source invalidates the table for the other
+    source.put_table('shop', 'items', [*ROWS[2:], dict(ROWS[3], column_name='stock')])
+    assert sync_schema(source)['inserted'] == 1
+    assert ('items', 'upload') not in _fingerprint_sources()
+    assert process_csv_data(ROWS)['deleted'] == 1
+
+
+def test_table_edited_while_the_upload_is_read_keeps_the_edit(db_file):
+    process_csv_data(ROWS)
+    edit = {'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': 'total', 'note': 'Gross amount',
+            'tag': 'finance'}
+
+    def runs():
+        yield from table_runs(filter(None, map(normalize_row, ROWS)))
+        # Annotated after the upload found the table unchanged, before it takes the write lock
+        apply_annotations(COLUMN_ANNOTATIONS, [edit])
+
+    counts = process_runs(runs())
+
+    note = query_database("SELECT note FROM columns WHERE table_name = 'orders' AND column_name = 'total'")
+    assert (counts['changed_tables'], counts['edited_tables'], counts['updated']) == (0, 1, 0)
+    assert note[0]['note'] == 'Gross amount'
+    assert ('orders', 'upload') not in _fingerprint_sources()
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+
+import pytest
+
+from nosqlviewer.app.services import jobs
+from nosqlviewer.app.services.db import query_database
+from nosqlviewer.app.services.ingest import process_csv_data
+
+
+def _counts(rows=0):
+    return {'rows': rows, 'inserted': 0, 'updated': 0, 'deleted': 0, 'timings': {}}
+
+
+def _running_job(db_file, heartbeat_age=0):
+    job_id = jobs._create_job(db_file, 'other.csv', 'admin')
+    now = time.time()
+    query_database("UPDATE ingest_jobs SET status = 'running', started_at = ?, heartbeat_at = ? WHERE id = ?",
+                   (now, now - heartbeat_age, job_id), fetchall=False)
+    return job_id
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(jobs, 'HEARTBEAT_INTERVAL', 0.01)
+
+
+def test_run_ingestion_records_a_succeeded_job(db_file):
+    rows = [{'keyspace_name': 'ks', 'table_name': 't', 'column_name': f'c{i}'} for i in range(3)]
+    counts = jobs.run_ingestion(lambda progress: process_csv_data(rows, progress=progress), 'schema.csv')
+
+    job = query_database('SELECT * FROM ingest_jobs')[0]
+    assert counts['inserted'] == 3
+    assert (job['status'], job['filename'], job['rows_processed'], job['inserted']) == ('succeeded', 'schema.csv', 3, 3)
+
+
+def test_claim_waits_for_the_running_job(db_file):
+    other = _running_job(db_file)
+    started = threading.Event()
+    claimed = []
+
+    def work(progress):
+        claimed.append(time.time())
+        return _counts()
+
+    thread = threading.Thread(target=lambda: (started.set(), jobs.run_ingestion(work, db_file=db_file)))
+    thread.start()
+    started.wait()
+    time.sleep(0.2)
+    assert not claimed
+    released = time.time()
+    query_database("UPDATE ingest_jobs SET status = 'succeeded' WHERE id = ?", (other,), fetchall=False)
+    thread.join(5)
+    assert claimed and claimed[0] >= released
+
+
+def test_stale_job_is_taken_over(db_file):
+    _running_job(db_file, heartbeat_age=jobs.STALE_AFTER + 1)
+
+    assert jobs.run_ingestion(lambda progress: _counts(5)) == _counts(5)
+
+
+def test_heartbeat_is_refreshed_while_work_reports_no_progress(db_file):
+    def work(progress):
+        job = query_database("SELECT id, heartbeat_at FROM ingest_jobs WHERE status = 'running'")[0]
+        time.sleep(0.2)
+        heartbeat = query_database('SELECT heartbeat_at FROM ingest_jobs WHERE id = ?', (job['id'],))[0]
+        assert heartbeat['heartbeat_at'] > job['heartbeat_at']
+        return _counts()
+
+    jobs.run_ingestion(work)
+
+
+def test_failed_ingestion_is_recorded_and_releases_the_claim(db_file):
+    def work(progress):
+        raise ValueError('broken upload')
+
+    with pytest.raises(ValueError):
+        jobs.run_ingestion(work, 'broken.csv')
+
+    job = query_database('SELECT status, error, finished_at FROM ingest_jobs')[0]
+    assert (job['status'], job['error']) == ('failed', 'broken upload')
+    assert job['finished_at'] is not None
+    # The next ingestion is not kept waiting by the failed one
+    assert jobs.run_ingestion(lambda progress: _counts(1))['rows'] == 1
+
+
+def test_background_job_failure(db_file):
+    job_id = jobs.submit_ingestion([b'not,a\ncsv'], 'schema.txt')
+    for _ in range(500):
+        job = jobs.get_job(job_id)
+        if job['status'] in ('succeeded', 'failed'):
+            break
+        time.sleep(0.01)
+    assert job['status'] == 'failed'
+    assert 'Only CSV' in job['error']
+
+
+def _orphan(db_file, status, upload=None):
+    """A job left `status` by a process that exited, with its upload file if `upload` is given."""
+    path = None
+    if upload is not None:
+        path = os.path.join(jobs.upload_dir(db_file), 'orphan.upload')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(upload)
+    job_id = jobs._create_job(db_file, 'schema.csv', 'admin', path)
+    jobs._queued.pop(job_id)
+    stale = time.time() - jobs.STALE_AFTER - 1
+    query_database('UPDATE ingest_jobs SET status = ?, heartbeat_at = ? WHERE id = ?', (status, stale, job_id),
+                   fetchall=False)
+    return job_id, path
+
+
+def _wait_for(job_id):
+    for _ in range(500):
+        job = jobs.get_job(job_id)
+        if job['status'] in ('succeeded', 'failed'):
+            return job
+        time.sleep(0.01)
+    return job
+
+
+def test_recovery_fails_dead_jobs_and_requeues_orphaned_uploads(db_file):
+    running, _ = _orphan(db_file, 'running')
+    lost, _ = _orphan(db_file, 'queued')
+    orphaned, path = _orphan(db_file, 'queued', b'keyspace_name,table_name,column_name\nshop,orders,id\n')
+    live = jobs._create_job(db_file, 'other.csv', 'admin')
+
+    assert jobs.recover_jobs() == [orphaned]
+
+    assert _wait_for(orphaned)['status'] == 'succeeded'
+    assert not os.path.exists(path)
+    assert query_database('SELECT column_name FROM columns') == [{'column_name': 'id'}]
+    statuses = {row['id']: (row['status'], row['error']) for row in query_database(
+        'SELECT id, status, error FROM ingest_jobs WHERE id IN (?, ?, ?)', (running, lost, live))}
+    assert statuses[running][0] == statuses[lost][0] == 'failed'
+    assert 'exited' in statuses[running][1] and 'exited' in statuses[lost][1]
+    assert statuses[live] == ('queued', None)
+
+
+def test_polling_a_dead_job_settles_it(db_file):
+    job_id, _ = _orphan(db_file, 'running')
+
+    job = jobs.get_job(job_id)
+
+    assert job['status'] == 'failed'
+    assert job['finished_at'] is not None
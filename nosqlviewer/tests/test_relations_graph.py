@@ -0,0 +1,43 @@
+import copy
+
+from nosqlviewer.app.services.db import query_database
+from nosqlviewer.app.services.relations_graph import RelationsGraph
+
+
+def _relate(source, target, published='yes'):
+    query_database('''
+        INSERT INTO relations (from_keyspace, from_table, from_column, to_keyspace, to_table, to_column, is_published)
+        VALUES (?, ?, 'id', ?, ?, 'id', ?)
+    ''', (*source, *target, published), fetchall=False)
+
+
+def test_lineage_paths_and_components(db_file):
+    _relate(('shop', 'orders'), ('billing', 'invoices'))
+    _relate(('billing', 'invoices'), ('audit', 'ledger'), published='no')
+    _relate(('hr', 'staff'), ('hr', 'payroll'))
+    graph = RelationsGraph(db_file).refresh()
+
+    nodes, _ = graph.traverse(('shop', 'orders'), depth=5)
+    assert nodes == {('shop', 'orders'): 0, ('billing', 'invoices'): 1, ('audit', 'ledger'): 2}
+    nodes, _ = graph.traverse(('shop', 'orders'), depth=5, published=True)
+    assert ('audit', 'ledger') not in nodes
+    assert len(graph.shortest_path(('shop', 'orders'), ('audit', 'ledger'))) == 2
+    assert graph.shortest_path(('audit', 'ledger'), ('shop', 'orders')) is None
+    assert [len(component) for component in graph.components()] == [3, 2]
+
+
+def test_refresh_leaves_the_version_being_read_untouched(db_file):
+    _relate(('shop', 'orders'), ('billing', 'invoices'))
+    graph = RelationsGraph(db_file).refresh()
+    index = graph.index
+    before = copy.deepcopy(vars(index))
+
+    # A relation saved meanwhile, by this worker or another, from the same table
+    _relate(('shop', 'orders'), ('audit', 'ledger'))
+    graph.refresh()
+
+    assert vars(index) == before
+    assert graph.index is not index
+    assert len(graph.index.forward[('shop', 'orders')]) == 2
+    nodes, _ = graph.traverse(('shop', 'orders'))
+    assert ('audit', 'ledger') in nodes
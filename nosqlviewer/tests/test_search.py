@@ -0,0 +1,63 @@
+import pytest
+
+COLUMNS = ('id', 'total', 'customer_id', 'placed_at', 'shipping_address', 'status_code')
+ROWS = [{'keyspace_name': 'shop', 'table_name': table, 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x00', 'kind': 'regular', 'position': '-1', 'type': 'text'}
+        for table in ('orders', 'returns') for column in COLUMNS]
+
+
+@pytest.fixture
+def catalog(client, upload):
+    assert upload(ROWS).status_code == 200
+    return client
+
+
+def _search(client, search, **args):
+    response = client.get('/api/filtered_data', query_string={'search': search, **args})
+    assert response.status_code == 200
+    return response
+
+
+def _columns(response):
+    return sorted((row['table_name'], row['column_name']) for row in response.get_json())
+
+
+def test_search_follows_annotation_edits(catalog):
+    assert _columns(_search(catalog, 'revenue')) == []
+
+    edit = {'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': 'total', 'note': 'Gross revenue',
+            'tag': 'finance'}
+    assert catalog.put('/api/update_column_tag', json=edit).status_code == 200
+    assert _columns(_search(catalog, 'revenue')) == [('orders', 'total')]
+
+    edit['note'] = 'Gross amount'
+    assert catalog.put('/api/update_column_tag', json=edit).status_code == 200
+    assert _columns(_search(catalog, 'revenue')) == []
+    assert _columns(_search(catalog, 'amount fin')) == [('orders', 'total')]
+
+
+def test_search_follows_table_descriptions(catalog):
+    table = {'keyspace_name': 'shop', 'table_name': 'returns', 'note': 'Refunded orders', 'tag': 'warehouse'}
+    assert catalog.put('/api/update_table_description', json=table).status_code == 200
+
+    assert _columns(_search(catalog, 'warehouse')) == [('returns', column) for column in sorted(COLUMNS)]
+
+
+def test_short_terms_fall_back_to_a_scan(catalog):
+    assert _columns(_search(catalog, 'id')) == [(table, column) for table in ('orders', 'returns')
+                                                for column in ('customer_id', 'id')]
+
+
+@pytest.mark.parametrize('search', ['_id', 'shop', ''])
+def test_after_cursor_pages_through_every_match(catalog, search):
+    everything = _columns(_search(catalog, search, limit=100))
+    seen, after = [], None
+    while True:
+        response = _search(catalog, search, limit=2, **({'after': after} if after else {}))
+        seen += _columns(response)
+        after = response.headers.get('X-Next-After')
+        if not after:
+            break
+
+    assert everything
+    assert sorted(seen) == everything
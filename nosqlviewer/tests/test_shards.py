@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from nosqlviewer.app.services import shards
+
+ROWS = [{'keyspace_name': keyspace, 'table_name': 'orders', 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x' + column.encode().hex(), 'kind': 'regular', 'position': '-1', 'type': 'text'}
+        for keyspace in ('shop', 'billing') for column in ('id', 'total')]
+
+
+@pytest.fixture
+def sharded_client(sharded, client, upload):
+    assert shards.ENABLED
+    assert upload(ROWS).status_code == 200
+    return client
+
+
+def test_relations_export_reads_the_main_database(sharded_client):
+    relation = {'from_keyspace': 'shop', 'from_table': 'orders', 'from_column': 'id', 'to_keyspace': 'billing',
+                'to_table': 'orders', 'to_column': 'id', 'is_published': 'yes'}
+    assert sharded_client.post('/api/save_relation', json=relation).status_code == 201
+
+    for query in ('', '?keyspace=shop'):
+        response = sharded_client.get(f'/api/export/relations{query}')
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [row['to_keyspace'] for row in rows] == ['billing']
+
+    # Columns come from the keyspace's shard
+    response = sharded_client.get('/api/export/columns?keyspace=billing')
+    assert response.get_data(as_text=True).count('"billing"') == 2
+    assert sharded_client.get('/api/export/columns').status_code == 400
+
+
+def test_compacting_history_covers_every_shard(sharded_client, upload):
+    retyped = [dict(row, type='bigint') if row['column_name'] == 'id' else row for row in ROWS]
+    counts = upload(retyped).get_json()['counts']
+    assert counts['batch_id'] is None
+    assert sorted(counts['batch_ids']) == ['billing', 'shop']
+
+    response = sharded_client.post('/api/history/compact', json={'keep_batches': 1})
+
+    # The first upload's inserts are gone from both shards, the type changes of the second one are kept
+    assert response.get_json()['deleted'] == 4
+    for keyspace in ('billing', 'shop'):
+        entries = sharded_client.get(f'/api/history?keyspace_name={keyspace}').get_json()['data']
+        batch_id = counts['batch_ids'][keyspace]
+        assert [(entry['action'], entry['batch_id']) for entry in entries] == [('update', batch_id)]
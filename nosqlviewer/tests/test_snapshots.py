@@ -0,0 +1,38 @@
+import pytest
+
+
+def _rows(keyspace, table, *columns, type='text'):
+    return [{'keyspace_name': keyspace, 'table_name': table, 'column_name': column, 'clustering_order': 'none',
+             'column_name_bytes': '0x00', 'kind': 'regular', 'position': '-1', 'type': type} for column in columns]
+
+
+@pytest.fixture(params=['single', 'sharded'])
+def storage(request):
+    # Sharded manifests are read from each keyspace's shard
+    if request.param == 'sharded':
+        request.getfixturevalue('sharded')
+
+
+def test_diff_reports_dropped_and_changed_tables(storage, client, upload):
+    first = upload([*_rows('shop', 'orders', 'id', 'total'), *_rows('shop', 'items', 'sku'),
+                    *_rows('billing', 'invoices', 'id')]).get_json()['counts']
+    second = upload([*_rows('shop', 'orders', 'id'), *_rows('shop', 'orders', 'total', type='bigint'),
+                     *_rows('shop', 'orders', 'placed_at')]).get_json()['counts']
+    assert first['snapshot_id'] != second['snapshot_id']
+
+    diff = client.get(f"/api/snapshots/diff?from={first['snapshot_id']}").get_json()
+
+    assert diff['to']['id'] == second['snapshot_id']
+    assert diff['summary'] == {'tables_added': 0, 'tables_removed': 2, 'tables_changed': 1, 'columns_added': 1,
+                               'columns_removed': 0, 'columns_changed': 1}
+    assert sorted((table['keyspace_name'], table['table_name']) for table in diff['tables']['removed']) == [
+        ('billing', 'invoices'), ('shop', 'items')]
+    [orders] = diff['tables']['changed']
+    assert orders['columns']['changed'] == [{'column_name': 'total', 'changes': {'type': ['text', 'bigint']}}]
+    assert [column['column_name'] for column in orders['columns']['added']] == ['placed_at']
+
+    # Re-uploading the same schema records no new snapshot, and a diff with itself is empty
+    assert upload([*_rows('shop', 'orders', 'id'), *_rows('shop', 'orders', 'total', type='bigint'),
+                   *_rows('shop', 'orders', 'placed_at')]).get_json()['counts']['snapshot_id'] == second['snapshot_id']
+    same = client.get(f"/api/snapshots/diff?from={second['snapshot_id']}&to={second['snapshot_id']}").get_json()
+    assert not any(same['summary'].values())
@@ -0,0 +1,50 @@
+import pytest
+
+ROWS = [{'keyspace_name': 'shop', 'table_name': table, 'column_name': column, 'clustering_order': 'none',
+         'column_name_bytes': '0x00', 'kind': kind, 'position': '-1', 'type': type}
+        for table in ('orders', 'items')
+        for column, kind, type in (('id', 'partition_key', 'uuid'), ('total', 'regular', 'int'),
+                                   ('placed_at', 'clustering', 'timestamp'))]
+
+
+@pytest.fixture
+def catalog(client, upload):
+    assert upload(ROWS).status_code == 200
+    return client
+
+
+def _stats(client, **args):
+    response = client.get('/api/stats', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_stats_after_upload(catalog):
+    stats = _stats(catalog)
+
+    expected = {'keyspaces': 1, 'tables': 2, 'columns': 6, 'partition_keys': 2, 'clustering_keys': 2,
+                'regular_columns': 2}
+    assert {field: stats['totals'][field] for field in expected} == expected
+    assert stats['types'] == {'int': 2, 'timestamp': 2, 'uuid': 2}
+
+
+def test_stats_follow_annotations_and_dropped_columns(catalog, upload):
+    column = {'keyspace_name': 'shop', 'table_name': 'orders', 'column_name': 'total', 'note': 'Gross amount',
+              'tag': 'finance'}
+    table = {'keyspace_name': 'shop', 'table_name': 'items', 'note': 'Order lines', 'tag': 'no tag'}
+    assert catalog.put('/api/update_column_tag', json=column).status_code == 200
+    assert catalog.put('/api/update_table_description', json=table).status_code == 200
+
+    totals = _stats(catalog)['totals']
+    assert (totals['noted_columns'], totals['tagged_columns'], totals['described_tables'],
+            totals['tagged_tables']) == (1, 1, 1, 0)
+    tables = {row['table_name']: row for row in _stats(catalog, keyspace_name='shop')['tables']}
+    assert (tables['orders']['noted_columns'], tables['items']['described']) == (1, 1)
+
+    # Clearing the note takes it off again; a re-upload without the column drops its counts
+    assert catalog.put('/api/update_column_tag', json=dict(column, note='no note')).status_code == 200
+    assert _stats(catalog)['totals']['noted_columns'] == 0
+    assert upload([row for row in ROWS if row['column_name'] != 'total']).status_code == 200
+    stats = _stats(catalog)
+    assert (stats['totals']['columns'], stats['totals']['tagged_columns']) == (4, 0)
+    assert 'int' not in stats['types']
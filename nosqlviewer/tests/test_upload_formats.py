@@ -0,0 +1,29 @@
+import io
+
+import pytest
+
+from nosqlviewer.app.services.upload_formats import _fallback_rows, read_upload
+
+POSITIONS = ['7', '+7', '-7', '007', '+007', '-0', ' 3 ', '', 'x', '1.5', '9223372036854775807',
+             '9223372036854775808', '-9223372036854775808', '-9223372036854775809', '99999999999999999999999']
+
+
+def _upload(positions):
+    lines = ['keyspace_name,table_name,column_name,kind,position,type']
+    lines += [f'shop,orders,c{index},regular,{position},text' for index, position in enumerate(positions)]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def _arrow_rows(body):
+    return [row for _, _, run in read_upload(io.BytesIO(body), 'csv') for row in run]
+
+
+def test_arrow_and_stdlib_parsers_read_positions_alike():
+    pytest.importorskip('pyarrow')
+    body = _upload(POSITIONS)
+
+    arrow_rows = _arrow_rows(body)
+    stdlib_rows = list(_fallback_rows(io.BytesIO(body), 'csv'))
+
+    assert arrow_rows == stdlib_rows
+    assert [row[6] for row in arrow_rows] == [7, 7, -7, 7, 7, 0, 3, 0, 0, 0, 2 ** 63 - 1, 0, -2 ** 63, 0, 0]